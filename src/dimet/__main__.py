@@ -26,10 +26,11 @@ def main_run_analysis(cfg: DictConfig) -> None:
 
     dataset: Dataset = Dataset(
         config=hydra.utils.instantiate(cfg.analysis.dataset))
-    dataset.preload()
-    dataset.split_datafiles_by_compartment()
     method: Method = hydra.utils.instantiate(
         cfg.analysis.method).build()  # method factory
+    # only the data files used by the method are read beforehand
+    dataset.preload(datatypes=method.get_datatypes(cfg))
+    dataset.split_datafiles_by_compartment()
 
     method.run(cfg, dataset)
 
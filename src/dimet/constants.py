@@ -25,7 +25,16 @@ data_files_keys_type = Literal[
     "isotopologues",
 ]
 
-supported_file_extension = ["csv", "tsv"]
+# in increasing order of preference when several files have the same name
+supported_file_extension = ["csv.gz", "tsv.gz", "csv", "tsv"]
+
+max_threads_loading_files = 8  # data files read concurrently
+
+# metadata columns of the keys of the metadata index (see index_metadata)
+metadata_index_columns = ["compartment", "condition", "timepoint"]
+
+# metadata columns loaded as categoricals by the compact_dtypes option
+metadata_categorical_columns = ["condition", "timepoint", "compartment"]
 
 availtest_methods = ["MW", "KW", "ranksum", "Wcox", "Tt", "BrMu", "prm-scipy",
                      "disfit", "none"]
@@ -1,17 +1,27 @@
+import hashlib
+import importlib.util
+import json
 import logging
 import os
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Literal, Optional, Set
+from typing import Dict, Iterable, List, Literal, Optional, Set, Tuple
 
+import numpy as np
 import pandas as pd
 from hydra.core.hydra_config import HydraConfig
-from omegaconf import DictConfig, ListConfig
+from omegaconf import DictConfig, ListConfig, OmegaConf
 from pydantic import BaseModel as PydanticBaseModel
 
-from dimet.constants import molecular_types_for_metabologram
-from dimet.helpers import (df_to_dict_by_compartment,
-                           drop_all_nan_metabolites_on_comp_frames,
-                           extfind, set_samples_names,
+from dimet.constants import (data_files_keys, max_threads_loading_files,
+                             metadata_categorical_columns,
+                             molecular_types_for_metabologram)
+from dimet.helpers import (extfind, index_folder_files, index_isotopologues,
+                           index_metadata, metadata_rows,
+                           split_samples_by_compartment,
                            verify_metadata_sample_not_duplicated,
                            message_bad_separator_input)
 
@@ -24,6 +34,151 @@ class BaseModel(PydanticBaseModel):
 logger = logging.getLogger(__name__)
 
 
+def get_csv_engine() -> str:
+    """the pyarrow parser of pandas if pyarrow is installed, else 'c'"""
+    if importlib.util.find_spec("pyarrow") is not None:
+        return "pyarrow"
+    return "c"
+
+
+def memory_usage_mb(df: Optional[pd.DataFrame]) -> float:
+    if df is None:
+        return 0.0
+    return df.memory_usage(index=True, deep=True).sum() / 1024 ** 2
+
+
+def write_memmap_frame(df: pd.DataFrame, columns: List[str],
+                       file_path: str, chunk_columns: int = 64) -> None:
+    """
+    Writes the values of the columns of df to the .npy file_path, and the
+    index and the columns to the .json sidecar. Both are written to unique
+    temporary files first, and the .npy is moved in place last, so that a
+    .npy file always has a matching sidecar
+    """
+    folder = os.path.dirname(file_path)
+    temp_files = []
+    try:
+        fd, json_temp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        temp_files.append(json_temp)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"index": df.index.tolist(),
+                       "index_name": df.index.name,
+                       "columns": list(columns)}, f)
+        fd, npy_temp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        temp_files.append(npy_temp)
+        os.close(fd)
+        values = np.lib.format.open_memmap(
+            npy_temp, mode="w+", dtype=df.dtypes.iloc[0],
+            shape=(df.shape[0], len(columns)))
+        for start in range(0, len(columns), chunk_columns):
+            chunk = columns[start:start + chunk_columns]
+            values[:, start:start + len(chunk)] = df[chunk].to_numpy()
+        values.flush()
+        del values
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+        os.replace(json_temp, file_path + ".json")
+        os.replace(npy_temp, file_path)
+    finally:
+        for temp_file in temp_files:
+            if os.path.isfile(temp_file):
+                os.remove(temp_file)
+
+
+def is_memmap_folder(folder: str, other_files: Iterable[str] = ()) -> bool:
+    """
+    True if folder is a non-empty directory containing only the .npy files
+    written by write_memmap_frame, their .json sidecars and the other_files
+    (which must all be there)
+    """
+    if os.path.islink(folder) or not os.path.isdir(folder):
+        return False
+    file_names = set(os.listdir(folder))
+    npy_names = {name for name in file_names if name.endswith(".npy")}
+    expected = npy_names | {name + ".json" for name in npy_names} | \
+        set(other_files)
+    return len(expected) > 0 and file_names == expected and \
+        all(os.path.isfile(os.path.join(folder, name))
+            for name in file_names)
+
+
+def remove_outdated_folders(parent: str, label: str, current: str,
+                            other_files: Iterable[str] = ()) -> None:
+    """
+    Removes the folders <label>-<key> of parent, other than current, that
+    only contain frames written by write_memmap_frame and the other_files
+    (see is_memmap_folder): the folders of the outdated inputs of a dataset
+    """
+    for folder_name in os.listdir(parent):
+        folder = os.path.join(parent, folder_name)
+        if folder == current or not re.fullmatch(
+                rf"{re.escape(label)}-[0-9a-f]{{64}}", folder_name) or \
+                not is_memmap_folder(folder, other_files):
+            continue
+        try:
+            for file_name in os.listdir(folder):
+                os.remove(os.path.join(folder, file_name))
+            os.rmdir(folder)
+        except OSError as e:
+            logger.warning(f"Could not remove the outdated {folder}: {e}")
+
+
+def read_memmap_frame(file_path: str, mmap_mode: Optional[str] = "c"
+                      ) -> Optional[pd.DataFrame]:
+    """
+    DataFrame backed by the memory-mapped .npy file_path (copy-on-write:
+    the file is never modified; mmap_mode=None reads the values in memory),
+    None if there is no such file
+    """
+    if not os.path.isfile(file_path):
+        return None
+    with open(file_path + ".json") as f:
+        sidecar = json.load(f)
+    values = np.load(file_path, mmap_mode=mmap_mode)
+    return pd.DataFrame(values, index=pd.Index(sidecar["index"],
+                                               name=sidecar["index_name"]),
+                        columns=sidecar["columns"], copy=False)
+
+
+def get_compartments_layout(frames: Dict[str, pd.DataFrame]) -> Dict:
+    """the rows and the columns of the compartment dataframes"""
+    return {compartment: {"rows": df.index.tolist(),
+                          "columns": df.columns.tolist()}
+            for compartment, df in frames.items()}
+
+
+def frame_to_json(df: pd.DataFrame) -> Dict:
+    """
+    The values, dtypes and categories (of the categorical columns) of the
+    small dataframe df as plain data, see frame_from_json
+    """
+    return {
+        "index": None if df.index.equals(pd.RangeIndex(len(df)))
+        else df.index.tolist(),
+        "columns": df.columns.tolist(),
+        "values": [df[column].tolist() for column in df.columns],
+        "dtypes": [str(dtype) for dtype in df.dtypes],
+        "categories": {
+            column: df[column].cat.categories.tolist()
+            for column in df.columns
+            if isinstance(df[column].dtype, pd.CategoricalDtype)}}
+
+
+def frame_from_json(data: Dict) -> pd.DataFrame:
+    """the dataframe written as plain data by frame_to_json"""
+    df = pd.DataFrame(dict(zip(data["columns"], data["values"])),
+                      columns=data["columns"])
+    for column, dtype in zip(data["columns"], data["dtypes"]):
+        if column in data["categories"]:
+            df[column] = pd.Categorical(
+                df[column], categories=data["categories"][column])
+        else:
+            df[column] = df[column].astype(dtype)
+    if data["index"] is not None:
+        df.index = data["index"]
+    return df
+
+
 class DatasetConfig(BaseModel):
     label: str
     name: str
@@ -39,6 +194,23 @@ class DatasetConfig(BaseModel):
     mean_enrichment: str = "MeanEnrichment13C"
     isotopologue_proportions: str = "IsotopologuesProportions"
     isotopologues: str = "Isotopologues"  # isotopologue absolute values
+    # directory (absolute, or relative to the data subfolder) of the cache
+    # of the loaded and compartmentalized data (.npy matrices and plain
+    # data, see save_to_cache); None: no cache
+    cache_dir: Optional[str] = None
+    # low-memory loading: quantification values parsed as float32,
+    # metadata_categorical_columns as categoricals, faster csv engine
+    # (pyarrow) if available
+    compact_dtypes: bool = False
+    # number of rows of the quantification files parsed at once: the rows
+    # having NaN in all the values, and the columns that are not samples of
+    # the metadata, are dropped from each chunk; None: read at once
+    chunk_rows: Optional[int] = None
+    # directory (absolute, or relative to the data subfolder) of the
+    # memory-mapped quantification matrices; None: data in memory.
+    # The maps are reused while the inputs are unchanged (the cache,
+    # cache_dir, is not used with this backend)
+    memmap_dir: Optional[str] = None
 
     def build(self) -> "Dataset":
         return Dataset(config=self)
@@ -58,13 +230,29 @@ class Dataset(BaseModel):
             "isotopologue_proportions", "isotopologues"]
     ] = set()
     compartmentalized_dfs: Dict[str, Dict[str, pd.DataFrame]] = {}
-
-    def preload(self):
+    loaded_from_cache: bool = False
+    # data files not read yet (see preload), read at the first access
+    # (see get_compartmentalized_dfs)
+    deferred_datasets: Set[str] = set()
+    compartments_split: bool = False
+    # {file name : extension} of the data subfolder, see get_files_index
+    files_index: Optional[Dict[str, str]] = None
+    # memory-mapped backend (see memmap_dir): folder of the maps of the
+    # current inputs, and data files served by the maps
+    memmap_folder: Optional[str] = None
+    memmapped_datasets: Set[str] = set()
+    # rows of metadata_df by (compartment, condition, timepoint), built once
+    # (see get_metadata_index)
+    metadata_index: Optional[Dict[Tuple, np.ndarray]] = None
+    # metabolite and m+x of the isotopologues, built once
+    # (see get_isotopologue_index)
+    isotopologue_index: Optional[pd.DataFrame] = None
+
+    def set_sub_folder_absolute(self) -> None:
         # check if we have a relative or absolute path, compute the absolute
-        # path then load the data using pandas
+        # path
         # if the path is relative, we assume it is relative to the original
         # CWD (befre hydra changed it)
-        # store the data in self.metadata
         original_cwd = HydraConfig.get().runtime.cwd
         logger.info("Current config directory is %s", original_cwd)
         if not self.config.subfolder.startswith("/"):
@@ -75,7 +263,8 @@ class Dataset(BaseModel):
         else:
             self.sub_folder_absolute = self.config.subfolder
 
-        # start loading the dataframes
+    def get_data_files_paths(self) -> List[Tuple[str, str]]:
+        """returns the (label, absolute path) of each data file"""
         ext = self.get_files_extension_as_dict()  # extension str by file
         file_paths = [
             ("metadata", os.path.join(
@@ -94,48 +283,187 @@ class Dataset(BaseModel):
                 self.sub_folder_absolute,
                 self.config.isotopologues + "." + ext['isotopologues'])),
         ]
-        dfs = []
-        for label, file_path in file_paths:
-            try:
-                if label != "metadata":
-                    # the quantifications dfs take first column as index
-                    # (metabolites), regardless the name of that column
-                    dfs.append(pd.read_csv(file_path, sep="\t",
-                                           header=0, index_col=0))
-                else:
-                    dfs.append(pd.read_csv(file_path, sep="\t", header=0))
-                self.available_datasets.add(label)
-            except FileNotFoundError:
-                if file_path.endswith(self.config.isotopologues + "." + ext['isotopologues']):
-                    message_detail = "isotopologue absolute values missing"
-                    logger.critical(
-                        "File %s not found (%s), continue"
-                        % (file_path, message_detail))
-                else:
-                    logger.critical("File %s not found, continue",
-                                    file_path)
-                dfs.append(None)
-            except Exception as e:
-                logger.error(
-                    "Failed to load file %s during preload, aborting",
-                    file_path)
-                raise e
-
-        (
-            self.metadata_df,
-            self.abundances_df,
-            self.mean_enrichment_df,
-            self.isotopologue_proportions_df,
-            self.isotopologues_df,
-        ) = dfs
+        return file_paths
+
+    def preload(self, datatypes: Optional[Iterable[str]] = None):
+        # load the data using pandas (or from the cache, see cache_dir),
+        # store the data in self.metadata.
+        # Only the metadata and the given data types (None: all) are read,
+        # the other data files are read at the first access
+        if self.sub_folder_absolute is None:
+            self.set_sub_folder_absolute()
+        self.metadata_index = None  # of the metadata to be loaded
+        self.isotopologue_index = None
+        if datatypes is None:
+            datatypes = data_files_keys
+        file_paths = self.get_data_files_paths()
+        self.deferred_datasets = set()
+        if self.load_from_cache(file_paths):
+            self.check_expectations()
+            self.load_datatypes(datatypes)  # the ones not in the cache
+            return
+        self.memmap_folder = self.get_memmap_folder(file_paths)
+        self.deferred_datasets = set(
+            label for label, file_path in file_paths
+            if label != "metadata" and label not in set(datatypes))
+
+        start = time.perf_counter()
+        self.read_data_files([(label, file_path) for label, file_path in
+                              file_paths
+                              if label not in self.deferred_datasets])
 
         # log the first 5 rows of the metadata
         logger.info("Loaded metadata: \n%s", self.metadata_df.head())
         logger.info(
-            "Finished loading dataset %s, available dataframes are : %s",
-            self.config.label, self.available_datasets
+            "Finished loading dataset %s (%.2f s, %.1f MB), available "
+            "dataframes are : %s", self.config.label,
+            time.perf_counter() - start,
+            sum(memory_usage_mb(getattr(self, label + "_df"))
+                for label in self.available_datasets),
+            self.available_datasets
         )
+        if len(self.deferred_datasets) > 0:
+            logger.info("Data files read at first use: %s",
+                        self.deferred_datasets)
+        self.check_expectations()
+
+    def read_data_files(self, file_paths: List[Tuple[str, str]]) -> None:
+        """
+        Reads the data files concurrently (the metadata first, needed by
+        the chunked reader), sets the dataframes (attributes <label>_df)
+        and the available datasets
+        """
+        file_paths = sorted(file_paths, key=lambda x: x[0] != "metadata")
+        dfs = []
+        if len(file_paths) > 0 and file_paths[0][0] == "metadata":
+            self.metadata_df = self.read_data_file(*file_paths[0])
+            dfs.append(self.metadata_df)
+        if len(file_paths) > len(dfs):
+            with ThreadPoolExecutor(
+                    max_workers=min(len(file_paths) - len(dfs),
+                                    max_threads_loading_files)) as executor:
+                dfs += list(executor.map(lambda x: self.read_data_file(*x),
+                                         file_paths[len(dfs):]))
+        for (label, file_path), df in zip(file_paths, dfs):
+            setattr(self, label + "_df", df)
+            self.deferred_datasets.discard(label)
+            if df is not None:
+                self.available_datasets.add(label)
+
+    def load_datatypes(self, datatypes: Iterable[str]) -> None:
+        """
+        Reads the deferred data files of the given data types (see preload),
+        and splits them by compartment if the split was already done
+        """
+        file_paths = [(label, file_path) for label, file_path in
+                      self.get_data_files_paths()
+                      if label in set(datatypes) and
+                      label in self.deferred_datasets]
+        if len(file_paths) == 0:
+            return
+        if self.memmap_folder is None:
+            self.memmap_folder = self.get_memmap_folder(
+                self.get_data_files_paths())
+        self.read_data_files(file_paths)
         self.check_expectations()
+        if self.compartments_split:
+            self.split_datafiles_by_compartment()
+
+    def get_compartmentalized_dfs(self, label: str
+                                  ) -> Dict[str, pd.DataFrame]:
+        """
+        returns the dictionary of the compartment dataframes of the data
+        type, reading and splitting the data file at the first access
+        """
+        self.load_datatypes([label])
+        return self.compartmentalized_dfs[label]
+
+    def read_data_file(self, label: str,
+                       file_path: str) -> Optional[pd.DataFrame]:
+        """
+        Reads one data file. Returns None if the file is not found (logged),
+        aborts on any other error
+        """
+        try:
+            start = time.perf_counter()
+            if label != "metadata" and self.memmap_folder is not None and \
+                    os.path.isfile(os.path.join(self.memmap_folder,
+                                                f"{label}.npy")):
+                df = read_memmap_frame(os.path.join(self.memmap_folder,
+                                                    f"{label}.npy"))
+                self.memmapped_datasets.add(label)
+            elif label != "metadata":
+                df = self.read_quantification_file(file_path)
+            else:
+                df = self.read_metadata_file(file_path)
+            logger.info("Loaded %s in %.2f s, %.1f MB in memory", file_path,
+                        time.perf_counter() - start, memory_usage_mb(df))
+            return df
+        except FileNotFoundError:
+            if label == "isotopologues":
+                message_detail = "isotopologue absolute values missing"
+                logger.critical(
+                    "File %s not found (%s), continue"
+                    % (file_path, message_detail))
+            else:
+                logger.critical("File %s not found, continue",
+                                file_path)
+            return None
+        except Exception as e:
+            logger.error(
+                "Failed to load file %s during preload, aborting",
+                file_path)
+            raise e
+
+    def read_quantification_file(self, file_path: str) -> pd.DataFrame:
+        # the quantifications dfs take first column as index
+        # (metabolites), regardless the name of that column;
+        # the compression (.gz) is inferred from the file name
+        if self.config.chunk_rows is not None:
+            return self.read_quantification_file_chunks(file_path)
+        if not self.config.compact_dtypes:
+            return pd.read_csv(file_path, sep="\t", header=0, index_col=0)
+        columns = pd.read_csv(file_path, sep="\t", header=0,
+                              nrows=0).columns
+        df = pd.read_csv(file_path, sep="\t", header=0,
+                         engine=get_csv_engine(),
+                         dtype={column: "float32" for column in columns[1:]})
+        return df.set_index(columns[0])
+
+    def read_quantification_file_chunks(self, file_path: str
+                                        ) -> pd.DataFrame:
+        """
+        Reads the quantification file by chunks of chunk_rows rows, keeping
+        only the samples of the metadata and the rows having values, so that
+        the unfiltered table is never in memory.
+        Rows being all zero are kept (complete isotopologue vectors are
+        needed by the bivariate analysis and the isotopologue plots)
+        """
+        columns = pd.read_csv(file_path, sep="\t", header=0,
+                              nrows=0).columns
+        use_columns = list(columns)
+        if self.metadata_df is not None:
+            samples = set(self.metadata_df["original_name"])
+            use_columns = [columns[0]] + [
+                column for column in columns[1:] if column in samples]
+        dtype = None
+        if self.config.compact_dtypes:
+            dtype = {column: "float32" for column in use_columns[1:]}
+        chunks = [
+            chunk.set_index(columns[0]).dropna(how="all")
+            for chunk in pd.read_csv(file_path, sep="\t", header=0,
+                                     usecols=use_columns, dtype=dtype,
+                                     chunksize=self.config.chunk_rows)]
+        return pd.concat(chunks) if len(chunks) > 1 else chunks[0]
+
+    def read_metadata_file(self, file_path: str) -> pd.DataFrame:
+        if not self.config.compact_dtypes:
+            return pd.read_csv(file_path, sep="\t", header=0)
+        df = pd.read_csv(file_path, sep="\t", header=0,
+                         engine=get_csv_engine())
+        return df.astype({column: "category"
+                          for column in metadata_categorical_columns
+                          if column in df.columns})
 
     def check_expectations(self):
         # conditions should be a subset of the metadata corresponding column
@@ -158,20 +486,248 @@ class Dataset(BaseModel):
         message_bad_separator_input(self.isotopologues_df, "isotopologues")
 
     def split_datafiles_by_compartment(self) -> None:
-        frames_dict = {}
-        for data_file_label in self.available_datasets:
-            if 'metadata' in data_file_label:
-                continue
+        # only the data files not split yet (e.g. loaded from the cache)
+        labels = [label for label in self.available_datasets
+                  if label != "metadata" and
+                  label not in self.compartmentalized_dfs.keys()]
+        self.compartments_split = True
+        if len(labels) == 0:
+            if self.loaded_from_cache:
+                logger.info("Compartmentalized data loaded from the cache")
+            return
+        frames_dict = dict(self.compartmentalized_dfs)
+        for data_file_label in labels:
             dataframe_label = data_file_label + "_df"  # TODO: this is fragile!
-            tmp_co_dict = df_to_dict_by_compartment(
-                getattr(self, dataframe_label),
-                self.metadata_df)  # split by compartment
-            frames_dict[data_file_label] = tmp_co_dict
-
-        frames_dict = drop_all_nan_metabolites_on_comp_frames(
-            frames_dict, self.metadata_df)
-        frames_dict = set_samples_names(frames_dict, self.metadata_df)
+            self.memmap_data_file(data_file_label)
+            # split by compartment, views into the data when possible
+            frames_dict[data_file_label] = split_samples_by_compartment(
+                getattr(self, dataframe_label), self.metadata_df,
+                self.get_metadata_index())
+
         self.compartmentalized_dfs = frames_dict
+        self.save_to_cache(self.get_data_files_paths())
+
+    def get_inputs_key(self, file_paths: List[Tuple[str, str]]) -> str:
+        """
+        Hash of the dataset config and of the path, modification time and
+        size of each data file: any change of the inputs gives another key
+        """
+        config_dict = {
+            k: OmegaConf.to_container(v) if isinstance(
+                v, (DictConfig, ListConfig)) else v
+            for k, v in self.config.model_dump().items()
+            if k not in ["cache_dir", "memmap_dir"]}
+        signature = [config_dict, pd.__version__]
+        for label, file_path in file_paths:
+            try:
+                file_stat = os.stat(file_path)
+                signature.append([label, file_path, file_stat.st_mtime_ns,
+                                  file_stat.st_size])
+            except OSError:
+                signature.append([label, file_path, None])
+        return hashlib.sha256(json.dumps(signature, sort_keys=True,
+                                         default=str).encode()).hexdigest()
+
+    def get_cache_folder(self, file_paths: List[Tuple[str, str]]
+                         ) -> Optional[str]:
+        """
+        Folder of the cache for the current data files and config (its
+        name contains the key of the inputs, see get_inputs_key), None if
+        the cache is disabled
+        """
+        if self.config.cache_dir is None or \
+                self.config.memmap_dir is not None:
+            return None
+        key = self.get_inputs_key(file_paths)
+        cache_dir = os.path.join(self.sub_folder_absolute,
+                                 self.config.cache_dir)
+        return os.path.join(cache_dir, f"{self.config.label}-{key}")
+
+    def get_memmap_folder(self, file_paths: List[Tuple[str, str]]
+                          ) -> Optional[str]:
+        """
+        Folder of the memory-mapped matrices for the current data files and
+        config, None if the memmap backend is disabled
+        """
+        if self.config.memmap_dir is None:
+            return None
+        key = self.get_inputs_key(file_paths)
+        return os.path.join(self.sub_folder_absolute, self.config.memmap_dir,
+                            f"{self.config.label}-{key}")
+
+    def memmap_data_file(self, label: str) -> None:
+        """
+        Moves the quantification dataframe to a memory-mapped matrix (the
+        samples grouped by compartment, so that the compartment dataframes
+        are views into the map), replacing the maps of outdated inputs.
+        Dataframes not having a single numeric dtype stay in memory.
+        """
+        if self.memmap_folder is None or label in self.memmapped_datasets:
+            return
+        df = getattr(self, label + "_df")
+        if len(set(df.dtypes)) != 1 or \
+                not pd.api.types.is_numeric_dtype(df.dtypes.iloc[0]):
+            logger.info("%s kept in memory (not a numeric matrix)", label)
+            return
+        samples = [name for compartment in
+                   self.metadata_df['compartment'].unique()
+                   for name in self.metadata_df.loc[
+                       self.metadata_df['compartment'] == compartment,
+                       "original_name"] if name in df.columns]
+        columns = samples + [name for name in df.columns
+                             if name not in set(samples)]
+        file_path = os.path.join(self.memmap_folder, f"{label}.npy")
+        try:
+            os.makedirs(self.memmap_folder, exist_ok=True)
+            write_memmap_frame(df, columns, file_path)
+        except OSError as e:
+            logger.warning(f"Could not write the memory-mapped {label}: {e}")
+            return
+        setattr(self, label + "_df", read_memmap_frame(file_path))
+        self.memmapped_datasets.add(label)
+        logger.info("%s memory-mapped to %s", label, file_path)
+        remove_outdated_folders(os.path.dirname(self.memmap_folder),
+                                self.config.label, self.memmap_folder)
+
+    def load_from_cache(self, file_paths: List[Tuple[str, str]]) -> bool:
+        """
+        Sets the dataframes (also the compartmentalized ones) from the
+        cache folder, returns False if there is no valid cache
+        """
+        cache_folder = self.get_cache_folder(file_paths)
+        if cache_folder is None or not os.path.isfile(
+                os.path.join(cache_folder, "dataset.json")):
+            return False
+        try:
+            with open(os.path.join(cache_folder, "dataset.json")) as f:
+                cached = json.load(f)
+            metadata_df = frame_from_json(cached["metadata"])
+            dfs = dict()
+            for label, dtypes in cached["dtypes"].items():
+                df = read_memmap_frame(
+                    os.path.join(cache_folder, f"{label}.npy"),
+                    mmap_mode=None)
+                if len(set(dtypes)) > 1:
+                    df = df.astype(dict(zip(df.columns, dtypes)))
+                dfs[label] = df
+            # the compartment dataframes are split again (views into the
+            # data), their rows and columns must be the cached ones
+            metadata_index = index_metadata(metadata_df)
+            compartmentalized_dfs = dict()
+            for label, layout in cached["compartments"].items():
+                frames = split_samples_by_compartment(
+                    dfs[label], metadata_df, metadata_index)
+                if get_compartments_layout(frames) != layout:
+                    raise ValueError(f"{label} compartments differ")
+                compartmentalized_dfs[label] = frames
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cache {cache_folder}: {e}")
+            return False
+        self.metadata_df = metadata_df
+        self.metadata_index = metadata_index
+        for label in data_files_keys:
+            setattr(self, label + "_df", dfs.get(label))
+        self.available_datasets = set(cached["available_datasets"])
+        self.deferred_datasets = set(cached["deferred_datasets"])
+        self.compartmentalized_dfs = compartmentalized_dfs
+        self.loaded_from_cache = True
+        logger.info("Loaded dataset %s from the cache %s, available "
+                    "dataframes are : %s", self.config.label, cache_folder,
+                    self.available_datasets)
+        return True
+
+    def save_to_cache(self, file_paths: List[Tuple[str, str]]) -> None:
+        """
+        Writes the dataframes to the cache folder: each quantification
+        matrix as a .npy file with its .json sidecar (see
+        write_memmap_frame), the metadata and the rows and columns of the
+        compartment dataframes as plain data (dataset.json). Replaces the
+        outdated cache folders of this dataset
+        """
+        cache_folder = self.get_cache_folder(file_paths)
+        if cache_folder is None:
+            return
+        dfs = {label: getattr(self, label + "_df")
+               for label in sorted(self.available_datasets)
+               if label != "metadata"}
+        if not all(isinstance(dtype, np.dtype) and
+                   pd.api.types.is_numeric_dtype(dtype)
+                   for df in dfs.values() for dtype in df.dtypes):
+            logger.info("Dataset %s not cached (not numeric matrices)",
+                        self.config.label)
+            return
+        cached = {
+            "available_datasets": sorted(self.available_datasets),
+            "deferred_datasets": sorted(self.deferred_datasets),
+            "metadata": frame_to_json(self.metadata_df),
+            "dtypes": {label: [str(dtype) for dtype in df.dtypes]
+                       for label, df in dfs.items()},
+            "compartments": {
+                label: get_compartments_layout(frames)
+                for label, frames in self.compartmentalized_dfs.items()}}
+        cache_dir = os.path.dirname(cache_folder)
+        temp_folder = None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            temp_folder = tempfile.mkdtemp(dir=cache_dir, suffix=".tmp")
+            for label, df in dfs.items():
+                if len(set(df.dtypes)) > 1:
+                    df = df.astype(np.result_type(*df.dtypes))
+                write_memmap_frame(df, list(df.columns),
+                                   os.path.join(temp_folder, f"{label}.npy"))
+            with open(os.path.join(temp_folder, "dataset.json"), "w") as f:
+                json.dump(cached, f)
+            if is_memmap_folder(cache_folder, ["dataset.json"]):
+                # cached before reading the deferred data files
+                for file_name in os.listdir(cache_folder):
+                    os.remove(os.path.join(cache_folder, file_name))
+                os.rmdir(cache_folder)
+            os.replace(temp_folder, cache_folder)
+            temp_folder = None
+            remove_outdated_folders(cache_dir, self.config.label,
+                                    cache_folder, ["dataset.json"])
+        except OSError as e:
+            logger.warning(f"Could not write the dataset cache: {e}")
+            return
+        finally:
+            if temp_folder is not None and os.path.isdir(temp_folder):
+                for file_name in os.listdir(temp_folder):
+                    os.remove(os.path.join(temp_folder, file_name))
+                os.rmdir(temp_folder)
+        logger.info("Saved dataset %s to the cache %s", self.config.label,
+                    cache_folder)
+
+    def get_metadata_index(self) -> Dict[Tuple, np.ndarray]:
+        """
+        returns the index of the metadata rows (see index_metadata in
+        helpers), built at the first call
+        """
+        if self.metadata_index is None:
+            self.metadata_index = index_metadata(self.metadata_df)
+        return self.metadata_index
+
+    def get_isotopologue_index(self) -> pd.DataFrame:
+        """
+        returns the index of the isotopologues of the isotopologue
+        proportions, all the compartments (see index_isotopologues in
+        helpers), built at the first call
+        """
+        if self.isotopologue_index is None:
+            frames = self.get_compartmentalized_dfs(
+                "isotopologue_proportions")
+            self.isotopologue_index = index_isotopologues(np.concatenate(
+                [frame.index.to_numpy() for frame in frames.values()]))
+        return self.isotopologue_index
+
+    def get_metadata_rows(self, compartment=None, condition=None,
+                          timepoint=None) -> pd.DataFrame:
+        """
+        returns the metadata rows having the given compartment, condition
+        and timepoint (None: any value), looked up in the metadata index
+        """
+        return self.metadata_df.iloc[metadata_rows(
+            self.get_metadata_index(), compartment=compartment,
+            condition=condition, timepoint=timepoint)]
 
     def get_file_for_label(self, label):
         if label == "abundances":
@@ -185,20 +741,31 @@ class Dataset(BaseModel):
         else:
             raise ValueError(f"Unknown label {label}")
 
+    def get_files_index(self) -> Dict[str, str]:
+        """
+        returns the extension of each file of the data subfolder, the
+        subfolder is scanned once (see index_folder_files in helpers)
+        """
+        if self.files_index is None:
+            self.files_index = index_folder_files(self.sub_folder_absolute)
+        return self.files_index
+
     def get_files_extension_as_dict(self):
         """returns dictionary of file extensions, uses extfind (helpers)"""
+        files_index = self.get_files_index()
         extension_dict: Dict[str, str] = dict()
-        extension_dict['metadata'] = extfind(self.sub_folder_absolute,
-                                             self.config.metadata)
-        extension_dict['abundances'] = extfind(self.sub_folder_absolute,
-                                               self.config.abundances)
+        extension_dict['metadata'] = extfind(
+            self.sub_folder_absolute, self.config.metadata, files_index)
+        extension_dict['abundances'] = extfind(
+            self.sub_folder_absolute, self.config.abundances, files_index)
         extension_dict['mean_enrichment'] = extfind(
-            self.sub_folder_absolute, self.config.mean_enrichment)
-        extension_dict['isotopologues'] = extfind(self.sub_folder_absolute,
-                                                  self.config.isotopologues)
+            self.sub_folder_absolute, self.config.mean_enrichment,
+            files_index)
+        extension_dict['isotopologues'] = extfind(
+            self.sub_folder_absolute, self.config.isotopologues, files_index)
         extension_dict['isotopologue_proportions'] = extfind(
             self.sub_folder_absolute,
-            self.config.isotopologue_proportions)
+            self.config.isotopologue_proportions, files_index)
         return extension_dict
 
 
@@ -212,8 +779,9 @@ class DataIntegration(Dataset):
     deg_dfs: Dict[int, pd.DataFrame] = {}
     pathways_dfs: Dict[str, pd.DataFrame] = {}
 
-    def set_dataset_integration_config(self):
-        self.preload()
+    def set_dataset_integration_config(
+            self, datatypes: Optional[Iterable[str]] = None):
+        self.preload(datatypes)
         self.split_datafiles_by_compartment()
 
         self.check_expectations()  # of the Dataset class
@@ -239,44 +807,56 @@ class DataIntegration(Dataset):
                 " in dataset yaml file"
             )
 
+    def read_integration_file(self, file_name: str) -> Optional[
+            pd.DataFrame]:
+        """
+        Reads one transcripts or pathways file; errors (file not found
+        included) are logged, and give None
+        """
+        file_extension = extfind(self.sub_folder_absolute, file_name,
+                                 self.get_files_index())
+        try:
+            path_file = os.path.join(
+                self.sub_folder_absolute,
+                f"{file_name}.{file_extension}")
+            return pd.read_csv(path_file, sep='\t', header=0)
+        except FileNotFoundError:
+            logger.info(f"{file_name}.{file_extension}: file not found")
+        except Exception as e:
+            logger.info(
+                f'Error while opening file {file_name}.{file_extension} '
+                f' \n {e}')
+        return None
+
+    def read_integration_files(self, file_names: List[str]) -> List[
+            Optional[pd.DataFrame]]:
+        """Reads the files concurrently, see read_integration_file"""
+        if len(file_names) == 0:
+            return []
+        with ThreadPoolExecutor(
+                max_workers=min(len(file_names),
+                                max_threads_loading_files)) as executor:
+            return list(executor.map(self.read_integration_file,
+                                     file_names))
+
     def load_deg_dfs(self):
         # generate dictionary of transcripts dataframes (DEGs) :
         # the keys are integers, with the order of files in the dataset yml
-        for i, file_name in enumerate(self.config.transcripts):
-            try:
-                file_extension = extfind(self.sub_folder_absolute, file_name)
-                path_deg_file = os.path.join(
-                    self.sub_folder_absolute,
-                    f"{file_name}.{file_extension}")
-                deg_df = pd.read_csv(path_deg_file, sep='\t', header=0)
+        deg_dfs = self.read_integration_files(list(self.config.transcripts))
+        for i, deg_df in enumerate(deg_dfs):
+            if deg_df is not None:
                 self.deg_dfs[i] = deg_df
-            except FileNotFoundError:
-                logger.info(f"{file_name}.{file_extension}: file not found")
-            except Exception as e:
-                logger.info(
-                    f'Error while opening file {file_name}.{file_extension} '
-                    f' \n {e}')
 
         logger.info("Finished loading transcripts dataframes: "
                     "%s", self.config.transcripts)
 
     def load_pathways_dfs(self):
-        for k in self.config.pathways.keys():
-            try:
-                file_extension = extfind(
-                    self.sub_folder_absolute, self.config.pathways[k])
-                path_file = os.path.join(
-                    self.sub_folder_absolute,
-                    f"{self.config.pathways[k]}.{file_extension}")
-                pathway_df = pd.read_csv(path_file, sep='\t', header=0)
+        keys = list(self.config.pathways.keys())
+        pathways_dfs = self.read_integration_files(
+            [self.config.pathways[k] for k in keys])
+        for k, pathway_df in zip(keys, pathways_dfs):
+            if pathway_df is not None:
                 self.pathways_dfs[k] = pathway_df
-            except FileNotFoundError:
-                logger.info(
-                    f"{self.config.pathways[k]}.{file_extension}: not found")
-            except Exception as e:
-                logger.info(
-                    f'{e}. Error while opening file '
-                    f'{self.config.pathways[k]}.{file_extension} \n {e}')
 
         logger.info("Finished loading pathways dataframes: "
                     "%s", self.config.pathways)
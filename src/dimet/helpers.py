@@ -6,10 +6,10 @@
 import os
 import logging
 from collections.abc import Iterable
-from functools import reduce
-from typing import Dict, List
+from functools import lru_cache, reduce
+from typing import Dict, List, Optional, Tuple
 
-from dimet.constants import (assert_literal,
+from dimet.constants import (assert_literal, metadata_index_columns,
                              minimum_tolerated_fraction_value,
                              overlap_methods_types,
                              supported_file_extension)
@@ -18,11 +18,6 @@ import numpy as np
 
 import pandas as pd
 
-import scipy
-from scipy import stats
-
-import statsmodels.stats.multitest as ssm
-
 logger = logging.getLogger(__name__)
 
 
@@ -34,6 +29,7 @@ def compute_padj(df: pd.DataFrame, correction_alpha: float,
     Deals with the situation where pvalue column can contain np.nan values
     Adds a new column called "padj" with the adjusted p-values.
     '''
+    import statsmodels.stats.multitest as ssm
     tmp = df.copy()
     # inspired from R documentation in p.adjust :
     tmp["pvalue"] = tmp[["pvalue"]].fillna(1)
@@ -122,8 +118,7 @@ def calculate_gmean(df: pd.DataFrame,
     """
     for i, group in enumerate(groups):
         gmean_col = f"gmean_{i + 1}"
-        df[gmean_col] = df[group].apply(lambda x: stats.gmean(x.dropna()),
-                                        axis=1)
+        df[gmean_col] = row_wise_nangmean(df[group].to_numpy(dtype=float))
 
     ratio_col = "FC"
     mask = df[f"gmean_{2}"] == 0
@@ -142,25 +137,139 @@ def apply_multi_group_kruskal_wallis(df: pd.DataFrame,
     adds the resulting pvalue to a new column
     and returns the updated data frame
     '''
-    p_values = []
-    for _, row in df.iterrows():
-        # Create a list of groups based on the columns in cols
-        groups_values = [row[group] for group in groups]
-
-        # Apply the Kruskal-Wallis test to the groups
-        _, p_value = scipy.stats.kruskal(*groups_values, nan_policy='omit')
-        p_values.append(p_value)
+    values = np.concatenate(
+        [df[group].to_numpy(dtype=float) for group in groups], axis=1)
+    sizes = [len(group) for group in groups]
+    _, p_values = kruskal_wallis_rows(values, sizes)
 
     df['pvalue'] = p_values
     return df
 
 
-def first_column_for_column_values(df: pd.DataFrame, columns: List,
-                                   values: List) -> List:
+def kruskal_wallis_rows(values: np.ndarray,
+                        sizes: List[int]) -> (np.array, np.array):
+    """
+    Kruskal-Wallis H-test on each row of a 2-D array, as
+    scipy.stats.kruskal(..., nan_policy='omit'):
+    the columns are the samples of the groups, one after the other,
+    'sizes' giving the number of columns of each group.
+    Each row is ranked once (NaN omitted) and H, corrected for ties,
+    is computed for all rows together.
+    Rows where a group has no value, or where all the values are equal,
+    get NaN.
+    Returns the arrays of statistics and of p-values.
+    """
+    from scipy import special
+    if len(sizes) < 2:
+        raise ValueError("Need at least two groups in stats.kruskal()")
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    valid = ~np.isnan(values)
+    ranks, ties = rank_rows_with_ties(values)
+    ranks = np.where(valid, ranks, 0)
+    bounds = np.cumsum([0] + list(sizes))
+    total_n = valid.sum(axis=1)
+    ssbn = np.zeros(values.shape[0])
+    enough = np.ones(values.shape[0], dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            n_group = valid[:, start:end].sum(axis=1)
+            enough &= n_group > 0
+            ssbn += ranks[:, start:end].sum(axis=1) ** 2 / n_group
+        # each value of a group of t ties adds t**2 - 1: t**3 - t by group
+        tie_sum = np.where(valid, ties ** 2 - 1, 0).sum(axis=1)
+        tie_correction = 1 - tie_sum / (total_n ** 3 - total_n)
+        h = 12.0 / (total_n * (total_n + 1)) * ssbn - 3 * (total_n + 1)
+        h /= tie_correction
+    h = np.where(enough, h, np.nan)
+    p_values = special.chdtrc(len(sizes) - 1, h)
+    return h, p_values
+
+
+def index_metadata(metadata: pd.DataFrame) -> Dict[Tuple, np.ndarray]:
+    """
+    Index of the metadata rows, in one pass: the keys are the
+    (compartment, condition, timepoint) tuples (None for a column absent
+    from the metadata), the values the integer positions of the rows
+    having these values, in the metadata order
+    """
+    columns = [c for c in metadata_index_columns if c in metadata.columns]
+    if len(columns) == 0:
+        return {(None,) * len(metadata_index_columns):
+                np.arange(metadata.shape[0])}
+    groups = metadata.groupby(columns, sort=False, dropna=False,
+                              observed=True).indices
+    metadata_index = dict()
+    for values, rows in groups.items():
+        if not isinstance(values, tuple):
+            values = (values,)
+        key_dict = dict(zip(columns, values))
+        metadata_index[tuple(key_dict.get(c)
+                             for c in metadata_index_columns)] = rows
+    return metadata_index
+
+
+def index_isotopologues(isotopologues_names) -> pd.DataFrame:
+    """
+    Parses the isotopologue names (e.g. 'Cit_m+0') once.
+    Returns a dataframe indexed by the unique names (isotopologue_name),
+    ordered by metabolite and m+x (the MDV of each metabolite being
+    contiguous), with the columns:
+    metabolite, m+x (integer) and metabolite_code (position of the
+    metabolite in the sorted metabolites)
+    """
+    names = pd.Index(pd.unique(np.asarray(isotopologues_names, dtype=object)),
+                     name="isotopologue_name")
+    parts = names.str.split("_m+", n=1, expand=True, regex=False)
+    isotopologue_index = pd.DataFrame({
+        "metabolite": parts.get_level_values(0),
+        "m+x": parts.get_level_values(1).astype(int)}, index=names)
+    isotopologue_index = isotopologue_index.sort_values(
+        by=["metabolite", "m+x"])
+    isotopologue_index["metabolite_code"] = pd.factorize(
+        isotopologue_index["metabolite"])[0]
+    return isotopologue_index
+
+
+def metadata_rows(metadata_index: Dict[Tuple, np.ndarray],
+                  compartment=None, condition=None,
+                  timepoint=None) -> np.ndarray:
+    """
+    Integer positions (in the metadata order) of the metadata rows having
+    the given values (None: any value), looked up in the index built by
+    index_metadata
+    """
+    wanted = (compartment, condition, timepoint)
+    if all(value is not None for value in wanted):
+        return metadata_index.get(wanted, np.array([], dtype=int))
+    matches = [rows for key, rows in metadata_index.items()
+               if all(value is None or value == key_value
+                      for value, key_value in zip(wanted, key))]
+    if len(matches) == 0:
+        return np.array([], dtype=int)
+    return np.sort(np.concatenate(matches))
+
+
+def samples_positions(df: pd.DataFrame, samples) -> np.ndarray:
+    """
+    Integer positions of the samples (column names) in df, to select the
+    columns by integer slices. Raises KeyError if a sample is missing
+    """
+    positions = df.columns.get_indexer(samples)
+    if (positions < 0).any():
+        missing = list(np.asarray(samples)[positions < 0])
+        raise KeyError(f"{missing} not in the columns")
+    return positions
+
+
+def first_column_for_column_values(
+        df: pd.DataFrame, columns: List, values: List,
+        metadata_index: Optional[Dict[Tuple, np.ndarray]] = None) -> List:
     """
     Given a dataframe df and selection columns, selects rows
     where values are equal to the those
     in the "values" List (provided in pairwise fashion).
+    If df is the metadata and its index (see index_metadata) is given,
+    the rows are looked up in the index when possible.
     Returns: list of values of the first column for selected rows.
     """
 
@@ -170,6 +279,12 @@ def first_column_for_column_values(df: pd.DataFrame, columns: List,
         logger.info(message)
         raise ValueError(message)
 
+    if metadata_index is not None and \
+            set(columns).issubset(metadata_index_columns):
+        return [list(df.iloc[metadata_rows(metadata_index,
+                                           **dict(zip(columns, vals))), 0])
+                for vals in values]
+
     # Create a mask for each column-value pair
     first_column_values_list = []
     for vals in values:
@@ -215,27 +330,43 @@ def arg_repl_zero2value(how: str, df: pd.DataFrame) -> float:
     return output_value
 
 
-def overlap_symmetric(x: np.array, y: np.array) -> float:
-    a = [np.nanmin(x), np.nanmax(x)]
-    b = [np.nanmin(y), np.nanmax(y)]
+def overlap_symmetric(x: np.array, y: np.array, axis: int = -1):
+    """
+    Distance (positive) or overlap (negative) between the intervals
+    [min, max] of x and y, NaN omitted.
+    Works along 'axis': with 2-D arrays (one row by metabolite) returns
+    the whole column of values.
+    """
+    lower = np.fmax(np.nanmin(x, axis=axis), np.nanmin(y, axis=axis))
+    upper = np.fmin(np.nanmax(x, axis=axis), np.nanmax(y, axis=axis))
+    overlap = lower - upper
+    return overlap
 
-    a = np.asarray(a, dtype=np.float64)
-    b = np.asarray(b, dtype=np.float64)
 
-    overlap = np.nanmax([a[0], b[0]]) - np.nanmin([a[1], b[1]])
+def overlap_asymmetric(x: np.array, y: np.array, axis: int = -1):
+    """
+    As overlap_symmetric, but x is the reference group:
+    min of y minus max of x.
+    """
+    overlap = np.nanmin(y, axis=axis) - np.nanmax(x, axis=axis)
     return overlap
 
 
-def overlap_asymmetric(x: np.array, y: np.array) -> float:
-    # x is the reference group
-    overlap = np.nanmin(y) - np.nanmax(x)
-    return overlap
+def span_of_groups(x: np.array, y: np.array, axis: int = -1):
+    """
+    Difference between the maximum and the minimum of all the values
+    of x and y together, NaN omitted. Works along 'axis' as the overlaps.
+    """
+    span = np.fmax(np.nanmax(x, axis=axis), np.nanmax(y, axis=axis)) - \
+        np.fmin(np.nanmin(x, axis=axis), np.nanmin(y, axis=axis))
+    return span
 
 
 def compute_distance_between_intervals(group1: np.array, group2: np.array,
-                                       overlap_method: str) -> float:
+                                       overlap_method: str):
     """
     computes the distance between intervals provided in group1 and group2
+    (single rows, or 2-D arrays with one row by metabolite)
     """
     assert_literal(overlap_method, overlap_methods_types, "overlap method : ")
 
@@ -309,6 +440,7 @@ def a12(lst1, lst2, rev=True):
 
 
 def compute_gmean_nonan(anarray: np.array) -> float:
+    from scipy import stats
     arr_nonzero = np.where(anarray == 0, np.finfo(float).eps, anarray)
     return stats.gmean(arr_nonzero[~np.isnan(arr_nonzero)])
 
@@ -343,6 +475,91 @@ def flatten(xs):
             yield x
 
 
+def select_min_pvalue_alternative(stats_list: List, pvalues_list: List):
+    """
+    Given the results of the same test computed with the alternatives
+    'less', 'greater' and 'two-sided' (in this order), keeps the best
+    (smaller) non-NaN p-value and its statistic.
+    If all the p-values are NaN, the two-sided result is kept.
+    Works element-wise when the statistics and p-values are arrays
+    (one value by row).
+    """
+    stat_arr = np.stack(np.broadcast_arrays(*stats_list)).astype(float)
+    pval_arr = np.stack(np.broadcast_arrays(*pvalues_list)).astype(float)
+    pval_nan = np.isnan(pval_arr)
+    # argmin keeps the first of equal p-values, as min() over tuples did
+    best = np.argmin(np.where(pval_nan, np.inf, pval_arr), axis=0)
+    best = np.where(pval_nan.all(axis=0), len(pvalues_list) - 1, best)
+    best = np.expand_dims(best, axis=0)
+    stat_result = np.take_along_axis(stat_arr, best, axis=0)[0]
+    pval_result = np.take_along_axis(pval_arr, best, axis=0)[0]
+    if stat_result.ndim == 0:
+        return stat_result.item(), pval_result.item()
+
+    return stat_result, pval_result
+
+
+def drop_nan_single_row(vInterest: np.array, vBaseline: np.array):
+    """
+    Drops the NaN values of two 1-D arrays. Matrices (one row by
+    metabolite) are returned as they are: they are expected to be
+    already free of NaN (see compact_nan_rows)
+    """
+    if np.ndim(vInterest) == 1:
+        vInterest = vInterest[~np.isnan(vInterest)]
+        vBaseline = vBaseline[~np.isnan(vBaseline)]
+    return vInterest, vBaseline
+
+
+def rank_rows_with_ties(values: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Ranks the values of each row of a 2-D array in a single sort
+    (tied values get the average of their ranks, as scipy rankdata).
+    Returns the ranks and, for each value, the size of its group of ties.
+    NaN values are ranked last, each one in its own group.
+    """
+    order = np.argsort(values, axis=1, kind="mergesort")
+    sorted_values = np.take_along_axis(values, order, axis=1)
+    positions = np.broadcast_to(np.arange(values.shape[1]), values.shape)
+    starts = np.ones(values.shape, dtype=bool)
+    starts[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    ends = np.ones(values.shape, dtype=bool)
+    ends[:, :-1] = starts[:, 1:]
+    # first and last sorted position of the group of ties of each value
+    first = np.maximum.accumulate(np.where(starts, positions, 0), axis=1)
+    last = np.minimum.accumulate(
+        np.where(ends, positions, values.shape[1])[:, ::-1], axis=1)[:, ::-1]
+    ranks = np.empty(values.shape)
+    ties = np.empty(values.shape)
+    np.put_along_axis(ranks, order, (first + last) / 2 + 1, axis=1)
+    np.put_along_axis(ties, order, last - first + 1, axis=1)
+    return ranks, ties
+
+
+def rows_as_matrices(vInterest: np.array, vBaseline: np.array):
+    """
+    Returns the two groups of values as 2-D arrays (one row by
+    metabolite), and True if a single row (1-D arrays) was given
+    """
+    single_row = np.ndim(vInterest) == 1
+    vInterest = np.atleast_2d(np.asarray(vInterest, dtype=float))
+    vBaseline = np.atleast_2d(np.asarray(vBaseline, dtype=float))
+    return vInterest, vBaseline, single_row
+
+
+def select_min_pvalue_tails(stats_list: List, pvalues_list: List,
+                            single_row: bool):
+    """
+    select_min_pvalue_alternative, giving back scalars if the tails were
+    computed for a single row
+    """
+    stat_result, pval_result = select_min_pvalue_alternative(stats_list,
+                                                             pvalues_list)
+    if single_row:
+        return stat_result[0], pval_result[0]
+    return stat_result, pval_result
+
+
 def compute_ranksums_allH0(vInterest: np.array, vBaseline: np.array):
     """
     The Wilcoxon rank-sum test tests the null hypothesis that two sets of
@@ -353,90 +570,311 @@ def compute_ranksums_allH0(vInterest: np.array, vBaseline: np.array):
         than the distribution underlying y.
     ‘greater’: the distribution underlying x is stochastically
         greater than the distribution underlying y.
+    The samples are ranked once, and the three alternatives are derived
+    from the same z statistic (same values as scipy.stats.ranksums).
+    Accepts single rows or matrices (row-wise test, no NaN).
     """
-    vInterest = vInterest[~np.isnan(vInterest)]
-    vBaseline = vBaseline[~np.isnan(vBaseline)]
-    sta, p = scipy.stats.ranksums(vInterest, vBaseline, alternative="less")
-    sta2, p2 = scipy.stats.ranksums(vInterest, vBaseline,
-                                    alternative="greater")
-    sta3, p3 = scipy.stats.ranksums(vInterest, vBaseline,
-                                    alternative="two-sided")
+    from scipy import special
+    vInterest, vBaseline = drop_nan_single_row(vInterest, vBaseline)
+    x, y, single_row = rows_as_matrices(vInterest, vBaseline)
+    n1, n2 = x.shape[1], y.shape[1]
+    ranks, _ = rank_rows_with_ties(np.hstack([x, y]))
+    rank_sum = np.sum(ranks[:, :n1], axis=1)
+    expected = n1 * (n1 + n2 + 1) / 2.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (rank_sum - expected) / np.sqrt(n1 * n2 * (n1 + n2 + 1) / 12.0)
 
     # best (smaller pvalue) among all tailed tests
-    pretups = [(sta, p), (sta2, p2), (sta3, p3)]
-    tups = []
-    for t in pretups:  # make list of tuples with no-nan pvalues
-        if not np.isnan(t[1]):
-            tups.append(t)
+    return select_min_pvalue_tails(
+        [z, z, z],
+        [special.ndtr(z), special.ndtr(-z), 2 * special.ndtr(-np.abs(z))],
+        single_row)
 
-    if len(tups) == 0:  # if all pvalues are nan assign two sided result
-        tups = [(sta3, p3)]
 
-    stap_tup = min(tups, key=lambda x: x[1])  # nan already excluded
-    stat_result = stap_tup[0]
-    pval_result = stap_tup[1]
+@lru_cache(maxsize=None)
+def wilcoxon_exact_pmf(n: int) -> np.array:
+    """
+    Null distribution of the signed-rank statistic (sum of the positive
+    ranks) for n non-zero differences without ties
+    """
+    counts = np.zeros(n * (n + 1) // 2 + 1)
+    counts[0] = 1
+    for i in range(1, n + 1):
+        counts[i:] = counts[i:] + counts[:-i].copy()
+    return counts / 2 ** n
 
-    return stat_result, pval_result
+
+def wilcoxon_exact_tails(r_plus: np.array, n: int) -> (np.array, np.array):
+    """
+    Exact 'less' (cdf) and 'greater' (sf) p-values of the signed-rank
+    statistics, each tail summed from its nearest end as in scipy
+    """
+    pmf = wilcoxon_exact_pmf(n)
+    head = np.concatenate([[0.], np.cumsum(pmf)])  # head[k] = P(T < k)
+    tail = np.concatenate([np.cumsum(pmf[::-1])[::-1], [0.]])  # P(T >= k)
+    mean = n * (n + 1) / 4
+    k_less = np.ceil(r_plus).astype(int)
+    k_greater = np.floor(r_plus).astype(int)
+    p_less = np.where(k_less <= mean, head[k_less + 1],
+                      1 - tail[k_less + 1])
+    p_greater = np.where(k_greater <= mean, tail[k_greater],
+                         1 - head[k_greater])
+    return p_less, p_greater
+
+
+def wilcoxon_sign_flip_tails(ranks: np.ndarray, positive: np.ndarray,
+                             negative: np.ndarray, r_plus: np.array,
+                             chunk_size: int = 256) -> (np.array, np.array):
+    """
+    Permutation p-values of the signed-rank statistics, computed on the
+    2**n sign flips of the differences (exact permutation test, as the
+    one used by scipy for small samples with ties or zeros)
+    """
+    n = ranks.shape[1]
+    flips = ((np.arange(2 ** n)[:, None] >> np.arange(n)) & 1).astype(float)
+    gamma = np.abs(np.finfo(float).eps * 100 * r_plus)
+    p_less = np.empty(r_plus.shape)
+    p_greater = np.empty(r_plus.shape)
+    for start in range(0, ranks.shape[0], chunk_size):
+        rows = slice(start, start + chunk_size)
+        # flipping a sign moves its rank from r_plus to r_minus, or back
+        null_distribution = r_plus[rows, None] + np.dot(
+            ranks[rows] * (negative[rows] * 1. - positive[rows]), flips.T)
+        p_less[rows] = np.mean(
+            null_distribution <= (r_plus + gamma)[rows, None], axis=1)
+        p_greater[rows] = np.mean(
+            null_distribution >= (r_plus - gamma)[rows, None], axis=1)
+    return p_less, p_greater
 
 
 def compute_wilcoxon_allH0(vInterest: np.array, vBaseline: np.array):
-    #  Wilcoxon signed-rank test
-    vInterest = vInterest[~np.isnan(vInterest)]
-    vBaseline = vBaseline[~np.isnan(vBaseline)]
-    sta, p = scipy.stats.wilcoxon(vInterest, vBaseline, alternative="less")
-    sta2, p2 = scipy.stats.wilcoxon(vInterest, vBaseline,
-                                    alternative="greater")
-    sta3, p3 = scipy.stats.wilcoxon(vInterest, vBaseline,
-                                    alternative="two-sided")
+    """
+    Wilcoxon signed-rank test (zero differences are discarded, no
+    continuity correction), same values as scipy.stats.wilcoxon.
+    The absolute differences are ranked once, and the three alternatives
+    are derived from the same statistic, with the method scipy would
+    choose: exact if no ties nor zeros, sign flips permutation if there
+    are any and n <= 13, asymptotic otherwise (or if n > 50).
+    Accepts single rows or matrices (row-wise test, no NaN).
+    """
+    from scipy import special
+    vInterest, vBaseline = drop_nan_single_row(vInterest, vBaseline)
+    x, y, single_row = rows_as_matrices(vInterest, vBaseline)
+    if x.shape[1] != y.shape[1]:
+        raise ValueError("`x` and `y` must have the same length along "
+                         "`axis`.")
+    n = x.shape[1]
+    differences = x - y
+    zeros = differences == 0
+    differences[zeros] = np.nan  # discarded, as scipy 'wilcox' zero_method
+    positive = differences > 0
+    negative = differences < 0
+    ranks, ties = rank_rows_with_ties(np.abs(differences))
+    r_plus = np.sum(positive * ranks, axis=1)
+    r_minus = np.sum(negative * ranks, axis=1)
+    has_ties = np.any(ties > 1) or np.any(zeros)
+
+    if n <= 50 and not has_ties:
+        p_less, p_greater = wilcoxon_exact_tails(r_plus, n)
+        p_two = np.clip(2 * np.minimum(p_less, p_greater), 0, 1)
+    elif n <= 13:
+        p_less, p_greater = wilcoxon_sign_flip_tails(ranks, positive,
+                                                     negative, r_plus)
+        p_two = np.clip(2 * np.minimum(p_less, p_greater), 0, 1)
+    else:
+        count = n - np.count_nonzero(zeros, axis=1)
+        tie_correct = np.sum(np.where(zeros, 0, ties ** 2 - 1), axis=1)
+        mean = count * (count + 1.) * 0.25
+        se = count * (count + 1.) * (2. * count + 1.)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = (r_plus - mean) / np.sqrt((se - tie_correct / 2) / 24)
+        p_less, p_greater = special.ndtr(z), special.ndtr(-z)
+        p_two = 2 * special.ndtr(-np.abs(z))
 
     # best (smaller pvalue) among all tailed tests
-    pretups = [(sta, p), (sta2, p2), (sta3, p3)]
-    tups = []
-    for t in pretups:  # make list of tuples with no-nan pvalues
-        if not np.isnan(t[1]):
-            tups.append(t)
+    return select_min_pvalue_tails(
+        [r_plus, r_plus, np.minimum(r_plus, r_minus)],
+        [p_less, p_greater, p_two], single_row)
 
-    if len(tups) == 0:  # if all pvalues are nan assign two sided result
-        tups = [(sta3, p3)]
 
-    stap_tup = min(tups, key=lambda x: x[1])  # nan already excluded
-    stat_result = stap_tup[0]
-    pval_result = stap_tup[1]
+def compute_brunnermunzel_allH0(vInterest: np.array, vBaseline: np.array):
+    """
+    Brunner-Munzel test (t distribution), same values as
+    scipy.stats.brunnermunzel.
+    The samples are ranked once, and the three alternatives are derived
+    from the same statistic.
+    Accepts single rows or matrices (row-wise test, no NaN).
+    """
+    from scipy import special
+    vInterest, vBaseline = drop_nan_single_row(vInterest, vBaseline)
+    x, y, single_row = rows_as_matrices(vInterest, vBaseline)
+    nx, ny = x.shape[1], y.shape[1]
+    rankc, _ = rank_rows_with_ties(np.hstack([x, y]))
+    rankx, _ = rank_rows_with_ties(x)
+    ranky, _ = rank_rows_with_ties(y)
+    rankcx = rankc[:, :nx]
+    rankcy = rankc[:, nx:]
+    rankcx_mean = np.mean(rankcx, axis=1, keepdims=True)
+    rankcy_mean = np.mean(rankcy, axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        temp_x = (rankcx - rankx - rankcx_mean
+                  + np.mean(rankx, axis=1, keepdims=True))
+        sx = np.sum(temp_x * temp_x, axis=1) / (nx - 1)
+        temp_y = (rankcy - ranky - rankcy_mean
+                  + np.mean(ranky, axis=1, keepdims=True))
+        sy = np.sum(temp_y * temp_y, axis=1) / (ny - 1)
+        wbfn = nx * ny * (rankcy_mean[:, 0] - rankcx_mean[:, 0])
+        wbfn /= (nx + ny) * np.sqrt(nx * sx + ny * sy)
+        df = np.power(nx * sx + ny * sy, 2.0) / (
+            np.power(nx * sx, 2.0) / (nx - 1)
+            + np.power(ny * sy, 2.0) / (ny - 1))
 
-    return stat_result, pval_result
+    # best (smaller pvalue) among all tailed tests
+    return select_min_pvalue_tails(
+        [wbfn, wbfn, wbfn],
+        [special.stdtr(df, -wbfn), special.stdtr(df, wbfn),
+         2 * special.stdtr(df, -np.abs(wbfn))], single_row)
 
 
-def compute_brunnermunzel_allH0(vInterest: np.array, vBaseline: np.array):
-    vInterest = vInterest[~np.isnan(vInterest)]
-    vBaseline = vBaseline[~np.isnan(vBaseline)]
-    sta, p = scipy.stats.brunnermunzel(vInterest, vBaseline,
-                                       alternative="less")
-    sta2, p2 = scipy.stats.brunnermunzel(vInterest, vBaseline,
-                                         alternative="greater")
-    sta3, p3 = scipy.stats.brunnermunzel(vInterest, vBaseline,
-                                         alternative="two-sided")
+def compact_nan_rows(values: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Moves the non-NaN values of each row of a 2-D array to the left,
+    keeping their original order (NaN go to the right).
+    Returns the compacted array and the number of non-NaN values by row.
+    """
+    order = np.argsort(np.isnan(values), axis=1, kind="stable")
+    compacted = np.take_along_axis(values, order, axis=1)
+    counts = np.count_nonzero(~np.isnan(values), axis=1)
+    return compacted, counts
 
-    # best (smaller pvalue) among all tailed tests
-    pretups = [(sta, p), (sta2, p2), (sta3, p3)]
-    tups = []
-    for t in pretups:  # make list of tuples with no-nan pvalues
-        if not np.isnan(t[1]):
-            tups.append(t)
 
-    if len(tups) == 0:  # if all pvalues are nan assign two sided result
-        tups = [(sta3, p3)]
+def rows_with_ties(values: np.ndarray) -> np.array:
+    """
+    Returns a boolean array telling, for each row of a 2-D array, if
+    at least two non-NaN values are equal
+    """
+    sorted_values = np.sort(values, axis=1)
+    return (np.diff(sorted_values, axis=1) == 0).any(axis=1)
 
-    stap_tup = min(tups, key=lambda x: x[1])  # nan already excluded
-    stat_result = stap_tup[0]
-    pval_result = stap_tup[1]
 
-    return stat_result, pval_result
+def log_nonzero(values: np.array) -> np.array:
+    """
+    Natural logarithm of the values, zeros being replaced by the machine
+    epsilon (as in compute_gmean_nonan); NaN values stay NaN
+    """
+    return np.log(np.where(values == 0, np.finfo(float).eps, values))
+
+
+def row_wise_nangmean(values: np.ndarray, groups: List = None,
+                      min_valid: int = 1) -> np.array:
+    """
+    Geometric mean of each row of a 2-D array, NaN omitted, computed as
+    the exponential of the mean of the logarithms (as stats.gmean).
+    Zeros give 0 and negative values give NaN, as stats.gmean.
+     - groups: optional list of column indices (one element by group);
+       when given, returns a 2-D array with one column by group.
+     - min_valid: rows (of a group) having less non-NaN values than this
+       number get NaN. The bivariate analysis uses min_valid=2: the
+       geometric mean of a group is kept only if at least 2 samples have
+       values, e.g. [4.6, 6.5, NaN] gives gmean(4.6, 6.5) and
+       [NaN, NaN, 2] gives NaN (not 2).
+    """
+    values = np.asarray(values, dtype=float)
+    if groups is None:
+        return row_wise_nangmean(values, [np.arange(values.shape[1])],
+                                 min_valid)[:, 0]
+    result = np.full((values.shape[0], len(groups)), np.nan)
+    for j, columns in enumerate(groups):
+        compacted, counts = compact_nan_rows(values[:, columns])
+        # rows with the same number of values are summed over exactly
+        # those values, in their order: same result as stats.gmean
+        for n in np.unique(counts[counts >= max(min_valid, 1)]):
+            rows = counts == n
+            with np.errstate(divide="ignore", invalid="ignore"):
+                logs = np.log(np.ascontiguousarray(compacted[rows, :n]))
+                result[rows, j] = np.exp(np.mean(logs, axis=1))
+    return result
 
 
-def absolute_geommean_diff(b_values: np.array, a_values: np.array):
-    m_b = compute_gmean_nonan(b_values)
-    m_a = compute_gmean_nonan(a_values)
-    diff_absolute = abs(m_b - m_a)
+def correlation_rows(x: np.ndarray, y: np.ndarray,
+                     valid: Optional[np.ndarray] = None,
+                     method: str = "pearson") -> (np.array, np.array):
+    """
+    Pearson or Spearman correlation of each row of x with the same row
+    of y (2-D arrays), the 'valid' cells of each row being the paired
+    values (default: all, otherwise the rows can be padded), with the
+    same results as scipy.stats.pearsonr and spearmanr:
+    rows with NaN among their values, less than two values or a constant
+    input get NaN; p-values (two-sided) from the t distribution with n-2
+    degrees of freedom (as a beta distribution of r for pearson), 1 for
+    two values (pearson) or NaN (spearman).
+    Returns the arrays of coefficients and of p-values.
+    """
+    from scipy import special
+    assert method in ["pearson", "spearman"], \
+        f"unknown correlation method {method}"
+    if valid is None:
+        valid = np.ones(x.shape, dtype=bool)
+    x = np.where(valid, x, np.inf)
+    y = np.where(valid, y, np.inf)
+    if method == "spearman":
+        # padding (inf) is ranked after the values, leaving their ranks
+        x = np.where(np.isnan(x), np.nan, rank_rows_with_ties(x)[0])
+        y = np.where(np.isnan(y), np.nan, rank_rows_with_ties(y)[0])
+    n = valid.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_centered = np.where(valid, x - np.where(valid, x, 0).sum(
+            axis=1, keepdims=True) / n[:, np.newaxis], 0)
+        y_centered = np.where(valid, y - np.where(valid, y, 0).sum(
+            axis=1, keepdims=True) / n[:, np.newaxis], 0)
+        if method == "pearson":
+            # same order of operations as pearsonr (norms of scaled rows)
+            x_max = np.abs(x_centered).max(axis=1, keepdims=True)
+            y_max = np.abs(y_centered).max(axis=1, keepdims=True)
+            x_norm = x_max * np.linalg.norm(x_centered / x_max, axis=1,
+                                            keepdims=True)
+            y_norm = y_max * np.linalg.norm(y_centered / y_max, axis=1,
+                                            keepdims=True)
+            r = np.einsum("ij,ij->i", x_centered / x_norm,
+                          y_centered / y_norm)
+        else:
+            # same order of operations as numpy corrcoef (used by spearmanr)
+            r = (x_centered * y_centered).sum(axis=1) / (n - 1)
+            r /= np.sqrt((x_centered ** 2).sum(axis=1) / (n - 1))
+            r /= np.sqrt((y_centered ** 2).sum(axis=1) / (n - 1))
+        constant = (np.where(valid, x, -np.inf).max(axis=1) ==
+                    np.where(valid, x, np.inf).min(axis=1)) | \
+                   (np.where(valid, y, -np.inf).max(axis=1) ==
+                    np.where(valid, y, np.inf).min(axis=1))
+        r = np.clip(r, -1, 1)
+        r[(n < 2) | constant] = np.nan
+        if method == "pearson":
+            # r follows a beta distribution on (-1, 1), a = b = n/2 - 1
+            # (the t distribution of r * sqrt((n-2) / (1-r**2)))
+            ab = n / 2 - 1
+            p_values = 2 * special.betaincc(ab, ab, (np.abs(r) + 1) / 2)
+            two = (n == 2) & ~np.isnan(r)
+            r[two] = np.round(r[two])
+            p_values[two] = 1.0
+        else:
+            dof = n - 2
+            t = r * np.sqrt((dof / ((r + 1) * (1 - r))).clip(0))
+            p_values = 2 * special.stdtr(dof, -np.abs(t))
+            p_values[n == 2] = np.nan
+    return r, p_values
+
+
+def absolute_geommean_diff(b_values: np.array, a_values: np.array,
+                           axis: int = -1):
+    """
+    Absolute difference between the geometric means (zeros replaced by
+    epsilon, NaN omitted) of two groups of values.
+    The means are computed in log space along 'axis', thus it can be used
+    as a vectorized statistic (e.g. over a resamples axis).
+    """
+    m_b = np.exp(np.nanmean(log_nonzero(b_values), axis=axis))
+    m_a = np.exp(np.nanmean(log_nonzero(a_values), axis=axis))
+    diff_absolute = np.abs(m_b - m_a)
     return diff_absolute
 
 
@@ -475,6 +913,71 @@ def set_samples_names(frames_dict: Dict, metadata: pd.DataFrame) -> Dict:
     return frames_dict
 
 
+def split_samples_by_compartment(
+        df: pd.DataFrame, metadata: pd.DataFrame,
+        metadata_index: Optional[Dict[Tuple, np.ndarray]] = None) -> Dict:
+    """
+    One pass equivalent of df_to_dict_by_compartment followed by
+    drop_all_nan_metabolites_on_comp_frames and set_samples_names:
+    returns a dictionary of dataframes, each for one compartment, with the
+    rows having NaN in all the values dropped and the columns named as the
+    samples to plot (metabolites must be in rows).
+    When the values of df have a single dtype, the samples are grouped by
+    compartment in one block (no copy if they already are), and the
+    compartment dataframes are views into that block; only the compartments
+    having rows to drop are copied.
+    The samples of each compartment are looked up in the metadata_index
+    (see index_metadata), computed if not given.
+    """
+    if metadata_index is None:
+        metadata_index = index_metadata(metadata)
+    compartments = metadata['compartment'].unique()
+    samples_dict = {
+        compartment: metadata.iloc[
+            metadata_rows(metadata_index, compartment=compartment)][
+            ["original_name", "name_to_plot"]]
+        for compartment in compartments}
+    values = None
+    if len(set(df.dtypes)) == 1:
+        positions = np.array([df.columns.get_loc(name)
+                              for samples in samples_dict.values()
+                              for name in samples["original_name"]],
+                             dtype=int)
+        values = df.to_numpy()
+        if len(positions) > 0 and np.array_equal(
+                positions, np.arange(positions[0],
+                                     positions[0] + len(positions))):
+            values = values[:, positions[0]:positions[0] + len(positions)]
+        else:
+            values = values[:, positions]  # the one copy
+
+    output_dict = dict()
+    start = 0
+    for compartment, samples in samples_dict.items():
+        original_names = list(samples["original_name"])
+        if values is not None:
+            stop = start + len(original_names)
+            compartment_df = pd.DataFrame(values[:, start:stop],
+                                          index=df.index,
+                                          columns=original_names, copy=False)
+            start = stop
+        else:
+            compartment_df = df[original_names]
+        not_id = np.array([name != "ID" for name in original_names],
+                          dtype=bool)
+        if not_id.any():
+            keep_rows = compartment_df.notna().to_numpy()[:, not_id].any(
+                axis=1)
+            if not keep_rows.all():
+                compartment_df = compartment_df.take(
+                    np.flatnonzero(keep_rows))
+        compartment_df.columns = [
+            old if old == "ID" else new for old, new in
+            zip(original_names, samples["name_to_plot"])]
+        output_dict[compartment] = compartment_df
+    return output_dict
+
+
 def message_bad_separator_input(df: pd.DataFrame, type_df: str) -> None:
     error_message = (f"Error when reading input file of type '{type_df}': "
                      "possible wrong delimiter (tab is expected)")
@@ -496,16 +999,42 @@ def msg_correction_method_not_suitable(filename: str, test: str) -> str:
     return message
 
 
-def extfind(parent_folder_absolute, file_name):
-    repertoire_extension = supported_file_extension
-    out_str = ""
-    for x in repertoire_extension:
-        if not os.path.exists(
-                os.path.join(parent_folder_absolute,
-                             file_name + f".{x}")):
-            continue
-        else:
+def index_folder_files(folder_absolute: str) -> Dict[str, str]:
+    """
+    Scans the folder once, returns the dictionary {file name without
+    extension : extension} of the files having a supported extension
+    (when several files have the same name, the last supported extension
+    is kept)
+    """
+    try:
+        with os.scandir(folder_absolute) as entries:
+            file_names = [entry.name for entry in entries if entry.is_file()]
+    except OSError:
+        file_names = []
+    files_index: Dict[str, str] = dict()
+    for x in supported_file_extension:
+        suffix = f".{x}"
+        for name in file_names:
+            if name.endswith(suffix):
+                files_index[name[:-len(suffix)]] = x
+    return files_index
+
+
+def extfind(parent_folder_absolute, file_name,
+            files_index: Optional[Dict[str, str]] = None):
+    """
+    Extension of the file in the folder, taken from the files_index
+    (see index_folder_files) which is computed if not given. The file names
+    not in the index (e.g. with a sub-path, the index being of the top level
+    of the folder) are looked up on the file system
+    """
+    if files_index is None:
+        files_index = index_folder_files(parent_folder_absolute)
+    if file_name in files_index:
+        return files_index[file_name]
+    out_str = "csv"  # if none of the supported extensions, try this one
+    for x in supported_file_extension:
+        if os.path.exists(os.path.join(parent_folder_absolute,
+                                       file_name + f".{x}")):
             out_str = x
-    if out_str not in repertoire_extension:
-        out_str = "csv"  # if none of the supported extensions, try this one
     return out_str
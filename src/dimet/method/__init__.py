@@ -1,7 +1,7 @@
 ﻿import logging
 import os
 import sys
-from typing import Dict, Union
+from typing import Dict, List, Set, Union
 
 import hydra
 from omegaconf import DictConfig, ListConfig, OmegaConf, open_dict
@@ -10,24 +10,11 @@ from pydantic import BaseModel as PydanticBaseModel
 
 from dimet.constants import (assert_literal, availtest_methods,
                              columns_transcripts_config_keys,
-                             data_files_keys_type,
+                             data_files_keys, data_files_keys_type,
                              data_types_suitable_for_metabologram,
                              metabolites_values_for_metabologram)
 from dimet.data import DataIntegration, Dataset
 from dimet.helpers import flatten, msg_correction_method_not_suitable
-from dimet.processing.bivariate_analysis import bivariate_comparison
-from dimet.processing.differential_analysis import (differential_comparison,
-                                                    multi_group_compairson,
-                                                    time_course_analysis)
-from dimet.processing.pca_analysis import run_pca_analysis
-from dimet.visualization.abundance_bars import run_plot_abundance_bars
-from dimet.visualization.distr_fit_plot import run_distr_fit_plot
-from dimet.visualization.isotopologue_proportions import \
-    run_isotopologue_proportions_plot
-from dimet.visualization.mean_enrichment_line_plot import \
-    run_mean_enrichment_line_plot
-from dimet.visualization.metabologram import run_metabologram
-from dimet.visualization.pca_plot import run_pca_plot
 
 logger = logging.getLogger(__name__)
 
@@ -71,6 +58,13 @@ class DifferentialAnalysisConfig(MethodConfig):
     qualityDistanceOverSpan: float
     correction_method: str = "fdr_bh"
     impute_values: DictConfig
+    permutation_n_resamples: int = 9999  # prm-scipy test only
+    permutation_seed: Union[int, None] = 123
+    n_jobs: int = 1  # parallel comparisons, -1 for all the CPUs
+    fit_cache_dir: Union[str, None] = None  # disfit: on-disk fit cache
+    disfit_candidates: str = "all"  # or "fast"
+    disfit_n_jobs: int = 1  # processes fitting the distributions
+    disfit_timeout: Union[float, None] = None  # seconds by distribution
 
     def build(self) -> "DifferentialAnalysis":
         return DifferentialAnalysis(config=self)
@@ -148,6 +142,13 @@ class TimeCourseAnalysisConfig(MethodConfig):
     qualityDistanceOverSpan: float
     correction_method: str = "bonferroni"
     impute_values: DictConfig
+    permutation_n_resamples: int = 9999  # prm-scipy test only
+    permutation_seed: Union[int, None] = 123
+    n_jobs: int = 1  # parallel comparisons, -1 for all the CPUs
+    fit_cache_dir: Union[str, None] = None  # disfit: on-disk fit cache
+    disfit_candidates: str = "all"  # or "fast"
+    disfit_n_jobs: int = 1  # processes fitting the distributions
+    disfit_timeout: Union[float, None] = None  # seconds by distribution
 
     def build(self) -> "TimeCourseAnalysis":
         return TimeCourseAnalysis(config=self)
@@ -158,6 +159,10 @@ class DistrFitPlotConfig(MethodConfig):
     grouping: ListConfig = ["condition", "timepoint"]
     qualityDistanceOverSpan: float
     impute_values: DictConfig
+    fit_cache_dir: Union[str, None] = None  # disfit: on-disk fit cache
+    disfit_candidates: str = "all"  # or "fast"
+    disfit_n_jobs: int = 1  # processes fitting the distributions
+    disfit_timeout: Union[float, None] = None  # seconds by distribution
 
     def build(self) -> "DistrFitPlot":
         return DistrFitPlot(config=self)
@@ -171,6 +176,8 @@ class MetabologramIntegrationConfig(MethodConfig):
     qualityDistanceOverSpan: float
     correction_method: str = "fdr_bh"
     impute_values: DictConfig
+    permutation_n_resamples: int = 9999  # prm-scipy test only
+    permutation_seed: Union[int, None] = 123
     figure_format: str = "svg"
     abs_values_scale_color_bar: DictConfig
     colors_divergent_palette: ListConfig = ['royalblue', 'white', 'red']
@@ -191,6 +198,7 @@ class BivariateAnalysisConfig(MethodConfig):
     """
     correction_method: str = "fdr_bh"
     output_include_gmean_arr_columns: bool = True
+    n_jobs: int = 1  # parallel comparisons, -1 for all the CPUs
     conditions_MDV_comparison: Dict[str, str] = {
         'isotopologue_proportions': 'spearman'}
     timepoints_MDV_comparison: Dict[str, str] = {
@@ -207,6 +215,13 @@ class BivariateAnalysisConfig(MethodConfig):
 class Method(BaseModel):
     config: MethodConfig
 
+    def get_datatypes(self, cfg: DictConfig) -> Set[str]:
+        """
+        data types used by the method, the dataset reads these data files
+        beforehand (the others are read at the first access)
+        """
+        return set(data_files_keys)
+
     def plot(self):
         logger.info("Will plot the method, with the following config: %s",
                     self.config)
@@ -223,7 +238,11 @@ class Method(BaseModel):
 class AbundancePlot(Method):
     config: AbundancePlotConfig
 
+    def get_datatypes(self, cfg: DictConfig) -> Set[str]:
+        return {"abundances"}
+
     def run(self, cfg: DictConfig, dataset: Dataset) -> None:
+        from dimet.visualization.abundance_bars import run_plot_abundance_bars
         logger.info(
             "Will plot the abundance plot, with the following config: %s",
             self.config)
@@ -236,8 +255,8 @@ class AbundancePlot(Method):
                 cfg.analysis["metabolites"] = {}
                 for c in set(dataset.metadata_df['compartment']):
                     metabolites_compartment = \
-                        dataset.compartmentalized_dfs[
-                            'abundances'][c].index.to_list()
+                        dataset.get_compartmentalized_dfs(
+                            'abundances')[c].index.to_list()
                     cfg.analysis["metabolites"][c] = metabolites_compartment
 
         self.check_expectations(cfg, dataset)
@@ -282,7 +301,14 @@ class AbundancePlot(Method):
 class DifferentialAnalysis(Method):
     config: DifferentialAnalysisConfig
 
+    def get_datatypes(self, cfg: DictConfig) -> Set[str]:
+        statistical_test = cfg.analysis.get("statistical_test", None) or {}
+        return set(file_name for file_name, test in statistical_test.items()
+                   if test is not None)
+
     def run(self, cfg: DictConfig, dataset: Dataset) -> None:
+        from dimet.processing.differential_analysis import \
+            differential_comparison
         logger.info(f"The current working directory is {os.getcwd()}")
         logger.info("Current configuration is %s", OmegaConf.to_yaml(cfg))
         logger.info(
@@ -353,7 +379,12 @@ class DifferentialAnalysis(Method):
 class MultiGroupComparison(Method):
     config: MultiGroupComparisonConfig
 
+    def get_datatypes(self, cfg: DictConfig) -> Set[str]:
+        return set(cfg.analysis.get("datatypes", None) or [])
+
     def run(self, cfg: DictConfig, dataset: Dataset) -> None:
+        from dimet.processing.differential_analysis import \
+            multi_group_compairson
         logger.info(f"The current working directory is {os.getcwd()}")
         logger.info("Current configuration is %s", OmegaConf.to_yaml(cfg))
         logger.info(
@@ -398,7 +429,12 @@ class MultiGroupComparison(Method):
 class IsotopologueProportionsPlot(Method):
     config: IsotopologueProportionsPlotConfig
 
+    def get_datatypes(self, cfg: DictConfig) -> Set[str]:
+        return {"isotopologue_proportions"}
+
     def run(self, cfg: DictConfig, dataset: Dataset) -> None:
+        from dimet.visualization.isotopologue_proportions import \
+            run_isotopologue_proportions_plot
         logger.info(
             "Will perform isotopologue proportions stacked-bar plots, "
             "with the following config: %s", self.config)
@@ -410,14 +446,14 @@ class IsotopologueProportionsPlot(Method):
                 "No selected metabolites provided, plotting for all")
             with open_dict(cfg):
                 compartments = list(set(dataset.metadata_df['compartment']))
+                isotopologue_index = dataset.get_isotopologue_index()
                 cfg.analysis["metabolites"] = dict()
                 for c in compartments:
                     isotopologues_names = \
-                        dataset.compartmentalized_dfs[
-                            "isotopologue_proportions"][c].index.to_list()
-                    metabolites_c = set(
-                        [i.split("_m+")[0] for i in isotopologues_names]
-                    )
+                        dataset.get_compartmentalized_dfs(
+                            "isotopologue_proportions")[c].index
+                    metabolites_c = set(isotopologue_index.loc[
+                        isotopologues_names, "metabolite"])
                     cfg.analysis["metabolites"][c] = list(metabolites_c)
 
         self.check_expectations(cfg, dataset)
@@ -462,7 +498,12 @@ class IsotopologueProportionsPlot(Method):
 class MeanEnrichmentLinePlot(Method):
     config: MeanEnrichmentLinePlotConfig
 
+    def get_datatypes(self, cfg: DictConfig) -> Set[str]:
+        return {"mean_enrichment"}
+
     def run(self, cfg: DictConfig, dataset: Dataset) -> None:
+        from dimet.visualization.mean_enrichment_line_plot import \
+            run_mean_enrichment_line_plot
         logger.info("Will perform Mean Enrichment (syn. Fractional "
                     "Contributions) line-plot "
                     "with the following config: %s", self.config)
@@ -473,8 +514,8 @@ class MeanEnrichmentLinePlot(Method):
                 cfg.analysis["metabolites"] = {}
                 for c in set(dataset.metadata_df['compartment']):
                     cfg.analysis["metabolites"][c] = \
-                        dataset.compartmentalized_dfs[
-                            'mean_enrichment'][c].index.to_list()
+                        dataset.get_compartmentalized_dfs(
+                            'mean_enrichment')[c].index.to_list()
 
         self.check_expectations(cfg, dataset)
         out_plot_dir = os.path.join(os.getcwd(), cfg.figure_path)
@@ -518,7 +559,11 @@ class MeanEnrichmentLinePlot(Method):
 class PcaAnalysis(Method):
     config: PcaAnalysisConfig
 
+    def get_datatypes(self, cfg: DictConfig) -> Set[str]:
+        return {"abundances", "mean_enrichment"}
+
     def run(self, cfg: DictConfig, dataset: Dataset) -> None:
+        from dimet.processing.pca_analysis import run_pca_analysis
         logger.info("Will perform PCA analysis and save tables, "
                     "with the following config: %s", self.config)
         out_table_dir = os.path.join(os.getcwd(), cfg.table_path)
@@ -561,7 +606,12 @@ class PcaAnalysis(Method):
 class PcaPlot(Method):
     config: PcaPlotConfig
 
+    def get_datatypes(self, cfg: DictConfig) -> Set[str]:
+        return {"abundances", "mean_enrichment"}
+
     def run(self, cfg: DictConfig, dataset: Dataset) -> None:
+        from dimet.processing.pca_analysis import run_pca_analysis
+        from dimet.visualization.pca_plot import run_pca_plot
         logger.info("Will perform PCA plots and save figures, "
                     "with the following config: %s", self.config)
         out_plot_dir = os.path.join(os.getcwd(), cfg.figure_path)
@@ -614,7 +664,14 @@ class PcaPlot(Method):
 
 
 class TimeCourseAnalysis(Method):
+    def get_datatypes(self, cfg: DictConfig) -> Set[str]:
+        statistical_test = cfg.analysis.get("statistical_test", None) or {}
+        return set(file_name for file_name, test in statistical_test.items()
+                   if test is not None)
+
     def run(self, cfg: DictConfig, dataset: Dataset) -> None:
+        from dimet.processing.differential_analysis import \
+            time_course_analysis
         logger.info(f"The current working directory is {os.getcwd()}")
         logger.info("Current configuration is %s", OmegaConf.to_yaml(cfg))
         logger.info(
@@ -669,7 +726,13 @@ class TimeCourseAnalysis(Method):
 class DistrFitPlot(Method):
     config: DistrFitPlotConfig
 
+    def get_datatypes(self, cfg: DictConfig) -> Set[str]:
+        statistical_test = cfg.analysis.get("statistical_test", None) or {}
+        return set(file_name for file_name, test in statistical_test.items()
+                   if test == "disfit")
+
     def run(self, cfg: DictConfig, dataset: Dataset) -> None:
+        from dimet.visualization.distr_fit_plot import run_distr_fit_plot
         logger.info(f"The current working directory is {os.getcwd()}")
         logger.info("Current configuration is %s", OmegaConf.to_yaml(cfg))
         logger.info(
@@ -712,7 +775,12 @@ class DistrFitPlot(Method):
 class MetabologramIntegration(Method):
     config: MetabologramIntegrationConfig
 
+    def get_datatypes(self, cfg: DictConfig) -> Set[str]:
+        # the data are read in the data integration object, see run
+        return set()
+
     def run(self, cfg: DictConfig, dataset: Dataset) -> None:
+        from dimet.visualization.metabologram import run_metabologram
         logger.info(f"The current working directory is {os.getcwd()}")
         logger.info("Current configuration is %s", OmegaConf.to_yaml(cfg))
         logger.info("Will perform metabologram, "
@@ -720,7 +788,8 @@ class MetabologramIntegration(Method):
         # 'data_integration' (data for integration) inherits from dataset
         data_integration: DataIntegration = DataIntegration(
             config=hydra.utils.instantiate(cfg.analysis.dataset))
-        data_integration.set_dataset_integration_config()
+        data_integration.set_dataset_integration_config(
+            datatypes=set(cfg.analysis.get("statistical_test", None) or {}))
         data_integration.load_deg_dfs()
         data_integration.load_pathways_dfs()
 
@@ -881,6 +950,9 @@ class MetabologramIntegration(Method):
 class BivariateAnalysis(Method):
     config: BivariateAnalysisConfig
 
+    def get_datatypes(self, cfg: DictConfig) -> Set[str]:
+        return {"isotopologue_proportions", "abundances", "mean_enrichment"}
+
     @staticmethod
     def replace_test__if_user_external_config(cfg):
         """
@@ -909,6 +981,8 @@ class BivariateAnalysis(Method):
         - timepoints_MDV_comparison
         - conditions_metabolite_time_profiles
         """
+        from dimet.processing.bivariate_analysis import \
+            schedule_bivariate_comparisons
         logger.info(f"The current working directory is {os.getcwd()}")
 
         cfg = self.replace_test__if_user_external_config(cfg)
@@ -923,24 +997,23 @@ class BivariateAnalysis(Method):
 
         self.check_expectations(cfg, dataset)
 
+        # all the behaviors of all the files are run together (see n_jobs)
+        behaviors_by_file: Dict[str, List[str]] = dict()
         datatype_mdv = "isotopologue_proportions"
         if datatype_mdv in dataset.compartmentalized_dfs.keys():
             logger.info(f"Running bi-variate analysis with "
                         f"{datatype_mdv}:")
+            behaviors_mdv = list()
             if len(cfg.analysis.conditions) >= 2:
                 logger.info("assessing MDV (Mass Distribution Vector) "
                             "between conditions")
-                bivariate_comparison(
-                    datatype_mdv, dataset, cfg,
-                    behavior="conditions_MDV_comparison",
-                    out_table_dir=out_table_dir)
+                behaviors_mdv.append("conditions_MDV_comparison")
             if len(dataset.metadata_df["timepoint"].unique()) >= 2:
                 logger.info("assessing MDV (Mass Distribution Vector) "
                             "between time-points")
-                bivariate_comparison(
-                    datatype_mdv, dataset, cfg,
-                    behavior="timepoints_MDV_comparison",
-                    out_table_dir=out_table_dir)
+                behaviors_mdv.append("timepoints_MDV_comparison")
+            if len(behaviors_mdv) > 0:
+                behaviors_by_file[datatype_mdv] = behaviors_mdv
 
         if (len(cfg.analysis.conditions) >= 2) and (
            len(dataset.metadata_df["timepoint"].unique()) >= 2):
@@ -949,10 +1022,11 @@ class BivariateAnalysis(Method):
                     logger.info(f"Running bi-variate analysis with "
                                 f"{datatype} to compare "
                                 f"time course profiles between conditions")
-                    bivariate_comparison(
-                        datatype, dataset, cfg,
-                        behavior="conditions_metabolite_time_profiles",
-                        out_table_dir=out_table_dir)
+                    behaviors_by_file[datatype] = [
+                        "conditions_metabolite_time_profiles"]
+
+        schedule_bivariate_comparisons(behaviors_by_file, dataset, cfg,
+                                       out_table_dir)
 
     def check_expectations(self, cfg: DictConfig, dataset: Dataset) -> None:
         # check that necessary information is provided in the analysis config
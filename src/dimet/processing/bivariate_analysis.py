@@ -5,162 +5,213 @@
 """
 import logging
 import os
-from typing import Dict, List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 import numpy as np
 import pandas as pd
-import scipy.stats as stats
 from omegaconf import DictConfig
 
 from dimet.constants import (assert_literal,
                              data_files_keys_type)
 from dimet.data import Dataset
 from dimet.helpers import (arg_repl_zero2value,
-                           compute_padj,
-                           row_wise_nanstd_reduction)
+                           compute_padj, correlation_rows,
+                           index_isotopologues, index_metadata,
+                           metadata_rows, row_wise_nangmean,
+                           row_wise_nanstd_reduction, samples_positions)
 
 
 logger = logging.getLogger(__name__)
 
 
-def compute_statistical_correlation(df: pd.DataFrame,
+class RaggedArrays(NamedTuple):
+    """
+    Arrays of different lengths (e.g. one MDV by metabolite) stored in a
+    single flat buffer of values: the array i is
+    values[offsets[i]:offsets[i + 1]]
+    """
+    values: np.ndarray
+    offsets: np.ndarray
+
+    @classmethod
+    def from_arrays(cls, arrays: List[np.array]) -> "RaggedArrays":
+        arrays = [np.asarray(a, dtype=float).ravel() for a in arrays]
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        np.cumsum([a.size for a in arrays], out=offsets[1:])
+        values = np.concatenate(arrays) if len(arrays) > 0 else np.empty(0)
+        return cls(values, offsets)
+
+    @classmethod
+    def from_matrix(cls, matrix: np.ndarray) -> "RaggedArrays":
+        """The rows of a 2-D array, all of the same length"""
+        matrix = np.asarray(matrix, dtype=float)
+        n_rows, width = matrix.shape
+        return cls(matrix.ravel(), np.arange(n_rows + 1) * width)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def array(self, i: int) -> np.ndarray:
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def rows_of_length(self, rows: np.ndarray, length: int) -> np.ndarray:
+        """The arrays i in rows, all of this length, as a 2-D array"""
+        return self.values[self.offsets[rows][:, np.newaxis] +
+                           np.arange(length)]
+
+    def to_strings(self) -> List[str]:
+        """The arrays as text for the output tables, e.g. '[0.1 0.25 nan]'"""
+        texts = self.values.astype(str)
+        return ["[" + " ".join(texts[start:end]) + "]"
+                for start, end in zip(self.offsets[:-1], self.offsets[1:])]
+
+
+class GmeanArrays(NamedTuple):
+    """
+    By metabolite, the arrays of geometric means of the two groups compared
+    (e.g. MDV of two conditions, ordered by m+x)
+    """
+    metabolite: List[str]
+    gmean_arr_1: RaggedArrays
+    gmean_arr_2: RaggedArrays
+
+
+def compute_statistical_correlation(gmean_arrays: GmeanArrays,
                                     test: str) -> pd.DataFrame:
     """
     computes correlation test,  e.g. pearson
-    row-wise for each dataframe
-    """
-    stat_list = []
-    pvalue_list = []
-    for i, metabolite in enumerate(list(df['metabolite'])):
-        # array of n (timepoints or m+x) geometrical means values
-        array_1 = df.loc[metabolite, "gmean_arr_1"]
-        array_2 = df.loc[metabolite, "gmean_arr_2"]
-        if test == "pearson":
-            try:
-                stat_res, pvalue = stats.pearsonr(array_1, array_2)
-            except ValueError:
-                stat_res, pvalue = (np.nan, np.nan)
-
-        elif test == "spearman":
-            try:
-                stat_res, pvalue = stats.spearmanr(array_1, array_2)
-            except ValueError:
-                stat_res, pvalue = (np.nan, np.nan)
-
-        stat_list.append(stat_res)
-        if np.isnan(stat_res):
-            pvalue_list.append(np.nan)
-        else:
-            pvalue_list.append(pvalue)
-
-    df["correlation_coefficient"] = stat_list
-    df["pvalue"] = pvalue_list
+    row-wise for each pair of arrays: the arrays having the same length
+    are tested together
+    """
+    arrays_1, arrays_2 = gmean_arrays.gmean_arr_1, gmean_arrays.gmean_arr_2
+    lengths = arrays_1.lengths
+    stat_list = np.full(len(lengths), np.nan)
+    pvalue_list = np.full(len(lengths), np.nan)
+    # arrays of different lengths can not be paired: NaN
+    paired = lengths == arrays_2.lengths
+    for length in np.unique(lengths[paired]):
+        rows = np.flatnonzero(paired & (lengths == length))
+        stat_list[rows], pvalue_list[rows] = correlation_rows(
+            arrays_1.rows_of_length(rows, length),
+            arrays_2.rows_of_length(rows, length), method=test)
+
+    df = pd.DataFrame({"metabolite": gmean_arrays.metabolite,
+                       "correlation_coefficient": stat_list,
+                       "pvalue": pvalue_list})
+    df.index = df['metabolite']
 
     return df
 
 
-def compute_test_for_df_dict(df_dict: Dict[str, pd.DataFrame],
+def compute_test_for_df_dict(df_dict: Dict[str, GmeanArrays],
                              test: str) -> Dict[str, pd.DataFrame]:
-    """parses a dictionary of dataframes
+    """parses a dictionary of geometric means arrays
        computes bivariate test : e.g. pearson
     """
-    for akey in df_dict.keys():
-        df = df_dict[akey].copy()
-        df.index = df['metabolite']
-
-        df_dict[akey] = compute_statistical_correlation(df, test)
-
-    return df_dict
+    return {akey: compute_statistical_correlation(gmean_arrays, test)
+            for akey, gmean_arrays in df_dict.items()}
 
 
 def compute_bivariate_by_behavior(
         df: pd.DataFrame, metadata_df: pd.DataFrame, comparison: List[str],
-        behavior: str, test: str) -> Dict[str, pd.DataFrame]:
+        behavior: str, test: str,
+        isotopologue_index: Optional[pd.DataFrame] = None
+) -> Tuple[Dict[str, GmeanArrays], Dict[str, pd.DataFrame]]:
     """
     performs two steps:
-    1. calls functions to compute geometric means, obtaining df's inside dict
+    1. calls functions to compute geometric means, obtaining the arrays
+       inside dict
     2. computes the bivariate statistical test
+    Returns both dicts (arrays, results), having the same keys
     """
     if behavior == "conditions_MDV_comparison":
-        df_dict = conditions_MDV_gmean_df_dict(df, metadata_df, comparison)
+        gmean_dict = conditions_MDV_gmean_df_dict(
+            df, metadata_df, comparison, isotopologue_index)
 
     elif behavior == "timepoints_MDV_comparison":
-        df_dict = timepoints_MDV_gmean_df_dict(df, metadata_df, comparison)
+        gmean_dict = timepoints_MDV_gmean_df_dict(
+            df, metadata_df, comparison, isotopologue_index)
 
     elif behavior == "conditions_metabolite_time_profiles":
         # only abundances or mean enrichment processed
-        df_dict = metabolite_time_profiles_gmean_df_dict(
+        gmean_dict = metabolite_time_profiles_gmean_df_dict(
             df, metadata_df, comparison)
 
     # 2. compute the statistical test
-    df_dict = compute_test_for_df_dict(df_dict, test)
+    df_dict = compute_test_for_df_dict(gmean_dict, test)
 
-    return df_dict
+    return gmean_dict, df_dict
 
 
-def conditions_MDV_gmean_df_dict(df: pd.DataFrame, metadata_df: pd.DataFrame,
-                                 comparison: List[str]
-                                 ) -> Dict[str, pd.DataFrame]:
+def conditions_MDV_gmean_df_dict(
+        df: pd.DataFrame, metadata_df: pd.DataFrame, comparison: List[str],
+        isotopologue_index: Optional[pd.DataFrame] = None
+) -> Dict[str, GmeanArrays]:
     """
     Note: e.g. comparison [Ctl, Treated1]
     Separately by time-point:
     Using isotopologue proportions, by metabolite and condition,
      computes the arrays of geometric means, ordered by m+x.
-     Outputs dict of df, each df with columns arr_1 and arr_2 (np arrays);
+     Outputs dict of GmeanArrays (gmean_arr_1 and gmean_arr_2);
              the keys of the dict are the time-points
+    isotopologue_index: see index_isotopologues in helpers (computed from
+             the rows of df if not given)
     """
-    clue_isotopologue_df = compute_isotopologue_meaning(list(df.index))
+    clue_isotopologue_df = compute_isotopologue_meaning(
+        list(df.index), isotopologue_index)
     metabolites_uniq = clue_isotopologue_df["metabolite"].unique()
+    metadata_index = index_metadata(metadata_df)
+    positions = samples_positions(df, metadata_df['name_to_plot'])
     df_dict = dict()
     for timepoint in list(metadata_df["timepoint"].unique()):
         inner_gmean_dict = {"metabolite": metabolites_uniq,
                             "gmean_arr_1": list(),  "gmean_arr_2": list()}
-        metadata_df_tp = metadata_df.loc[
-                         metadata_df["timepoint"] == timepoint, :]
-        df_timepoint = df[metadata_df_tp['name_to_plot']].copy()
         for k, condition in enumerate(comparison):
-            metadata_df_tp_cond = metadata_df_tp.loc[
-                                  metadata_df_tp["condition"] == condition, :]
-            df_one_group = df_timepoint[
-                metadata_df_tp_cond['name_to_plot']].copy()
+            rows = metadata_rows(metadata_index, condition=condition,
+                                 timepoint=timepoint)
+            df_one_group = df.take(positions[rows], axis=1)
 
             inner_gmean_dict = inner_gmean_dict_filler(
                 k, inner_gmean_dict, df_one_group, clue_isotopologue_df)
 
-        df_dict[timepoint] = pd.DataFrame(inner_gmean_dict)
+        df_dict[timepoint] = GmeanArrays(**inner_gmean_dict)
 
     return df_dict
 
 
-def timepoints_MDV_gmean_df_dict(df: pd.DataFrame, metadata_df: pd.DataFrame,
-                                 comparison: List[str]
-                                 ) -> Dict[str, pd.DataFrame]:
+def timepoints_MDV_gmean_df_dict(
+        df: pd.DataFrame, metadata_df: pd.DataFrame, comparison: List[str],
+        isotopologue_index: Optional[pd.DataFrame] = None
+) -> Dict[str, GmeanArrays]:
     """
     Note: e.g. comparison [T1, T0]
     Separately by condition:
      Using isotopologue proportions, by metabolite and time-point,
      computes the arrays of geometric means, ordered by m+x.
-     Outputs dict of df, the keys of the dict are the conditions
+     Outputs dict of GmeanArrays, the keys of the dict are the conditions
+    isotopologue_index: see index_isotopologues in helpers (computed from
+             the rows of df if not given)
     """
-    clue_isotopologue_df = compute_isotopologue_meaning(list(df.index))
+    clue_isotopologue_df = compute_isotopologue_meaning(
+        list(df.index), isotopologue_index)
     metabolites_uniq = clue_isotopologue_df["metabolite"].unique()
+    metadata_index = index_metadata(metadata_df)
+    positions = samples_positions(df, metadata_df['name_to_plot'])
     df_dict = dict()
     for condition in list(metadata_df['condition'].unique()):
-        metadata_df_sub1 = metadata_df.loc[
-                         metadata_df["condition"] == condition, :]
-
-        df_sub1 = df[metadata_df_sub1['name_to_plot']].copy()
         inner_gmean_dict = {"metabolite": metabolites_uniq,
                             "gmean_arr_1": list(), "gmean_arr_2": list()}
 
         for k, timepoint in enumerate(comparison):
-            metadata_df_a_gr = metadata_df_sub1.loc[
-                               metadata_df_sub1["timepoint"] == timepoint, :]
-            df_a_group = df_sub1[metadata_df_a_gr['name_to_plot']].copy()
+            rows = metadata_rows(metadata_index, condition=condition,
+                                 timepoint=timepoint)
+            df_a_group = df.take(positions[rows], axis=1)
             inner_gmean_dict = inner_gmean_dict_filler(
                 k, inner_gmean_dict, df_a_group, clue_isotopologue_df)
 
-        df_dict[condition] = pd.DataFrame(inner_gmean_dict)
+        df_dict[condition] = GmeanArrays(**inner_gmean_dict)
 
     return df_dict
 
@@ -168,112 +219,94 @@ def timepoints_MDV_gmean_df_dict(df: pd.DataFrame, metadata_df: pd.DataFrame,
 def inner_gmean_dict_filler(
         k: int, inner_gmean_dict: Dict[str, List[None]],
         df_a_group: pd.DataFrame,   clue_isotopologue_df: pd.DataFrame
-) -> Dict[str, List[np.array]]:
+) -> Dict[str, RaggedArrays]:
     """
     For MDV, fills the dictionary (of one single condition or time point)
     inner_gmean_dict = {"metabolite": metabolites_uniq,
                           "gmean_arr_1": list(), "gmean_arr_2": list()}, where
     this function replaces (fills) 'gmean_arr_..' lists only.
     output:  inner_gmean_dict, filled:
-        'gmean_arr_..' list of np.arrays (one np.array by metabolite),
+        'gmean_arr_..' RaggedArrays (one array by metabolite),
         (respects the order of the metabolites in the 'metabolite' key).
         Note: each elem in np. array respects the order of isotopologues m+x.
     """
     assert k in [0, 1], "k can only take value 0 or 1"
-    metabolites_uniq = clue_isotopologue_df["metabolite"].unique()
     # compute the arrays of geometric means
-    df_a_group["gmean"] = np.around(df_a_group.apply(
-        lambda x: stats.gmean(x.dropna()), axis=1), decimals=6)
-    df_a_group['gmean'] = modify_gmean_by_sanity(df_a_group)
-    df_a_group["isotopologue_name"] = list(df_a_group.index)
-    # order these geometric means by m+x
-    merged_df = pd.merge(df_a_group, clue_isotopologue_df, how='left',
-                         on="isotopologue_name").sort_values(
-                         by=["metabolite", "m+x"])
-    MDV_ordered_list_gmeans = list()
-    for i, metabolite in enumerate(metabolites_uniq):
-        mdv_arr = merged_df.loc[merged_df["metabolite"] == metabolite,
-                                "gmean"].values
-        MDV_ordered_list_gmeans.append(np.array(mdv_arr))
+    # (NaN if less than 2 no-NaN samples)
+    gmeans = np.around(row_wise_nangmean(
+        df_a_group.to_numpy(dtype=float), min_valid=2), decimals=6)
+    # a single sort of the isotopologues by metabolite (in the order of
+    # the 'metabolite' key) and m+x: the MDV of each metabolite is then a
+    # contiguous slice of the geometric means, delimited by offsets
+    codes, _ = pd.factorize(clue_isotopologue_df["metabolite"])
+    order = np.lexsort((clue_isotopologue_df["m+x"].to_numpy(), codes))
+    positions = df_a_group.index.get_indexer(
+        clue_isotopologue_df["isotopologue_name"].to_numpy()[order])
+    offsets = np.zeros(codes.max(initial=-1) + 2, dtype=np.int64)
+    np.cumsum(np.bincount(codes), out=offsets[1:])
     key_name = f'gmean_arr_{k + 1}'
-    inner_gmean_dict[key_name] = MDV_ordered_list_gmeans
+    inner_gmean_dict[key_name] = RaggedArrays(
+        np.where(positions >= 0, gmeans[positions], np.nan), offsets)
 
     return inner_gmean_dict
 
 
-def modify_gmean_by_sanity(df: pd.DataFrame) -> np.array:
-    """
-    Accepts the df of samples of one single group, with gmean column (last).
-    If at least 2 no-NaN samples, gmean value is preserved,
-     otherwise gmean value is replaced by np.nan.
-    """
-    gmean_values = df["gmean"].to_numpy()
-    df_samples = df.drop(columns=["gmean"])
-    # Count non-NaN cells for each  row
-    no_nan_count = df_samples.count(axis=1).to_numpy()
-    for i in range(len(gmean_values)):
-        if no_nan_count[i] < 2:
-            gmean_values[i] = np.nan
-    return gmean_values
-
-
 def metabolite_time_profiles_gmean_df_dict(
         df: pd.DataFrame, metadata_df: pd.DataFrame, comparison: List[str]
-) -> Dict[str, pd.DataFrame]:
+) -> Dict[str, GmeanArrays]:
     """
     Using mean enrichment or abundances,
     computes the arrays of geometric means, ordered by time.
-    Outputs dict of df of arrays, for comparing 2 condition time profiles.
+    Outputs dict of GmeanArrays, for comparing 2 condition time profiles.
     """
     metadata_df = metadata_df.loc[
                   metadata_df['condition'].isin(comparison), :]
     metadata_df['timenum'] = metadata_df['timenum'].astype(float)
     metadata_df_sorted = metadata_df.sort_values(by="timenum")
-    df = df[metadata_df_sorted['name_to_plot']]
+    metadata_index = index_metadata(metadata_df_sorted)
+    timepoints = metadata_df_sorted['timepoint'].to_numpy()
+    # samples in the order of metadata_df_sorted
+    values = df.take(samples_positions(
+        df, metadata_df_sorted['name_to_plot']), axis=1).to_numpy(dtype=float)
     metabolites = list(df.index)
     inner_gmean_dict = {"metabolite": metabolites,
                         "gmean_arr_1": list(), "gmean_arr_2": list()}
     for k, condition in enumerate(comparison):
-        metadata_sorted2 = metadata_df_sorted.loc[
-                metadata_df_sorted["condition"] == condition, :].copy()
+        condition_rows = metadata_rows(metadata_index, condition=condition)
         tmp_gmean_time_dict = {}
-        for curr_time in list(metadata_sorted2['timepoint'].unique()):
-            metadata_sorted3 = metadata_sorted2.loc[
-                metadata_sorted2['timepoint'] == curr_time, :].copy()
-            data_time_df = df[metadata_sorted3['name_to_plot']].copy()
-            data_time_df = data_time_df.assign(
-                gmean=data_time_df.apply(lambda x: stats.gmean(x.dropna()),
-                                         axis=1))
-            data_time_df['gmean'] = modify_gmean_by_sanity(data_time_df)
-            tmp_gmean_time_dict[curr_time] = data_time_df["gmean"].tolist()
+        for curr_time in list(pd.unique(timepoints[condition_rows])):
+            rows = metadata_rows(metadata_index, condition=condition,
+                                 timepoint=curr_time)
+            data_time = values[:, rows]
+            tmp_gmean_time_dict[curr_time] = row_wise_nangmean(
+                data_time, min_valid=2).tolist()
         tmp_df = pd.DataFrame(tmp_gmean_time_dict)
         #  tmp_df :   T0       T2h  ...
         # 0  0.471528  0.719920  ...
         # 1  3.692766  1.743812   ...
         key_name = f'gmean_arr_{k + 1}'
-        inner_gmean_dict[key_name] = list(np.around(tmp_df.to_numpy(), 6))
+        inner_gmean_dict[key_name] = RaggedArrays.from_matrix(
+            np.around(tmp_df.to_numpy(), 6))
 
-    return {'metabo_time_profile': pd.DataFrame(inner_gmean_dict)}
+    return {'metabo_time_profile': GmeanArrays(**inner_gmean_dict)}
 
 
-def compute_isotopologue_meaning(isotopologues_list: List[str]
-                                 ) -> pd.DataFrame:
+def compute_isotopologue_meaning(
+        isotopologues_list: List[str],
+        isotopologue_index: Optional[pd.DataFrame] = None) -> pd.DataFrame:
     """output: df :
     isotopologue_name  metabolite  m+x
     Cit_m+0            Cit         0
     ...
+    the names are parsed once by dataset, in isotopologue_index (see
+    index_isotopologues in helpers), otherwise here
     """
-    isotopologues_uniq = sorted(list(np.unique(np.array(isotopologues_list))))
-    clue_isotopologue = pd.DataFrame({
-        "isotopologue_name": isotopologues_uniq
-    })
-    clue_isotopologue[["metabolite", "m+x"]] = (
-        clue_isotopologue["isotopologue_name"].str.split(
-         "_m+", expand=True, regex=False))
-    clue_isotopologue["m+x"] = clue_isotopologue["m+x"].astype(int)
-    clue_isotopologue = clue_isotopologue.sort_values(
-        by=["metabolite", "m+x"])
-    return clue_isotopologue
+    if isotopologue_index is None:
+        isotopologue_index = index_isotopologues(isotopologues_list)
+    clue_isotopologue = isotopologue_index.loc[
+        isotopologue_index.index.isin(isotopologues_list),
+        ["metabolite", "m+x"]]
+    return clue_isotopologue.reset_index()
 
 
 def conditions_to_comparisons(conditions: List[str]) -> List[List[str]]:
@@ -328,22 +361,29 @@ def set_comparisons_by_behavior(behavior: str, cfg: DictConfig,
     return comparisons
 
 
-def save_output(result_df: pd.DataFrame, compartment: str, dataset: Dataset,
+def save_output(result_df: pd.DataFrame, gmean_arrays: GmeanArrays,
+                compartment: str, dataset: Dataset,
                 file_name: data_files_keys_type, out_file_name_str: str,
-                test: str, out_table_dir: str, cfg: DictConfig) -> None:
-    """saves result to tab delimited file, for one comparison"""
-
-    result = result_df.sort_values(["correlation_coefficient", "padj"],
-                                   ascending=True)
+                test: str, out_table_dir: str, cfg: DictConfig) -> str:
+    """
+    saves result to tab delimited file, for one comparison
+    (result_df rows in the order of the metabolites of gmean_arrays)
+    Returns the path of the written table.
+    """
+    out_order_columns = ['correlation_coefficient', 'pvalue',
+                         'padj', 'compartment']
+    result = result_df.assign(compartment=compartment)
+    if cfg.analysis.method.output_include_gmean_arr_columns:
+        out_order_columns += ['gmean_arr_1', 'gmean_arr_2']
+        result = result.assign(
+            gmean_arr_1=gmean_arrays.gmean_arr_1.to_strings(),
+            gmean_arr_2=gmean_arrays.gmean_arr_2.to_strings())
+    result = result.sort_values(["correlation_coefficient", "padj"],
+                                ascending=True)
     for name_col in ['correlation_coefficient', 'pvalue', 'padj']:
         result[name_col] = np.around(result[name_col].to_numpy(), 6)
 
-    result['compartment'] = compartment
-    out_order_columns = ['correlation_coefficient', 'pvalue',
-                         'padj', 'compartment', 'gmean_arr_1', 'gmean_arr_2']
     result = result[out_order_columns]  # fix the order of columns
-    if not cfg.analysis.method.output_include_gmean_arr_columns:
-        result = result.drop(columns=['gmean_arr_1', 'gmean_arr_2'])
 
     base_file_name = dataset.get_file_for_label(file_name)
     base_file_name += f"--{compartment}-{out_file_name_str}-{test}"
@@ -354,13 +394,15 @@ def save_output(result_df: pd.DataFrame, compartment: str, dataset: Dataset,
         index_label="metabolite", header=True, sep="\t"
     )
     logger.info(f"Saved the result in {output_file_name}")
+    return output_file_name
 
 
 def bivariate_run_and_save_current_comparison(
         file_name: data_files_keys_type, df: pd.DataFrame,
         metadata_df: pd.DataFrame, compartment: str, dataset: Dataset,
         cfg: DictConfig, comparison: List[str],
-        behavior: str, test: str, out_table_dir: str) -> None:
+        behavior: str, test: str, out_table_dir: str,
+        isotopologue_index: Optional[pd.DataFrame] = None) -> List[str]:
     """
     Runs a bivariate analysis for blocks of values, handling 3 behavior types:
     a - conditions_MDV_comparison:
@@ -373,10 +415,12 @@ def bivariate_run_and_save_current_comparison(
         comparison of the time course profiles of the metabolites
         total abundances and mean enrichment, between two conditions
     Finally, computes correction for multiple tests, and saves results
+    Returns the paths of the written tables.
     """
-    df_dict = compute_bivariate_by_behavior(
-         df, metadata_df, comparison, behavior, test
+    gmean_dict, df_dict = compute_bivariate_by_behavior(
+         df, metadata_df, comparison, behavior, test, isotopologue_index
     )
+    output_files = list()
     for akey in df_dict.keys():
         df = df_dict[akey]
 
@@ -391,32 +435,28 @@ def bivariate_run_and_save_current_comparison(
         if akey == "metabo_time_profile":
             out_file_name_str = f"{comparison_str}"
 
-        save_output(result_df, compartment, dataset, file_name,
-                    out_file_name_str, test, out_table_dir, cfg)
+        output_files.append(save_output(
+            result_df, gmean_dict[akey], compartment, dataset, file_name,
+            out_file_name_str, test, out_table_dir, cfg))
+    return output_files
 
 
-def bivariate_comparison(
-        file_name: data_files_keys_type, dataset: Dataset, cfg: DictConfig,
-        behavior: str, out_table_dir: str
-) -> None:
+def prepare_compartment_dfs(
+        file_name: data_files_keys_type, dataset: Dataset, cfg: DictConfig
+) -> Dict[str, Tuple[pd.DataFrame, pd.DataFrame]]:
     """
-    Bi-variate analysis is performed on compartmentalized versions
-    of data files
-    Attention: we replace zero values using the provided method
-    Writes the table with computed statistics in the relevant output directory
+    By compartment: the dataframe of the samples of the analysis conditions,
+    the zero values replaced using the provided method (and reduced if
+    abundances), and the metadata of these samples.
+    Computed once by file, shared by all the behaviors and comparisons.
     """
-    assert_literal(file_name, data_files_keys_type, "file name")
-    assert behavior in ["conditions_metabolite_time_profiles",
-                        "conditions_MDV_comparison",
-                        "timepoints_MDV_comparison"], "wrong behavior chosen"
     impute_value = cfg.analysis.method.impute_values[file_name]
-    test = cfg.analysis.method[behavior][file_name]  # e.g. pearson
-
+    compartment_dfs = dict()
     for compartment, compartmentalized_df in \
-            dataset.compartmentalized_dfs[file_name].items():
+            dataset.get_compartmentalized_dfs(file_name).items():
         df = compartmentalized_df
-        metadata_df_subset = dataset.metadata_df.loc[
-            dataset.metadata_df['compartment'] == compartment, :]
+        metadata_df_subset = dataset.get_metadata_rows(
+            compartment=compartment)
         metadata_df_subset = metadata_df_subset.loc[
             metadata_df_subset['condition'].isin(cfg.analysis.conditions), :]
 
@@ -428,14 +468,109 @@ def bivariate_comparison(
         if file_name == "abundances":  # only reduction values if abundances
             df = row_wise_nanstd_reduction(df)
         df = df.round(decimals=6)
+        compartment_dfs[compartment] = (df, metadata_df_subset)
+    return compartment_dfs
+
+
+# set once in each worker process by the pool initializer: the prepared
+# compartment dataframes (by file) and the arguments shared by all the tasks
+bivariate_worker_context: Dict = dict()
+
+
+def init_bivariate_worker(context: Dict) -> None:
+    bivariate_worker_context.update(context)
+
+
+def run_bivariate_task(context: Dict, file_name: data_files_keys_type,
+                       behavior: str, compartment: str,
+                       comparison: List[str]) -> List[str]:
+    """Runs one file x behavior x compartment x comparison task"""
+    df, metadata_df = context["compartment_dfs"][file_name][compartment]
+    cfg = context["cfg"]
+    isotopologue_index = None
+    if behavior != "conditions_metabolite_time_profiles":  # MDV
+        isotopologue_index = context["isotopologue_index"]
+    return bivariate_run_and_save_current_comparison(
+        file_name, df, metadata_df, compartment, context["dataset"], cfg,
+        comparison,
+        behavior,  # specifies the type of comparison
+        cfg.analysis.method[behavior][file_name],  # test, e.g. pearson
+        context["out_table_dir"], isotopologue_index)
+
+
+def run_bivariate_task_in_worker(
+        file_name: data_files_keys_type, behavior: str, compartment: str,
+        comparison: List[str]) -> List[str]:
+    return run_bivariate_task(bivariate_worker_context, file_name, behavior,
+                              compartment, comparison)
+
 
-        automatic_comparisons = set_comparisons_by_behavior(
-            behavior, cfg, metadata_df_subset
-        )
-        for comparison in automatic_comparisons:
-            # e.g. comparison = ['A', 'B'], list of exactly two elements
-            bivariate_run_and_save_current_comparison(
-                file_name, df, metadata_df_subset, compartment,
-                dataset, cfg, comparison,
-                behavior,  # specifies the type of comparison
-                test, out_table_dir)
+def schedule_bivariate_comparisons(
+        behaviors_by_file: Dict[str, List[str]], dataset: Dataset,
+        cfg: DictConfig, out_table_dir: str) -> List[str]:
+    """
+    Runs the bivariate analysis of every file x behavior x compartment x
+    comparison task, each one writing its own tables. The compartment
+    dataframes are prepared (imputed, reduced) once by file.
+    The tasks are independent: with n_jobs > 1 (or -1 for all the CPUs)
+    in the method config, they are spread across a process pool whose
+    workers receive the prepared dataframes only once.
+    The tables are the same as in the serial run.
+    Returns the paths of the written tables, in the serial order.
+    """
+    compartment_dfs = dict()
+    tasks = list()
+    for file_name, behaviors in behaviors_by_file.items():
+        assert_literal(file_name, data_files_keys_type, "file name")
+        compartment_dfs[file_name] = prepare_compartment_dfs(
+            file_name, dataset, cfg)
+        for behavior in behaviors:
+            assert behavior in ["conditions_metabolite_time_profiles",
+                                "conditions_MDV_comparison",
+                                "timepoints_MDV_comparison"], \
+                "wrong behavior chosen"
+            for compartment, (_, metadata_df_subset) in \
+                    compartment_dfs[file_name].items():
+                automatic_comparisons = set_comparisons_by_behavior(
+                    behavior, cfg, metadata_df_subset)
+                # e.g. comparison = ['A', 'B'], list of exactly two elements
+                tasks += [(file_name, behavior, compartment, comparison)
+                          for comparison in automatic_comparisons]
+    isotopologue_index = None
+    if any(task[1] != "conditions_metabolite_time_profiles"
+           for task in tasks):
+        isotopologue_index = dataset.get_isotopologue_index()
+    context = {"compartment_dfs": compartment_dfs, "dataset": dataset,
+               "cfg": cfg, "out_table_dir": out_table_dir,
+               "isotopologue_index": isotopologue_index}
+
+    n_jobs = cfg.analysis.method.get("n_jobs", 1)
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count()
+    n_jobs = min(n_jobs, len(tasks))
+    if n_jobs <= 1:
+        output_files = [run_bivariate_task(context, *task) for task in tasks]
+    else:
+        logger.info(f"Running {len(tasks)} bivariate comparisons on "
+                    f"{n_jobs} processes")
+        with ProcessPoolExecutor(max_workers=n_jobs,
+                                 initializer=init_bivariate_worker,
+                                 initargs=(context,)) as executor:
+            output_files = list(executor.map(run_bivariate_task_in_worker,
+                                             *zip(*tasks)))
+    return [f for task_files in output_files for f in task_files]
+
+
+def bivariate_comparison(
+        file_name: data_files_keys_type, dataset: Dataset, cfg: DictConfig,
+        behavior: str, out_table_dir: str
+) -> None:
+    """
+    Bi-variate analysis is performed on compartmentalized versions
+    of data files
+    Attention: we replace zero values using the provided method
+    Writes the table with computed statistics in the relevant output directory
+    (see schedule_bivariate_comparisons to run several behaviors and files)
+    """
+    schedule_bivariate_comparisons({file_name: [behavior]}, dataset, cfg,
+                                   out_table_dir)
@@ -3,14 +3,17 @@
 """
 @author: Johanna Galvis, Florian Specque, Macha Nikolski
 """
+import itertools
 import logging
 import operator
 import os
-from functools import reduce
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, reduce
+from typing import Dict, List, Tuple, Union
 
 import numpy as np
 import pandas as pd
+import scipy.special
 import scipy.stats
 from dimet.constants import (assert_literal, availtest_methods_type,
                              data_files_keys_type)
@@ -18,12 +21,15 @@ from dimet.data import Dataset
 from dimet.helpers import (absolute_geommean_diff,
                            apply_multi_group_kruskal_wallis,
                            arg_repl_zero2value, calculate_gmean,
-                           compute_brunnermunzel_allH0,
+                           compact_nan_rows, compute_brunnermunzel_allH0,
                            compute_distance_between_intervals, compute_padj,
                            compute_ranksums_allH0, compute_wilcoxon_allH0,
                            concatenate_dataframes, countnan_samples,
-                           first_column_for_column_values,
-                           row_wise_nanstd_reduction, split_rows_by_threshold)
+                           first_column_for_column_values, log_nonzero,
+                           rank_rows_with_ties, row_wise_nanstd_reduction,
+                           rows_as_matrices, rows_with_ties,
+                           select_min_pvalue_tails, span_of_groups,
+                           split_rows_by_threshold)
 from dimet.processing import fit_statistical_distribution
 from omegaconf import DictConfig
 
@@ -39,11 +45,9 @@ def compute_span_incomparison(df: pd.DataFrame, groups: List) -> pd.DataFrame:
          DataFrame with an additional 'span_allsamples' column containing
          the computed differences.
     """
-    for i in df.index.values:
-        all_values = list(df.loc[i, groups[0]]) + list(df.loc[i, groups[1]])
-
-        interval = max(all_values) - min(all_values)
-        df.loc[i, "span_allsamples"] = interval
+    df["span_allsamples"] = span_of_groups(
+        df[groups[0]].to_numpy(dtype=float),
+        df[groups[1]].to_numpy(dtype=float))
 
     return df
 
@@ -70,13 +74,11 @@ def distance_or_overlap(df: pd.DataFrame, groups: List) -> pd.DataFrame:
         DataFrame with an additional 'distance' column containing
         computed distances.
     """
-    for i in df.index.values:
-        group1 = df.loc[i, groups[0]].values
-        group2 = df.loc[i, groups[1]].values
-        overlap_method = "symmetric"  # Modify as needed,
-        # can be "symmetric" or "asymmetric"
-        df.at[i, "distance"] = compute_distance_between_intervals(
-            group1, group2, overlap_method)
+    overlap_method = "symmetric"  # Modify as needed,
+    # can be "symmetric" or "asymmetric"
+    df["distance"] = compute_distance_between_intervals(
+        df[groups[0]].to_numpy(dtype=float),
+        df[groups[1]].to_numpy(dtype=float), overlap_method)
 
     return df
 
@@ -109,6 +111,22 @@ def select_rows_with_sufficient_non_nan_values(
     return good_df, bad_df
 
 
+@lru_cache(maxsize=None)
+def mann_whitney_exact_pmf(n1: int, n2: int) -> np.array:
+    """
+    Null distribution of the U statistic for samples of sizes n1 and n2
+    without ties: coefficients of the Gaussian binomial (n1 + n2, n1)
+    """
+    counts = np.zeros(n1 * n2 + 1)
+    counts[0] = 1
+    for i in range(1, n1 + 1):
+        # multiply by (1 - q^(n2 + i)), then divide by (1 - q^i)
+        counts[n2 + i:] = counts[n2 + i:] - counts[:-(n2 + i)].copy()
+        for start in range(i):
+            counts[start::i] = np.cumsum(counts[start::i])
+    return counts / scipy.special.comb(n1 + n2, n1)
+
+
 def compute_mann_whitney_allH0(vInterest, vBaseline):
     """
     Calculate Mann–Whitney U test (a.k.a Wilcoxon rank-sum test,
@@ -117,115 +135,212 @@ def compute_mann_whitney_allH0(vInterest, vBaseline):
     because "auto" will set continuity depending on ties and sample size.
     If ties in the data  and method "exact" (i.e use_continuity False)
     pvalues cannot be calculated, check scipy doc
+    The samples are ranked once, and the three alternatives are derived
+    from the same U statistic, with the method scipy "auto" would choose
+    (same values as scipy.stats.mannwhitneyu, use_continuity=False).
+    Accepts single rows or matrices (row-wise test); note that for
+    matrices the method is chosen once for all the rows, as in scipy.
     """
-    usta, p = scipy.stats.mannwhitneyu(
-        vInterest,
-        vBaseline,
-        # method = "auto",
-        use_continuity=False,
-        alternative="less",
-    )
+    x, y, single_row = rows_as_matrices(vInterest, vBaseline)
+    n1, n2 = x.shape[1], y.shape[1]
+    ranks, ties = rank_rows_with_ties(np.hstack([x, y]))
+    u1 = np.sum(ranks[:, :n1], axis=1) - n1 * (n1 + 1) / 2
+    u2 = n1 * n2 - u1
+    u_two_sided = np.maximum(u1, u2)
+
+    if (n1 > 8 and n2 > 8) or np.any(ties > 1):  # asymptotic
+        n = n1 + n2
+        tie_term = np.sum(ties ** 2 - 1, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            s = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+            pvalues = [scipy.special.ndtr(-(u - n1 * n2 / 2) / s)
+                       for u in [u2, u1, u_two_sided]]
+    else:  # exact
+        tail = np.cumsum(mann_whitney_exact_pmf(n1, n2)[::-1])[::-1]
+        pvalues = [tail[np.asarray(u, dtype=int)]
+                   for u in [u2, u1, u_two_sided]]
+    pvalues[2] = np.clip(2 * pvalues[2], 0., 1.)
+    # rows with NaN values give NaN results, as scipy does
+    missing = np.isnan(x).any(axis=1) | np.isnan(y).any(axis=1)
+    u1[missing] = np.nan
+    pvalues = [np.where(missing, np.nan, p) for p in pvalues]
 
-    usta2, p2 = scipy.stats.mannwhitneyu(
-        vInterest,
-        vBaseline,
-        # method = "auto",
-        use_continuity=False,
-        alternative="greater",
-    )
+    # best (smaller pvalue) among all tailed tests
+    return select_min_pvalue_tails([u1, u1, u1], pvalues, single_row)
 
-    usta3, p3 = scipy.stats.mannwhitneyu(
-        vInterest,
-        vBaseline,
-        # method = "auto",
-        use_continuity=False,
-        alternative="two-sided",
-    )
 
-    # best (smaller pvalue) among all tailed tests
-    pretups = [(usta, p), (usta2, p2), (usta3, p3)]
-    tups = []
-    for t in pretups:  # make list of tuples with no-nan pvalues
-        if not np.isnan(t[1]):
-            tups.append(t)
+@lru_cache(maxsize=16)
+def permutation_membership_matrix(n1: int, n2: int, n_resamples: int,
+                                  seed: Union[int, None]) -> np.ndarray:
+    """
+    Matrix of the resampled group memberships, shared by all the
+    metabolites having the same group sizes: one row by resample, one
+    column by pooled sample (the n1 interest samples, then the n2
+    baseline ones), True when the sample is drawn in the interest group.
+    If all the distinct partitions are not more than n_resamples, they
+    are all enumerated (exact test), otherwise n_resamples random
+    permutations are drawn with the given seed.
+    """
+    n = n1 + n2
+    if scipy.special.comb(n, n1, exact=True) <= n_resamples:
+        combinations = np.array(list(itertools.combinations(range(n), n1)))
+        membership = np.zeros((combinations.shape[0], n), dtype=bool)
+        np.put_along_axis(membership, combinations, True, axis=1)
+    else:
+        rng = np.random.default_rng(seed)
+        permutations = np.argsort(rng.random((n_resamples, n)), axis=1)
+        membership = permutations < n1
+    membership.setflags(write=False)
+    return membership
+
+
+def compute_permutation_test_matrix(
+        vInterest: np.ndarray, vBaseline: np.ndarray,
+        n_resamples: int = 9999, seed: Union[int, None] = None,
+        chunk_size: int = 256) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Permutation test whose statistic is the absolute geometric means
+    difference (alternative "greater", as scipy permutation_test),
+    for all the rows at once: the geometric means of every resample are
+    computed in log space as matrix products with the shared membership
+    matrix (see permutation_membership_matrix).
+    vInterest and vBaseline are 2-D arrays (one row by metabolite)
+    free of NaN values.
+    """
+    n1, n2 = vInterest.shape[1], vBaseline.shape[1]
+    membership = permutation_membership_matrix(n1, n2, n_resamples, seed)
+    # the observed partition is counted only if resamples are random
+    exact = scipy.special.comb(n1 + n2, n1, exact=True) <= n_resamples
+    adjustment = 0 if exact else 1
+    weights_interest = membership / n1
+    weights_baseline = ~membership / n2
+    log_values = log_nonzero(np.hstack([vInterest, vBaseline]))
+
+    statistic = absolute_geommean_diff(vInterest, vBaseline, axis=1)
+    # same relative tolerance as scipy for the null >= observed comparison
+    gamma = np.abs(np.finfo(float).eps * 100 * statistic)
+    pvalue = np.empty(statistic.shape)
+    for start in range(0, log_values.shape[0], chunk_size):
+        rows = slice(start, start + chunk_size)
+        null_distribution = np.abs(
+            np.exp(np.dot(log_values[rows], weights_interest.T)) -
+            np.exp(np.dot(log_values[rows], weights_baseline.T)))
+        count = np.sum(null_distribution >= (statistic - gamma)[rows, None],
+                       axis=1)
+        pvalue[rows] = (count + adjustment) / (membership.shape[0] +
+                                               adjustment)
+    return statistic, pvalue
+
+
+def compute_test_on_block(vInterest: np.ndarray, vBaseline: np.ndarray,
+                          test: str, n_resamples: int = 9999,
+                          seed: Union[int, None] = None
+                          ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the chosen test for all the rows of a block at once.
+    vInterest and vBaseline are 2-D arrays (one row by metabolite)
+    free of NaN values.
+    n_resamples and seed are only used by the permutation test.
+    Returns the arrays of statistics and p-values.
+    """
+    if test == "MW":
+        return compute_mann_whitney_allH0(vInterest, vBaseline)
 
-    if len(tups) == 0:  # if all pvalues are nan assign two sided result
-        tups = [(usta3, p3)]
+    elif test == "Tt":
+        return scipy.stats.ttest_ind(vInterest, vBaseline, axis=1,
+                                     alternative="two-sided")
 
-    stap_tup = min(tups, key=lambda x: x[1])  # nan already excluded
-    stat_result = stap_tup[0]
-    pval_result = stap_tup[1]
+    elif test == "KW":
+        return scipy.stats.kruskal(vInterest, vBaseline, axis=1)
+
+    elif test == "ranksum":
+        return compute_ranksums_allH0(vInterest, vBaseline)
+
+    elif test == "Wcox":
+        # signed-rank test: one sample (independence),
+        # or two paired or related samples
+        return compute_wilcoxon_allH0(vInterest, vBaseline)
+
+    elif test == "BrMu":
+        return compute_brunnermunzel_allH0(vInterest, vBaseline)
+
+    elif test == "prm-scipy":
+        # test statistic is absolute geommean differences,
+        # so "greater" satisfy
+        return compute_permutation_test_matrix(vInterest, vBaseline,
+                                               n_resamples, seed)
+
+    raise ValueError(f"Unknown test {test}")
+
+
+def compute_statistical_test_matrix(
+        values_interest: np.ndarray, values_baseline: np.ndarray,
+        test: str, n_resamples: int = 9999, seed: Union[int, None] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Batched engine for the row-wise pairwise tests.
+    values_interest and values_baseline are 2-D arrays (metabolites in rows,
+    samples in columns), they can contain NaN values.
+    The rows are gathered in blocks sharing the number of non-NaN values
+    in each group, and the presence of ties (so that the automatic choice
+    of exact or asymptotic methods in scipy is the same as row by row).
+    In each block the NaN values are moved out, and the test is computed
+    for all the rows of the block in one call.
+    Returns the arrays of statistics and p-values, in the order of the rows.
+    """
+    compact_interest, n_interest = compact_nan_rows(values_interest)
+    compact_baseline, n_baseline = compact_nan_rows(values_baseline)
+    if test == "Wcox" and compact_interest.shape == compact_baseline.shape:
+        # signed-rank: what matters are the ties of the paired differences
+        differences = np.abs(compact_interest - compact_baseline)
+        ties = rows_with_ties(differences) | (differences == 0).any(axis=1)
+    else:
+        ties = rows_with_ties(np.hstack([values_interest, values_baseline]))
+
+    stat_result = np.full(values_interest.shape[0], np.nan)
+    pval_result = np.full(values_interest.shape[0], np.nan)
+    blocks_keys, block_of_row = np.unique(
+        np.column_stack([n_interest, n_baseline, ties]), axis=0,
+        return_inverse=True)
+    block_of_row = block_of_row.reshape(-1)
+    for block, (size_interest, size_baseline, _) in enumerate(blocks_keys):
+        rows = np.flatnonzero(block_of_row == block)
+        stat_block, pval_block = compute_test_on_block(
+            compact_interest[rows, :size_interest],
+            compact_baseline[rows, :size_baseline], test, n_resamples, seed)
+        stat_result[rows] = stat_block
+        pval_result[rows] = pval_block
 
     return stat_result, pval_result
 
 
 def run_statistical_test(df: pd.DataFrame, comparison: List,
-                         test: str) -> pd.DataFrame:
+                         test: str, n_resamples: int = 9999,
+                         seed: Union[int, None] = None) -> pd.DataFrame:
     """
     This is a switch function for computing statistics for a pairwise
     differential analysis
     The comparison is a list with 2 sublists that contain column names
+    n_resamples and seed are only used by the permutation test (prm-scipy)
     """
     metabolites = df.index.values
-    pval = []
-    for i in df.index:
-        a1 = np.array(df.loc[i, comparison[0]], dtype=float)
-        a2 = np.array(df.loc[i, comparison[1]], dtype=float)
-        vInterest = a1[~np.isnan(a1)]
-        vBaseline = a2[~np.isnan(a2)]
-
-        if (len(vInterest) < 2) | (len(vBaseline) < 2):
-            return pd.DataFrame(
-                data={
-                    "metabolite": metabolites,
-                    "stat": [float("nan")] * len(metabolites),
-                    "pvalue": [float("nan")] * len(metabolites),
-                }
-            )
-
-        if test == "MW":
-            stat_result, pval_result = compute_mann_whitney_allH0(vInterest,
-                                                                  vBaseline)
-
-        elif test == "Tt":
-            stat_result, pval_result = scipy.stats.ttest_ind(
-                vInterest, vBaseline, alternative="two-sided")
-
-        elif test == "KW":
-            stat_result, pval_result = scipy.stats.kruskal(vInterest,
-                                                           vBaseline)
-
-        elif test == "ranksum":
-            stat_result, pval_result = compute_ranksums_allH0(
-                vInterest, vBaseline)
-
-        elif test == "Wcox":
-            # signed-rank test: one sample (independence),
-            # or two paired or related samples
-            stat_result, pval_result = compute_wilcoxon_allH0(
-                vInterest, vBaseline)
-
-        elif test == "BrMu":
-            stat_result, pval_result = compute_brunnermunzel_allH0(
-                vInterest, vBaseline)
-
-        elif test == "prm-scipy":
-            # test statistic is absolute geommean differences,
-            # so "greater" satisfy
-            prm_res = scipy.stats.permutation_test(
-                (vInterest, vBaseline),
-                statistic=absolute_geommean_diff,
-                permutation_type="independent",
-                vectorized=False,
-                n_resamples=9999,
-                batch=None,
-                alternative="greater",
-            )
-            stat_result, pval_result = prm_res.statistic, prm_res.pvalue
-
-        del stat_result  # to avoid flake8 error
-
-        pval.append(pval_result)
+    values_interest = df[comparison[0]].to_numpy(dtype=float)
+    values_baseline = df[comparison[1]].to_numpy(dtype=float)
+    n_interest = np.count_nonzero(~np.isnan(values_interest), axis=1)
+    n_baseline = np.count_nonzero(~np.isnan(values_baseline), axis=1)
+
+    if (n_interest < 2).any() | (n_baseline < 2).any():
+        return pd.DataFrame(
+            data={
+                "metabolite": metabolites,
+                "stat": [float("nan")] * len(metabolites),
+                "pvalue": [float("nan")] * len(metabolites),
+            }
+        )
+
+    stat_result, pval = compute_statistical_test_matrix(
+        values_interest, values_baseline, test, n_resamples, seed)
+    del stat_result  # to avoid flake8 error
 
     assert len(metabolites) == len(pval)
     return pd.DataFrame(
@@ -247,14 +362,22 @@ def auto_detect_tailway(good_df, best_distribution, args_param):
     return min(min_pval_, key=lambda x: x[1])[0]
 
 
-def run_distribution_fitting(df: pd.DataFrame,
-                             disfit_tail_option: str) -> pd.DataFrame:
+def run_distribution_fitting(
+        df: pd.DataFrame, disfit_tail_option: str,
+        fit_settings: Union[Dict, None] = None) -> pd.DataFrame:
+    """
+    fit_settings: keyword arguments of the distribution fitting (see
+    fit_statistical_distribution.get_fit_settings)
+    """
+    if fit_settings is None:
+        fit_settings = dict()
     recognized_tail_options = ["auto", "two-sided", "right-tailed"]
     assert disfit_tail_option in recognized_tail_options, ("unrecognized"
            "disfit_tail_option")
     df = fit_statistical_distribution.compute_z_score(df, "FC")
     best_distribution, args_param = \
-        fit_statistical_distribution.find_best_distribution(df)
+        fit_statistical_distribution.find_best_distribution(
+            df, **fit_settings)
     if disfit_tail_option == "auto":
         autoset_tailway = auto_detect_tailway(
             df, best_distribution, args_param)
@@ -347,9 +470,14 @@ def compute_current_comparison_test(
     if test == "disfit":
         result = run_distribution_fitting(
             df_good,
-            disfit_tail_option=cfg.analysis.method.disfit_tail_option)
+            disfit_tail_option=cfg.analysis.method.disfit_tail_option,
+            fit_settings=fit_statistical_distribution.get_fit_settings(cfg))
     else:
-        result_test_df = run_statistical_test(df_good, this_comparison, test)
+        result_test_df = run_statistical_test(
+            df_good, this_comparison, test,
+            n_resamples=cfg.analysis.method.get("permutation_n_resamples",
+                                                9999),
+            seed=cfg.analysis.method.get("permutation_seed", 123))
         assert result_test_df.shape[0] == df_good.shape[0]
         result_test_df.set_index("metabolite", inplace=True)
         df_good = pd.merge(df_good, result_test_df, left_index=True,
@@ -379,7 +507,7 @@ def pairwise_comparison(
     """
     conditions_list = first_column_for_column_values(
         df=dataset.metadata_df, columns=cfg.analysis.method.grouping,
-        values=comparison
+        values=comparison, metadata_index=dataset.get_metadata_index()
     )
     # flatten the list of lists and select the subset of column names
     # present in the sub dataframe
@@ -407,6 +535,110 @@ def pairwise_comparison(
     return result
 
 
+def save_pairwise_comparison(
+        df: pd.DataFrame, dataset: Dataset, cfg: DictConfig,
+        comparison: List[str], test: availtest_methods_type,
+        file_name: data_files_keys_type, compartment: str,
+        out_table_dir: str
+) -> str:
+    """
+    Runs the pairwise comparison on the (imputed) compartment dataframe and
+    writes the table with computed statistics.
+    Returns the path of the written table.
+    """
+    result = pairwise_comparison(df, dataset, cfg, comparison, test)
+    result["compartment"] = compartment
+    result = reorder_columns_diff_end(result, test)
+
+    result = result.sort_values(["pvalue", "distance/span"],
+                                ascending=[True, False])
+    comp = "-".join(map(lambda x: "-".join(x), comparison))
+    base_file_name = dataset.get_file_for_label(file_name)
+    base_file_name += f"--{compartment}-{comp}-{test}"
+    output_file_name = os.path.join(out_table_dir,
+                                    f"{base_file_name}.tsv")
+    result.to_csv(
+        output_file_name,
+        index_label="metabolite",
+        header=True,
+        sep="\t"
+    )
+    logger.info(f"Saved the result in {output_file_name}")
+    return output_file_name
+
+
+# set once in each worker process by the pool initializer: the imputed
+# compartment dataframes and the arguments shared by all the comparisons
+comparison_worker_context: Dict = dict()
+
+
+def init_comparison_worker(context: Dict) -> None:
+    comparison_worker_context.update(context)
+
+
+def run_comparison_in_worker(compartment: str, comparison: List[str]) -> str:
+    context = comparison_worker_context
+    return save_pairwise_comparison(
+        context["compartment_dfs"][compartment], context["dataset"],
+        context["cfg"], comparison, context["test"], context["file_name"],
+        compartment, context["out_table_dir"])
+
+
+def schedule_pairwise_comparisons(
+        compartment_dfs: Dict[str, pd.DataFrame], comparisons: List,
+        dataset: Dataset, cfg: DictConfig, test: availtest_methods_type,
+        file_name: data_files_keys_type, out_table_dir: str
+) -> List[str]:
+    """
+    Runs every compartment x comparison pair, each one writing its own
+    table. The pairs are independent: with n_jobs > 1 (or -1 for all the
+    CPUs) in the method config, they are spread across a process pool
+    whose workers receive the imputed compartment dataframes only once.
+    The tables are the same as in the serial run.
+    Returns the paths of the written tables, in the serial order.
+    """
+    pairs = [(compartment, comparison) for compartment in compartment_dfs
+             for comparison in comparisons]
+    n_jobs = cfg.analysis.method.get("n_jobs", 1)
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count()
+    n_jobs = min(n_jobs, len(pairs))
+    if n_jobs <= 1:
+        return [save_pairwise_comparison(
+            compartment_dfs[compartment], dataset, cfg, comparison, test,
+            file_name, compartment, out_table_dir)
+            for compartment, comparison in pairs]
+
+    context = {"compartment_dfs": compartment_dfs, "dataset": dataset,
+               "cfg": cfg, "test": test, "file_name": file_name,
+               "out_table_dir": out_table_dir}
+    logger.info(f"Running {len(pairs)} comparisons on {n_jobs} processes")
+    with ProcessPoolExecutor(max_workers=n_jobs,
+                             initializer=init_comparison_worker,
+                             initargs=(context,)) as executor:
+        return list(executor.map(run_comparison_in_worker,
+                                 *zip(*pairs)))
+
+
+def impute_compartment_dfs(file_name: data_files_keys_type,
+                           dataset: Dataset,
+                           cfg: DictConfig) -> Dict[str, pd.DataFrame]:
+    """
+    Compartment dataframes of the file without the rows being zero
+    everywhere, the zero values replaced using the provided method
+    """
+    impute_value = cfg.analysis.method.impute_values[file_name]
+    compartment_dfs = dict()
+    for compartment, compartmentalized_df in \
+            dataset.get_compartmentalized_dfs(file_name).items():
+        df = compartmentalized_df
+        df = df[(df.T != 0).any()]
+        val_instead_zero = arg_repl_zero2value(impute_value, df)
+        df = df.replace(to_replace=0, value=val_instead_zero)
+        compartment_dfs[compartment] = df
+    return compartment_dfs
+
+
 def differential_comparison(
         file_name: data_files_keys_type, dataset: Dataset, cfg: DictConfig,
         test: availtest_methods_type, out_table_dir: str
@@ -420,33 +652,10 @@ def differential_comparison(
     assert_literal(test, availtest_methods_type, "Available test")
     assert_literal(file_name, data_files_keys_type, "file name")
 
-    impute_value = cfg.analysis.method.impute_values[file_name]
-    for compartment, compartmentalized_df in \
-            dataset.compartmentalized_dfs[file_name].items():
-        df = compartmentalized_df
-        df = df[(df.T != 0).any()]
-        val_instead_zero = arg_repl_zero2value(impute_value, df)
-        df = df.replace(to_replace=0, value=val_instead_zero)
-
-        for comparison in cfg.analysis.comparisons:
-            result = pairwise_comparison(df, dataset, cfg, comparison, test)
-            result["compartment"] = compartment
-            result = reorder_columns_diff_end(result, test)
-
-            result = result.sort_values(["pvalue", "distance/span"],
-                                        ascending=[True, False])
-            comp = "-".join(map(lambda x: "-".join(x), comparison))
-            base_file_name = dataset.get_file_for_label(file_name)
-            base_file_name += f"--{compartment}-{comp}-{test}"
-            output_file_name = os.path.join(out_table_dir,
-                                            f"{base_file_name}.tsv")
-            result.to_csv(
-                output_file_name,
-                index_label="metabolite",
-                header=True,
-                sep="\t"
-            )
-            logger.info(f"Saved the result in {output_file_name}")
+    compartment_dfs = impute_compartment_dfs(file_name, dataset, cfg)
+    schedule_pairwise_comparisons(compartment_dfs, cfg.analysis.comparisons,
+                                  dataset, cfg, test, file_name,
+                                  out_table_dir)
 
 
 def multi_group_compairson(
@@ -461,7 +670,7 @@ def multi_group_compairson(
 
     impute_value = cfg.analysis.method.impute_values[file_name]
     for compartment, compartmentalized_df in\
-            dataset.compartmentalized_dfs[file_name].items():
+            dataset.get_compartmentalized_dfs(file_name).items():
         df = compartmentalized_df
         df = df[(df.T != 0).any()]
         val_instead_zero = arg_repl_zero2value(impute_value, df)
@@ -469,7 +678,8 @@ def multi_group_compairson(
 
         conditions_list = first_column_for_column_values(
             df=dataset.metadata_df, columns=cfg.analysis.method.grouping,
-            values=cfg.analysis.conditions
+            values=cfg.analysis.conditions,
+            metadata_index=dataset.get_metadata_index()
         )
         # flatten the list of lists and select the subset of column names
         # present in the sub dataframe
@@ -536,36 +746,10 @@ def time_course_analysis(file_name: data_files_keys_type,
     assert_literal(test, availtest_methods_type, "Available test")
     assert_literal(file_name, data_files_keys_type, "file name")
 
-    impute_value = cfg.analysis.method.impute_values[file_name]
-
-    for compartment, compartmentalized_df in \
-            dataset.compartmentalized_dfs[file_name].items():
-        df = compartmentalized_df
-        df = df[(df.T != 0).any()]
-        val_instead_zero = arg_repl_zero2value(impute_value, df)
-        df = df.replace(to_replace=0, value=val_instead_zero)
-
-        time_course_comparisons = time_course_auto_list_comparisons(
-            dataset.metadata_df
-        )
-
-        for comparison in time_course_comparisons:
-            result = pairwise_comparison(df, dataset, cfg, comparison,
-                                         test)
-            result["compartment"] = compartment
-            result = reorder_columns_diff_end(result, test)
-
-            result = result.sort_values(["pvalue", "distance/span"],
-                                        ascending=[True, False])
-            comp = "-".join(map(lambda x: "-".join(x), comparison))
-            base_file_name = dataset.get_file_for_label(file_name)
-            base_file_name += f"--{compartment}-{comp}-{test}"
-            output_file_name = os.path.join(out_table_dir,
-                                            f"{base_file_name}.tsv")
-            result.to_csv(
-                output_file_name,
-                index_label="metabolite",
-                header=True,
-                sep="\t",
-            )
-            logger.info(f"Saved the result in {output_file_name}")
+    compartment_dfs = impute_compartment_dfs(file_name, dataset, cfg)
+    time_course_comparisons = time_course_auto_list_comparisons(
+        dataset.metadata_df
+    )
+    schedule_pairwise_comparisons(compartment_dfs, time_course_comparisons,
+                                  dataset, cfg, test, file_name,
+                                  out_table_dir)
@@ -3,13 +3,21 @@
 """
 @author: Johanna Galvis, Florian Specque, Macha Nikolski
 """
+import hashlib
+import json
 import logging
+import os
+import signal
+import threading
+import time
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 
-from typing import List, Union
+from typing import Dict, List, NamedTuple, Tuple, Union
 import numpy as np
 import pandas as pd
 import scipy.stats as stats
+from omegaconf import DictConfig
 
 
 logger = logging.getLogger(__name__)
@@ -17,6 +25,52 @@ logger = logging.getLogger(__name__)
 np.random.seed(123)
 
 
+class DistributionFit(NamedTuple):
+    """
+    Result of fitting a scipy.stats distribution to the data:
+    its name, its parameters (full precision, shapes then loc and scale),
+    the sum of squared errors of its pdf against the data histogram and
+    the time (seconds) taken by the fit
+    """
+    name: str
+    params: Tuple[float, ...]
+    sse: float
+    fit_time: float
+
+    @property
+    def distribution(self):
+        return getattr(stats, self.name)
+
+    @property
+    def args_param(self) -> Dict[str, float]:
+        """The parameters by name, e.g. {'loc': 0.01, 'scale': 1.77}"""
+        shapes = self.distribution.shapes
+        param_names = (shapes + ", loc, scale").split(", ") if \
+            shapes else ["loc", "scale"]
+        return {k: float(v) for k, v in zip(param_names, self.params)}
+
+    @property
+    def param_str(self) -> str:
+        """Rounded parameters, for logging and plot titles"""
+        return ", ".join(["{}={:0.2f}".format(k, v)
+                          for k, v in self.args_param.items()])
+
+
+# best fits already computed in this process, by fit_cache_key
+fit_cache: Dict[str, DistributionFit] = dict()
+
+# candidates of the "fast" preset: analytical (or cheap) maximum
+# likelihood estimates in scipy
+fast_distributions_names = [
+    "cauchy", "expon", "gumbel_r", "gumbel_l", "halfcauchy",
+    "halflogistic", "halfnorm", "hypsecant", "laplace", "logistic",
+    "norm", "pareto", "powerlaw", "rayleigh", "uniform"]
+
+
+class FitTimeout(Exception):
+    pass
+
+
 def compute_z_score(df: pd.DataFrame, column_name: str) -> pd.DataFrame:
     """
     Add one column with z-score of ratio already computed
@@ -25,32 +79,30 @@ def compute_z_score(df: pd.DataFrame, column_name: str) -> pd.DataFrame:
     return df
 
 
-def find_best_distribution(df: pd.DataFrame, *args):
+def find_best_distribution(df: pd.DataFrame, *args, **fit_settings):
     """
     Find the best distribution among all the scipy.stats distributions
     and return it together with its parameters
 
     The input dataframe df has to have a "zscore" column
     as the fitting is done on the zscores
+    fit_settings: optional keyword arguments of best_fit_distribution
+    (cache_dir, candidates, n_jobs, timeout), see get_fit_settings
     """
     logger.info("Fitting a distribution")
     dist = np.around(np.array((df["zscore"]).astype(float)), 5)
     # the optional *args are used by unitary tests
-    best_dist, best_dist_name, best_fit_params = get_best_fit(dist, *args)
-
-    logger.info(f"Best fit is {best_dist_name} with {best_fit_params}")
-    args_param = dict(e.split("=") for e in best_fit_params.split(", "))
-    for k, v in args_param.items():
-        args_param[k] = float(v)
+    fit = get_best_fit(dist, *args, **fit_settings)
 
-    best_distribution = getattr(stats, best_dist_name)
-    q_val = best_dist.ppf(0.95, **args_param)
+    logger.info(f"Best fit is {fit.name} with {fit.param_str}")
+    args_param = fit.args_param
+    q_val = fit.distribution.ppf(0.95, **args_param)
     logger.info(f"And the q value is {q_val}")
-    return best_distribution, args_param
+    return fit.distribution, args_param
 
 
-def get_best_fit(input_array, *args):
-    """Return the best fit distribution to data and its parameters"""
+def get_best_fit(input_array, *args, **fit_settings) -> DistributionFit:
+    """Return the best fit distribution to data (with its parameters)"""
 
     try:  # *args are used by unitary tests
         DISTRIBUTIONS = args[0]
@@ -61,21 +113,15 @@ def get_best_fit(input_array, *args):
     data = pd.Series(input_array)
 
     # Find best fit distribution
-    best_fit_name, best_fit_params = best_fit_distribution(
-        data, DISTRIBUTIONS, 200)
+    return best_fit_distribution(data, DISTRIBUTIONS, 200, **fit_settings)
 
-    best_dist = getattr(stats, best_fit_name)
 
-    # parameters
-    param_names = (best_dist.shapes + ", loc, scale").split(", ") if \
-        best_dist.shapes else ["loc", "scale"]
-    param_str = ", ".join(["{}={:0.2f}".format(k, v)
-                           for k, v in zip(param_names, best_fit_params)])
-
-    return best_dist, best_fit_name, param_str
-
-
-def get_distributions_list():
+def get_distributions_list(candidates: str = "all"):
+    """
+    candidates: "all", or "fast" for the distributions having an
+    analytical or cheap maximum likelihood fit
+    """
+    assert candidates in ["all", "fast"], "unrecognized candidates preset"
     # Get distribution list not hardcoded was not possible to date.
     DISTRIBUTIONS = [
         stats.alpha,
@@ -165,31 +211,147 @@ def get_distributions_list():
         stats.weibull_max,
         stats.wrapcauchy,
     ]
+    if candidates == "fast":
+        DISTRIBUTIONS = [d for d in DISTRIBUTIONS
+                         if d.name in fast_distributions_names]
 
     return DISTRIBUTIONS
 
 
+def get_fit_cache_dir(cfg: DictConfig) -> Union[str, None]:
+    """
+    Directory of the on-disk cache of the distribution fits, from the
+    method config 'fit_cache_dir' (None: in memory only). A relative path
+    is placed in the current (Hydra output) directory; an absolute path can
+    be shared by several runs, e.g. the differential analysis and the
+    distribution fitting plot.
+    """
+    cache_dir = cfg.analysis.method.get("fit_cache_dir", None)
+    if cache_dir is None:
+        return None
+    return os.path.join(os.getcwd(), str(cache_dir))
+
+
+def get_fit_settings(cfg: DictConfig) -> Dict:
+    """
+    Distribution fitting settings from the method config, as keyword
+    arguments of best_fit_distribution
+    """
+    return {"cache_dir": get_fit_cache_dir(cfg),
+            "candidates": cfg.analysis.method.get("disfit_candidates", "all"),
+            "n_jobs": cfg.analysis.method.get("disfit_n_jobs", 1),
+            "timeout": cfg.analysis.method.get("disfit_timeout", None)}
+
+
+def fit_cache_key(data, DISTRIBUTIONS: List, bins: int) -> str:
+    """
+    Key of a distribution fit: hash of the data rounded to 5 decimals
+    (as the z-scores), of the names of the candidate distributions and of
+    the number of bins
+    """
+    values = np.around(np.asarray(data, dtype=float), 5)
+    key = hashlib.sha256(np.ascontiguousarray(values).tobytes())
+    key.update(str(values.shape).encode())
+    key.update(",".join(d.name for d in DISTRIBUTIONS).encode())
+    key.update(str(bins).encode())
+    return key.hexdigest()
+
+
+def read_cached_fit(key: str,
+                    cache_dir: Union[str, None]) -> Union[DistributionFit,
+                                                          None]:
+    """
+    Returns the cached fit, from memory or from the cache directory,
+    or None if this fit was never computed
+    """
+    if key in fit_cache:
+        return fit_cache[key]
+    if cache_dir is None:
+        return None
+    try:
+        with open(os.path.join(cache_dir, f"{key}.json")) as f:
+            cached = json.load(f)
+        fit = DistributionFit(cached["name"], tuple(cached["params"]),
+                              cached["sse"], cached["fit_time"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    fit_cache[key] = fit
+    return fit
+
+
+def write_cached_fit(key: str, fit: DistributionFit,
+                     cache_dir: Union[str, None]) -> None:
+    fit_cache[key] = fit
+    if cache_dir is None:
+        return
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(os.path.join(cache_dir, f"{key}.json"), "w") as f:
+            json.dump({"name": fit.name,
+                       "params": [float(p) for p in fit.params],
+                       "sse": float(fit.sse),
+                       "fit_time": float(fit.fit_time)}, f)
+    except OSError as e:
+        logger.warning(f"Could not write the distribution fit cache: {e}")
+
+
 def best_fit_distribution(
         data: pd.DataFrame,
         DISTRIBUTIONS: Union[List, None] = None,
-        bins: int = 200):
-    """Model data by finding best fit distribution to data"""
-    # Get histogram of original data
-    y, x = np.histogram(data, bins=bins, density=True)
-
-    x = (x + np.roll(x, -1))[:-1] / 2.0
-
+        bins: int = 200, cache_dir: Union[str, None] = None,
+        candidates: str = "all", n_jobs: int = 1,
+        timeout: Union[float, None] = None) -> DistributionFit:
+    """
+    Model data by finding best fit distribution to data.
+    The fits are cached (by data, candidate distributions and bins) in
+    memory, and also on disk when cache_dir is given.
+     - candidates: preset of get_distributions_list, when DISTRIBUTIONS
+       is None
+     - n_jobs: number of processes fitting the candidates (-1: all CPUs)
+     - timeout: time budget (seconds) of each candidate; a candidate
+       exceeding it is discarded
+    """
     if DISTRIBUTIONS is None:
-        DISTRIBUTIONS = get_distributions_list()
+        DISTRIBUTIONS = get_distributions_list(candidates)
+
+    key = fit_cache_key(data, DISTRIBUTIONS, bins)
+    fit = read_cached_fit(key, cache_dir)
+    if fit is not None:
+        logger.info(f"Distribution fit found in cache: {fit.name}")
+        return fit
+
+    fit, timed_out = search_best_fit(data, DISTRIBUTIONS, bins, n_jobs,
+                                     timeout)
+    if timed_out:
+        # the result depends on the speed of the machine: not cached
+        logger.info(f"Distributions discarded after {timeout} s: "
+                    f"{', '.join(timed_out)}")
+    else:
+        write_cached_fit(key, fit, cache_dir)
+    return fit
 
-    # Best holders
-    best_distribution = stats.norm
-    best_params = (0.0, 1.0)
-    best_sse = np.inf
 
-    # Estimate distribution parameters from data
-    for distribution in DISTRIBUTIONS:
-        # Try to fit the distribution
+def fit_one_distribution(
+        distribution, data: np.array, x: np.array, y: np.array,
+        timeout: Union[float, None] = None
+) -> Tuple[Union[DistributionFit, None], bool]:
+    """
+    Fits the distribution to the data and computes the sum of squared
+    errors of its pdf against the histogram (x, y).
+    Returns the fit (None if it failed) and whether it did not end within
+    'timeout' seconds.
+    The timeout needs a Unix system (SIGALRM) and the main thread of the
+    process, it is ignored otherwise.
+    """
+    use_alarm = timeout is not None and hasattr(signal, "setitimer") and \
+        threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        def raise_timeout(signum, frame):
+            raise FitTimeout()
+        previous_handler = signal.signal(signal.SIGALRM, raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    start = time.perf_counter()
+    try:
         try:
             # Ignore warnings from data that can't be fit
             with warnings.catch_warnings():
@@ -206,16 +368,66 @@ def best_fit_distribution(
                 # Calculate fitted PDF and error with fit in distribution
                 pdf = distribution.pdf(x, loc=loc, scale=scale, *arg)
                 sse = np.sum(np.power(y - pdf, 2.0))
-                # identify if this distribution is better
-                if best_sse > sse > 0:
-                    best_distribution = distribution
-                    best_params = params
-                    best_sse = sse
+        finally:
+            if use_alarm:  # the alarm may still ring until disarmed here
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    except FitTimeout:
+        return None, True
+    except Exception:
+        return None, False
+    finally:
+        if use_alarm:
+            signal.signal(signal.SIGALRM, previous_handler)
+    fit = DistributionFit(distribution.name, tuple(params), float(sse),
+                          time.perf_counter() - start)
+    return fit, False
+
+
+def search_best_fit(
+        data: pd.DataFrame, DISTRIBUTIONS: List, bins: int,
+        n_jobs: int = 1, timeout: Union[float, None] = None
+) -> Tuple[DistributionFit, List[str]]:
+    """
+    Fits each candidate distribution to the data, keeps the best one.
+    With n_jobs > 1 the candidates are fitted in a process pool; the best
+    fit is chosen in the order of DISTRIBUTIONS whatever the order the fits
+    end, so that it is the same as the serial one.
+    Returns the best fit (normal distribution (0, 1) if none could be
+    fitted), and the names of the candidates discarded by the timeout.
+    """
+    data = np.asarray(data, dtype=float).ravel()
+    # Get histogram of original data
+    y, x = np.histogram(data, bins=bins, density=True)
 
-        except Exception:
-            pass
+    x = (x + np.roll(x, -1))[:-1] / 2.0
 
-    return best_distribution.name, best_params
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count()
+    n_jobs = min(n_jobs, len(DISTRIBUTIONS))
+    start = time.time()
+    if n_jobs <= 1:
+        results = [fit_one_distribution(distribution, data, x, y, timeout)
+                   for distribution in DISTRIBUTIONS]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(
+                fit_one_distribution, DISTRIBUTIONS,
+                *[[v] * len(DISTRIBUTIONS) for v in [data, x, y, timeout]]))
+    logger.info(f"Fitted {len(DISTRIBUTIONS)} distributions in "
+                f"{time.time() - start:.1f} s")
+
+    # Best holder
+    best_fit = DistributionFit(stats.norm.name, (0.0, 1.0), np.inf, 0.0)
+    timed_out = list()
+
+    for distribution, (fit, fit_timed_out) in zip(DISTRIBUTIONS, results):
+        if fit_timed_out:
+            timed_out.append(distribution.name)
+        # identify if this distribution is better
+        elif fit is not None and best_fit.sse > fit.sse > 0:
+            best_fit = fit
+
+    return best_fit, timed_out
 
 
 def compute_p_value(df: pd.DataFrame, test: str, best_dist,
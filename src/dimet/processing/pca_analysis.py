@@ -80,12 +80,13 @@ def pca_on_split_dataset(compartment_df: pd.DataFrame,
     """
     assert len(metadata_co_df['compartment'].unique()) == 1
     assert chosen_column in ["condition", "timepoint"]
-    unique_nominal_values = metadata_co_df[chosen_column].unique().tolist()
+    # rows of each value of the column, in one pass
+    rows_by_value = metadata_co_df.groupby(chosen_column, sort=False,
+                                           observed=True).indices
     pca_tables_dict = {}
-    for cond_or_timepoint in unique_nominal_values:
+    for cond_or_timepoint, rows in rows_by_value.items():
         # example of cond_or_timepoint : 'T0'
-        metadata_co_ct_df = metadata_co_df.loc[
-            metadata_co_df[chosen_column] == cond_or_timepoint, :]
+        metadata_co_ct_df = metadata_co_df.iloc[rows]
         df = compartment_df[metadata_co_ct_df['name_to_plot']]
         df = handle_nan_values_before_pca(df)
         df = reduce_data_df(df)
@@ -142,19 +143,17 @@ def run_pca_analysis(file_name: data_files_keys_type,
     """
     assert_literal(file_name, data_files_keys_type, "file name")
 
-    metadata_df = dataset.metadata_df
-
     pca_results_dict = dict()
 
     impute_value = cfg.analysis.method.impute_values[file_name]
     for compartment, compartmentalized_df in \
-            dataset.compartmentalized_dfs[file_name].items():
+            dataset.get_compartmentalized_dfs(file_name).items():
         df = compartmentalized_df
         df = df[(df.T != 0).any()]  # delete rows being zero all values
         val_instead_zero = arg_repl_zero2value(impute_value, df)
         df = df.replace(to_replace=0, value=val_instead_zero)
 
-        metadata_co_df = metadata_df[metadata_df['compartment'] == compartment]
+        metadata_co_df = dataset.get_metadata_rows(compartment=compartment)
 
         pca_compartment_dict = pca_global_compartment_dataset(
             df, metadata_co_df, description=[file_name, compartment]
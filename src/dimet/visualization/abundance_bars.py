@@ -241,8 +241,8 @@ def run_plot_abundance_bars(dataset: Dataset, out_plot_dir,
     for compartment in compartments:
         metadata_compartment_df: pd.DataFrame = \
             metadata_df.loc[metadata_df['compartment'] == compartment, :]
-        compartment_df = dataset.compartmentalized_dfs[
-            "abundances"][compartment]
+        compartment_df = dataset.get_compartmentalized_dfs(
+            "abundances")[compartment]
         # metadata and abundances: slice of timepoints of interest
         metadata_slice = metadata_compartment_df.loc[
                          metadata_compartment_df[
@@ -2,13 +2,12 @@ import logging
 import operator
 import os
 from functools import reduce
-from typing import List
+from typing import Dict, List, Union
 
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import scipy.stats as stats
 from omegaconf import DictConfig
 
 from dimet.constants import (assert_literal, availtest_methods_type,
@@ -59,56 +58,48 @@ def plot_best_fit(data, dist_str, pdf, out_file) -> None:
     logger.info(f"saved plot to {out_file}")
 
 
-def find_best_distribution_to_plot(df: pd.DataFrame, out_file):
+def find_best_distribution_to_plot(df: pd.DataFrame, out_file,
+                                   fit_settings: Union[Dict, None] = None):
     """
     Find the best distribution among all the scipy.stats distributions
     and return it together with its parameters
+    (fits are shared with the differential analysis through the cache)
     """
     logger.info("Fitting a distribution")
     dist = np.around(np.array((df["zscore"]).astype(float)), 5)
 
-    best_dist, best_dist_name, best_fit_params = get_best_fit_to_plot(
-        dist, out_file)
+    fit = get_best_fit_to_plot(dist, out_file, fit_settings)
 
-    logger.info(f"Best fit is {best_dist_name} with {best_fit_params}")
-    args_param = dict(e.split("=") for e in best_fit_params.split(", "))
-    for k, v in args_param.items():
-        args_param[k] = float(v)
-
-    best_distribution = getattr(stats, best_dist_name)
-    q_val = best_dist.ppf(0.95, **args_param)
+    logger.info(f"Best fit is {fit.name} with {fit.param_str}")
+    args_param = fit.args_param
+    q_val = fit.distribution.ppf(0.95, **args_param)
     logger.info(f"And the q value is {q_val}")
-    return best_distribution, args_param
+    return fit.distribution, args_param
 
 
-def get_best_fit_to_plot(input_array, out_file):
+def get_best_fit_to_plot(input_array, out_file,
+                         fit_settings: Union[Dict, None] = None):
     matplotlib.rcParams["figure.figsize"] = (16.0, 12.0)
     matplotlib.style.use("ggplot")
-    """Return the best fit distribution to data and its parameters"""
+    """Return the best fit distribution to data (with its parameters)"""
 
+    if fit_settings is None:
+        fit_settings = dict()
     # Load data
     data = pd.Series(input_array)
 
     # Find best fit distribution
-    best_fit_name, best_fit_params = \
-        fit_statistical_distribution.best_fit_distribution(data, None, 200)
-
-    best_dist = getattr(stats, best_fit_name)
+    fit = fit_statistical_distribution.best_fit_distribution(
+        data, None, 200, **fit_settings)
 
     # Make probability density function (PDF) with best params
-    pdf = make_pdf(best_dist, best_fit_params)
-
-    # parameters
-    param_names = (best_dist.shapes + ", loc, scale").split(", ") if \
-        best_dist.shapes else ["loc", "scale"]
-    param_str = ", ".join(["{}={:0.2f}".format(k, v) for k, v
-                           in zip(param_names, best_fit_params)])
+    pdf = make_pdf(fit.distribution, fit.params)
 
     # Display
-    dist_str = '{} ({})'.format(best_fit_name, param_str)
+    dist_str = '{} ({})'.format(fit.name, fit.param_str)
     plot_best_fit(data, dist_str, pdf, out_file)
 
-    return best_dist, best_fit_name, param_str
+    return fit
 
 
 def run_dist_fit_plot_pairwise(
@@ -122,7 +113,7 @@ def run_dist_fit_plot_pairwise(
     assert test == "disfit"
     conditions_list = first_column_for_column_values(
         df=dataset.metadata_df, columns=cfg.analysis.method.grouping,
-        values=comparison
+        values=comparison, metadata_index=dataset.get_metadata_index()
     )
     # flatten the list of lists and select the subset of column names
     # present in the sub dataframe
@@ -134,6 +125,7 @@ def run_dist_fit_plot_pairwise(
     df4c = df4c[(df4c.T != 0).any()]  # delete rows being zero everywhere
     df4c = df4c.dropna(axis=0, how="all")
     df4c = row_wise_nanstd_reduction(df4c)
+    df4c = df4c.round(decimals=6)  # as in the differential analysis
     df4c = countnan_samples(df4c, this_comparison)
 
     df4c = calculate_gmean(df4c, this_comparison)
@@ -142,7 +134,9 @@ def run_dist_fit_plot_pairwise(
 
     df_good = fit_statistical_distribution.compute_z_score(df_good, "FC")
 
-    find_best_distribution_to_plot(df_good, out_file_path)
+    find_best_distribution_to_plot(
+        df_good, out_file_path,
+        fit_settings=fit_statistical_distribution.get_fit_settings(cfg))
 
 
 def run_distr_fit_plot(
@@ -159,7 +153,7 @@ def run_distr_fit_plot(
 
     impute_value = cfg.analysis.method.impute_values[file_name]
     for compartment, compartmentalized_df in \
-            dataset.compartmentalized_dfs[file_name].items():
+            dataset.get_compartmentalized_dfs(file_name).items():
         df = compartmentalized_df
         df = df[(df.T != 0).any()]
         val_instead_zero = arg_repl_zero2value(impute_value,
@@ -5,7 +5,7 @@
 """
 import logging
 import os
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import matplotlib
 import matplotlib.patches as mpatches
@@ -15,6 +15,7 @@ import numpy as np
 import pandas as pd
 import seaborn as sns
 from dimet.data import Dataset
+from dimet.helpers import index_isotopologues
 from hydra.core.config_store import ConfigStore
 from omegaconf import DictConfig
 
@@ -63,17 +64,24 @@ def isotopologue_proportions_2piled_df(
     return piled_df
 
 
-def massage_isotopologues(piled_df) -> pd.DataFrame:
+def massage_isotopologues(
+        piled_df, isotopologue_index: Optional[pd.DataFrame] = None
+) -> pd.DataFrame:
     """
     returns dataframe splitting metabolite and m+x into two separate columns
     and also correcting weird values
+    isotopologue_index: the names parsed once (see index_isotopologues in
+    helpers), otherwise parsed here
     """
-    tmp_df = piled_df['isotopologue_name'].str.split("_m+",
-                                                     expand=True, regex=False)
-    tmp_df.rename(columns={0: 'name', 1: 'm+x'}, inplace=True)
-    piled_df["metabolite"] = tmp_df["name"]
-    piled_df["m+x"] = tmp_df["m+x"]
-    piled_df["m+x"] = "m+" + tmp_df["m+x"].astype(str)
+    if isotopologue_index is None:
+        isotopologue_index = index_isotopologues(
+            piled_df['isotopologue_name'])
+    positions = isotopologue_index.index.get_indexer(
+        piled_df['isotopologue_name'])
+    piled_df["metabolite"] = \
+        isotopologue_index["metabolite"].to_numpy()[positions]
+    piled_df["m+x"] = (
+        "m+" + isotopologue_index["m+x"].astype(str)).to_numpy()[positions]
 
     # dealing with weird values: bigger than 100 and less than 0 :
     piled_df.loc[
@@ -101,7 +109,7 @@ def prepare_means_replicates(piled_df, metaboli_selected) -> Dict:
     dfcopy = piled_df.copy()
     # instead groupby isotopologue_name, using m+x and metabolite works better
     dfcopy = dfcopy.groupby(
-        ["condition", "metabolite", "m+x", "timenum"]) \
+        ["condition", "metabolite", "m+x", "timenum"], observed=True) \
         .mean("Isotopologue Contribution (%)")  # df.mean skips nan by default
 
     dfcopy["Isotopologue Contribution (%)"] = np.around(
@@ -109,12 +117,15 @@ def prepare_means_replicates(piled_df, metaboli_selected) -> Dict:
         decimals=6
     )
     dfcopy = dfcopy.reset_index()
+    # set m+x as numeric to avoid any bad reordering of stacked m+x
+    # (each distinct 'm+x' label parsed once)
+    mx_numbers = {mx: int(mx.split("m+")[1])
+                  for mx in dfcopy["m+x"].unique()}
+    dfcopy["m+x"] = dfcopy["m+x"].map(mx_numbers).astype(int)
+    metabolites_rows = dfcopy.groupby("metabolite", sort=False).indices
     dfs_dict = dict()
     for i in metaboli_selected:
-        tmp = dfcopy.loc[dfcopy["metabolite"] == i, ].reset_index(drop=True)
-        # set m+x as numeric to avoid any bad reordering of stacked m+x
-        tmp["m+x"] = tmp["m+x"].str.split("m+", regex=False).str[1]
-        tmp["m+x"] = tmp["m+x"].astype(int)
+        tmp = dfcopy.take(metabolites_rows.get(i, [])).reset_index(drop=True)
 
         dfs_dict[i] = tmp
     return dfs_dict
@@ -127,7 +138,8 @@ def add_combined_conditime(dfs_dict: Dict,
     """
     for metab in dfs_dict.keys():
         dfs_dict[metab]["time_and_condition"] = \
-            dfs_dict[metab]["timenum"] + " : " + dfs_dict[metab]["condition"]
+            dfs_dict[metab]["timenum"] + " : " + \
+            dfs_dict[metab]["condition"].astype(str)
 
         dfs_dict[metab]["time_and_condition"] = pd.Categorical(
             dfs_dict[metab]["time_and_condition"],
@@ -476,12 +488,13 @@ def run_isotopologue_proportions_plot(dataset: Dataset,
         str(i) for i in sorted(metadata_df['timenum'].unique())]
 
     compartments = list(metadata_df['compartment'].unique())
+    isotopologue_index = dataset.get_isotopologue_index()
 
     for compartment in compartments:
         metadata_compartment_df: pd.DataFrame = \
             metadata_df.loc[metadata_df['compartment'] == compartment, :]
-        compartment_df = dataset.compartmentalized_dfs[
-            "isotopologue_proportions"][compartment]
+        compartment_df = dataset.get_compartmentalized_dfs(
+            "isotopologue_proportions")[compartment]
 
         # metadata, isotopologues and time of interest
         time_metadata_df = metadata_compartment_df.loc[
@@ -492,7 +505,7 @@ def run_isotopologue_proportions_plot(dataset: Dataset,
         piled_df = isotopologue_proportions_2piled_df(time_compartment_df,
                                                       time_metadata_df)
         # values now are in %
-        piled_df = massage_isotopologues(piled_df)
+        piled_df = massage_isotopologues(piled_df, isotopologue_index)
         compartment_metabolites = metabolites[compartment]
         dfs_dict = prepare_means_replicates(piled_df, compartment_metabolites)
 
@@ -507,7 +520,8 @@ def run_isotopologue_proportions_plot(dataset: Dataset,
                     cond_time_metadata['name_to_plot']]
                 piled_df = isotopologue_proportions_2piled_df(
                     condition_df, cond_time_metadata)
-                piled_df = massage_isotopologues(piled_df)
+                piled_df = massage_isotopologues(piled_df,
+                                                 isotopologue_index)
                 dfs_dict = prepare_means_replicates(
                     piled_df, compartment_metabolites)
                 dfs_dict = add_categorical_time(dfs_dict, time_levels_list)
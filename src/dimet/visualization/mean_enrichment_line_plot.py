@@ -75,10 +75,13 @@ def metabolite_df__mean_and_sd(
     df = one_metabolite_df.copy()
     df = df.drop_duplicates()
     # by default both std and mean in pandas ignore NaN
-    mean_df = df.groupby(["condition", "timenum", "metabolite"])[
+    # observed=True: no rows for the unused categories of the condition
+    mean_df = df.groupby(["condition", "timenum", "metabolite"],
+                         observed=True)[
         "Fractional Contribution (%)"].mean().reset_index(name="mean")
     # std by pandas : ddof=0 to have same result as with numpy std
-    std_df = df.groupby(["condition", "timenum", "metabolite"])[
+    std_df = df.groupby(["condition", "timenum", "metabolite"],
+                        observed=True)[
         "Fractional Contribution (%)"].std(ddof=0).reset_index(name="sd")
 
     one_metabolite_result = mean_df.merge(std_df, how='inner',
@@ -389,7 +392,8 @@ def line_plot_by_compartment(dataset: Dataset,
 
     for co in compartments:
         metadata_co_df = metadata_df.loc[metadata_df['compartment'] == co, :]
-        compartment_df = dataset.compartmentalized_dfs["mean_enrichment"][co]
+        compartment_df = dataset.get_compartmentalized_dfs(
+            "mean_enrichment")[co]
 
         melted_co_df = melt_data_metadata_2df(compartment_df, metadata_co_df)
         melted_co_df["condition"] = pd.Categorical(
@@ -36,7 +36,8 @@ def get_differential_results_dict(file_name: str,
                                   compartment: str
                                   ) -> Dict[int, pd.DataFrame]:
     impute_value = cfg.analysis.method.impute_values[file_name]
-    df = data_integration.compartmentalized_dfs[file_name][compartment]
+    df = data_integration.get_compartmentalized_dfs(
+        file_name)[compartment]
 
     df = df[(df.T != 0).any()]
     val_instead_zero = arg_repl_zero2value(impute_value, df)
@@ -51,6 +51,11 @@ def pca_scatter_plot(pc_df: pd.DataFrame,
     """
     returns the scatter plot (a seaborn matplotlib figure)
     """
+    # categorical metadata (compact_dtypes) would add its unused categories
+    # to the legend: the values are plotted in order of appearance instead
+    pc_df = pc_df.astype({
+        column: object for column in {col1, col2}
+        if isinstance(pc_df[column].dtype, pd.CategoricalDtype)})
     fig, ax = plt.subplots()
     sns.scatterplot(x="PC1", y="PC2",
                     ax=ax,
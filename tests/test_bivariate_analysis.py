@@ -1,9 +1,13 @@
+import filecmp
+import os
+import tempfile
 from unittest import TestCase
 
 import numpy as np
 import pandas as pd
-from scipy import stats
+from omegaconf import OmegaConf
 
+from dimet.data import DatasetConfig
 from dimet.processing import bivariate_analysis
 
 
@@ -53,22 +57,10 @@ class TestBivariateAnalysis(TestCase):
         #  1    [5.468089, 4.09878, 1.8, 9.3]  [4.091455, 7.668116, 6.5, 7.6]}
         self.assertTrue(list(result.keys())[0] == 'metabo_time_profile')
         self.assertListEqual(
-            result['metabo_time_profile'].iloc[0, 1].tolist(),
+            result['metabo_time_profile'].gmean_arr_1.array(0).tolist(),
             [5.468089, 4.494441, 2.993326, 7.846018])
-
-    def test_modify_gmean_by_sanity(self):
-        df = pd.DataFrame({'A-T0-1': [4.6, np.nan],
-                           'A-T0-2': [6.5, np.nan],
-                           'A-T0-3': [np.nan, 2]})
-        df.index = ["metabolite1", "metabolite2"]
-        df = df.assign(gmean=df.apply(lambda x: stats.gmean(x.dropna()),
-                                      axis=1))
-        # df.gmean.to_numpy() :  [5.46808925,  2. ]
-        result = bivariate_analysis.modify_gmean_by_sanity(df)
-        # result : [5.46808925, nan] np array
-        self.assertFalse(np.all(df["gmean"].to_numpy() == result))
-        self.assertAlmostEqual(result[0], 5.46808925, places=5)
-        self.assertTrue(np.isnan(result[1]))
+        self.assertListEqual(
+            result['metabo_time_profile'].gmean_arr_2.lengths.tolist(), [4, 4])
 
     def test_inner_gmean_dict_filler(self):
         k = 0
@@ -97,20 +89,23 @@ class TestBivariateAnalysis(TestCase):
         #                 array([0.103228, 0.199331, 0.286392, 0.409919])]}
         self.assertTrue(np.allclose(np.array(
             [0.189454, 0.302643, 0.50658]),
-            result['gmean_arr_1'][0], rtol=1e-6))
+            result['gmean_arr_1'].array(0), rtol=1e-6))
         self.assertTrue(np.allclose(np.array(
             [0.103228, 0.199331, 0.286392, 0.409919]),
-            result['gmean_arr_1'][1], rtol=1e-6))
+            result['gmean_arr_1'].array(1), rtol=1e-6))
+        self.assertListEqual(result['gmean_arr_1'].lengths.tolist(), [3, 4])
 
     def test_compute_test_for_df_dict(self):
-        df = pd.DataFrame({
-            'metabolite': ['CoA', 'Ala'],
-            'gmean_arr_1': [np.array([0.1894, 0.3026, 0.506]),
-                            np.array([0.1032, 0.1993, 0.2863, 0.4099])],
-            'gmean_arr_2': [np.array([0.506, 0.3026, 0.1894]),
-                            np.array([0.4099, 0.2863, 0.1993, 0.1032])],
-        })
-        df_dict = {'T0': df}  # df comparing two conditions A vs B, at T0
+        gmean_arrays = bivariate_analysis.GmeanArrays(
+            metabolite=['CoA', 'Ala'],
+            gmean_arr_1=bivariate_analysis.RaggedArrays.from_arrays(
+                [np.array([0.1894, 0.3026, 0.506]),
+                 np.array([0.1032, 0.1993, 0.2863, 0.4099])]),
+            gmean_arr_2=bivariate_analysis.RaggedArrays.from_arrays(
+                [np.array([0.506, 0.3026, 0.1894]),
+                 np.array([0.4099, 0.2863, 0.1993, 0.1032])]))
+        # arrays comparing two conditions A vs B, at T0
+        df_dict = {'T0': gmean_arrays}
         test = "pearson"
         result = bivariate_analysis.compute_test_for_df_dict(df_dict, test)
         self.assertEqual('T0', list(result.keys())[0])
@@ -120,16 +115,17 @@ class TestBivariateAnalysis(TestCase):
         )
 
     def test_compute_statistical_correlation(self):
-        df = pd.DataFrame({
-            'metabolite': ['CoA', 'Ala'],
-            'gmean_arr_1': [np.array([0.1894, 0.3026, 0.506]),
-                            np.array([0.1032, 0.1993, 0.2863, 0.4099])],
-            'gmean_arr_2': [np.array([0.506, 0.3026, 0.1894]),
-                            np.array([0.4099, 0.2863, 0.1993, 0.1032])],
-        })
-        df.index = ['CoA', 'Ala']
+        gmean_arrays = bivariate_analysis.GmeanArrays(
+            metabolite=['CoA', 'Ala'],
+            gmean_arr_1=bivariate_analysis.RaggedArrays.from_arrays(
+                [np.array([0.1894, 0.3026, 0.506]),
+                 np.array([0.1032, 0.1993, 0.2863, 0.4099])]),
+            gmean_arr_2=bivariate_analysis.RaggedArrays.from_arrays(
+                [np.array([0.506, 0.3026, 0.1894]),
+                 np.array([0.4099, 0.2863, 0.1993, 0.1032])]))
         test = "pearson"
-        result = bivariate_analysis.compute_statistical_correlation(df, test)
+        result = bivariate_analysis.compute_statistical_correlation(
+            gmean_arrays, test)
 
         self.assertAlmostEqual(result.loc['CoA', 'correlation_coefficient'],
                                -0.947312, places=5)
@@ -139,3 +135,87 @@ class TestBivariateAnalysis(TestCase):
                                -0.992587, places=5)
         self.assertAlmostEqual(result.loc['Ala', 'pvalue'],
                                0.007413, places=5)
+
+    def test_ragged_arrays(self):
+        arrays = bivariate_analysis.RaggedArrays.from_arrays(
+            [np.array([0.1, 0.25]), np.array([0.5, np.nan, 1.0]),
+             np.array([0.2, 0.3])])
+        self.assertListEqual(arrays.offsets.tolist(), [0, 2, 5, 7])
+        self.assertListEqual(arrays.lengths.tolist(), [2, 3, 2])
+        self.assertListEqual(arrays.array(1)[[0, 2]].tolist(), [0.5, 1.0])
+        self.assertListEqual(
+            arrays.rows_of_length(np.array([0, 2]), 2).tolist(),
+            [[0.1, 0.25], [0.2, 0.3]])
+        self.assertListEqual(arrays.to_strings(),
+                             ['[0.1 0.25]', '[0.5 nan 1.0]', '[0.2 0.3]'])
+        # arrays of different lengths are not paired
+        gmean_arrays = bivariate_analysis.GmeanArrays(
+            ['A', 'B', 'C'], arrays,
+            bivariate_analysis.RaggedArrays.from_matrix(
+                [[0.3, 0.2, 0.1], [0.5, 0.4, 0.1], [0.1, 0.2, 0.3]]))
+        result = bivariate_analysis.compute_statistical_correlation(
+            gmean_arrays, "spearman")
+        self.assertTrue(result[
+            ['correlation_coefficient', 'pvalue']].loc[['A', 'C']].isna(
+            ).all(axis=None))
+        self.assertTrue(np.isnan(result.loc['B', 'correlation_coefficient']))
+
+    def test_schedule_bivariate_comparisons(self):
+        rng = np.random.default_rng(0)
+        samples = [f"{c}-{t}-{r}" for c in ['ctl', 'trt']
+                   for t in ['T0', 'T1'] for r in range(3)]
+        metadata = pd.DataFrame({
+            'name_to_plot': samples,
+            'condition': ['ctl'] * 6 + ['trt'] * 6,
+            'timepoint': (['T0'] * 3 + ['T1'] * 3) * 2,
+            'timenum': ([0] * 3 + [1] * 3) * 2,
+            'compartment': ['cell'] * 12})
+        isotopologues = [f"{m}_m+{x}" for m, n in
+                         [('Cit', 4), ('Lac', 3), ('Pyr', 2)]
+                         for x in range(n)]
+        with tempfile.TemporaryDirectory() as out_dir:
+            dataset = DatasetConfig(
+                label="d", name="d", subfolder=out_dir, metadata="m",
+                conditions=OmegaConf.create(['ctl', 'trt'])).build()
+            dataset.sub_folder_absolute = out_dir
+            dataset.metadata_df = metadata
+            dataset.compartmentalized_dfs = {
+                'isotopologue_proportions': {'cell': pd.DataFrame(
+                    rng.random((len(isotopologues), 12)),
+                    index=isotopologues, columns=samples)},
+                'abundances': {'cell': pd.DataFrame(
+                    rng.lognormal(size=(5, 12)),
+                    index=[f"met{i}" for i in range(5)], columns=samples)}}
+            behaviors_by_file = {
+                'isotopologue_proportions': ['conditions_MDV_comparison',
+                                             'timepoints_MDV_comparison'],
+                'abundances': ['conditions_metabolite_time_profiles']}
+            written = dict()
+            for n_jobs in [1, 2]:
+                cfg = OmegaConf.create({'analysis': {
+                    'conditions': ['ctl', 'trt'],
+                    'method': {
+                        'correction_method': 'fdr_bh',
+                        'output_include_gmean_arr_columns': True,
+                        'impute_values': {'abundances': 'min',
+                                          'isotopologue_proportions': 'min'},
+                        'conditions_MDV_comparison': {
+                            'isotopologue_proportions': 'spearman'},
+                        'timepoints_MDV_comparison': {
+                            'isotopologue_proportions': 'pearson'},
+                        'conditions_metabolite_time_profiles': {
+                            'abundances': 'spearman'},
+                        'n_jobs': n_jobs}}})
+                out_table_dir = os.path.join(out_dir, str(n_jobs))
+                os.makedirs(out_table_dir)
+                written[n_jobs] = \
+                    bivariate_analysis.schedule_bivariate_comparisons(
+                        behaviors_by_file, dataset, cfg, out_table_dir)
+            # 2 time points + 2 conditions (MDV), 1 time profiles
+            self.assertEqual(len(written[1]), 5)
+            self.assertListEqual(
+                [os.path.basename(f) for f in written[1]],
+                [os.path.basename(f) for f in written[2]])
+            for serial_file, parallel_file in zip(written[1], written[2]):
+                self.assertTrue(filecmp.cmp(serial_file, parallel_file,
+                                            shallow=False))
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+from omegaconf import OmegaConf
+
+from dimet.data import DatasetConfig
+
+
+def write_dataset_files(folder: str) -> None:
+    metadata = pd.DataFrame({
+        'name_to_plot': ['Ct-cell-1', 'Ct-cell-2', 'Tr-cell-1', 'Tr-cell-2',
+                         'Ct-med-1', 'Tr-med-1'],
+        'condition': ['Ct', 'Ct', 'Tr', 'Tr', 'Ct', 'Tr'],
+        'timepoint': ['1h'] * 6,
+        'timenum': [1] * 6,
+        'short_comp': ['cell'] * 4 + ['med'] * 2,
+        'compartment': ['cell'] * 4 + ['med'] * 2,
+        'original_name': ['s1', 's2', 's3', 's4', 's5', 's6']})
+    metadata.to_csv(os.path.join(folder, "metadata.tsv"), sep="\t",
+                    index=False)
+    abundances = pd.DataFrame(
+        np.arange(18, dtype=float).reshape(3, 6),
+        columns=metadata['original_name'])
+    abundances.insert(0, 'ID', ['Cit', 'Lac', 'Pyr'])
+    abundances.iloc[2, 5:] = np.nan
+    abundances.to_csv(os.path.join(folder, "AbundanceCorrected.tsv"),
+                      sep="\t", index=False)
+
+
+class TestDataset(TestCase):
+
+    def build_dataset(self, folder: str, datatypes=None, **config):
+        dataset = DatasetConfig(
+            label="test", name="test", subfolder=folder,
+            metadata="metadata", conditions=OmegaConf.create(['Ct', 'Tr']),
+            **config).build()
+        dataset.sub_folder_absolute = folder
+        dataset.preload(datatypes=datatypes)
+        dataset.split_datafiles_by_compartment()
+        return dataset
+
+    def test_preload_cache(self):
+        with tempfile.TemporaryDirectory() as folder:
+            write_dataset_files(folder)
+            dataset = self.build_dataset(folder, cache_dir="cache")
+            self.assertFalse(dataset.loaded_from_cache)
+            folder_names = os.listdir(os.path.join(folder, "cache"))
+            self.assertEqual(len(folder_names), 1)
+            # no pickle: .npy matrices and plain data
+            self.assertListEqual(
+                sorted(os.listdir(os.path.join(folder, "cache",
+                                               folder_names[0]))),
+                ["abundances.npy", "abundances.npy.json", "dataset.json"])
+
+            cached = self.build_dataset(folder, cache_dir="cache")
+            self.assertTrue(cached.loaded_from_cache)
+            self.assertSetEqual(cached.available_datasets,
+                                {"metadata", "abundances"})
+            pd.testing.assert_frame_equal(cached.metadata_df,
+                                          dataset.metadata_df)
+            pd.testing.assert_frame_equal(cached.abundances_df,
+                                          dataset.abundances_df)
+            for compartment in ["cell", "med"]:
+                pd.testing.assert_frame_equal(
+                    cached.compartmentalized_dfs["abundances"][compartment],
+                    dataset.compartmentalized_dfs["abundances"][compartment])
+            self.assertListEqual(
+                list(cached.compartmentalized_dfs["abundances"]["med"].index),
+                ["Cit", "Lac"])
+
+            # a modified input file rebuilds the cache, replacing the old one
+            # but not the caches of the other datasets
+            others = ["test-2-" + "0" * 64, "test-raw"]
+            for folder_name in others:
+                os.makedirs(os.path.join(folder, "cache", folder_name))
+                open(os.path.join(folder, "cache", folder_name,
+                                  "dataset.json"), "w").close()
+            path = os.path.join(folder, "AbundanceCorrected.tsv")
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            rebuilt = self.build_dataset(folder, cache_dir="cache")
+            self.assertFalse(rebuilt.loaded_from_cache)
+            file_names = os.listdir(os.path.join(folder, "cache"))
+            self.assertEqual(len(file_names), 3)
+            self.assertTrue(set(others) < set(file_names))
+
+    def test_preload_cache_dtypes(self):
+        with tempfile.TemporaryDirectory() as folder:
+            write_dataset_files(folder)
+            abundances = pd.read_csv(
+                os.path.join(folder, "AbundanceCorrected.tsv"), sep="\t")
+            abundances["s1"] = [1, 2, 3]  # int64 and float64 columns
+            abundances.to_csv(os.path.join(folder, "AbundanceCorrected.tsv"),
+                              sep="\t", index=False)
+            for compact_dtypes in [False, True]:
+                dataset = self.build_dataset(folder, cache_dir="cache",
+                                             compact_dtypes=compact_dtypes)
+                cached = self.build_dataset(folder, cache_dir="cache",
+                                            compact_dtypes=compact_dtypes)
+                self.assertTrue(cached.loaded_from_cache)
+                pd.testing.assert_frame_equal(cached.metadata_df,
+                                              dataset.metadata_df)
+                pd.testing.assert_frame_equal(cached.abundances_df,
+                                              dataset.abundances_df)
+                for compartment in ["cell", "med"]:
+                    pd.testing.assert_frame_equal(
+                        cached.compartmentalized_dfs["abundances"][
+                            compartment],
+                        dataset.compartmentalized_dfs["abundances"][
+                            compartment])
+
+    def test_preload_files_errors(self):
+        with tempfile.TemporaryDirectory() as folder:
+            write_dataset_files(folder)
+            # missing files are skipped
+            dataset = self.build_dataset(folder)
+            self.assertIsNone(dataset.isotopologues_df)
+            self.assertEqual(dataset.abundances_df.shape, (3, 6))
+            # a file that can not be parsed aborts
+            with open(os.path.join(folder, "Isotopologues.tsv"), "w") as f:
+                f.write("ID\ts1\nCit_m+0\t1\t2\t3\n")
+            self.assertRaises(pd.errors.ParserError, self.build_dataset,
+                              folder)
+
+    def test_preload_compressed_files(self):
+        with tempfile.TemporaryDirectory() as folder:
+            write_dataset_files(folder)
+            path = os.path.join(folder, "AbundanceCorrected.tsv")
+            expected = pd.read_csv(path, sep="\t", header=0, index_col=0)
+            pd.read_csv(path, sep="\t").to_csv(path + ".gz", sep="\t",
+                                               index=False)
+            os.remove(path)
+            dataset = self.build_dataset(folder)
+            self.assertEqual(dataset.get_files_extension_as_dict()[
+                                 'abundances'], "tsv.gz")
+            pd.testing.assert_frame_equal(dataset.abundances_df, expected)
+
+    def test_preload_compact_dtypes(self):
+        with tempfile.TemporaryDirectory() as folder:
+            write_dataset_files(folder)
+            default = self.build_dataset(folder)
+            compact = self.build_dataset(folder, compact_dtypes=True)
+            self.assertTrue((compact.abundances_df.dtypes ==
+                             np.float32).all())
+            self.assertEqual(compact.abundances_df.index.name, "ID")
+            pd.testing.assert_frame_equal(
+                compact.abundances_df.astype(float), default.abundances_df)
+            self.assertIsInstance(compact.metadata_df["condition"].dtype,
+                                  pd.CategoricalDtype)
+            self.assertEqual(compact.metadata_df["name_to_plot"].dtype,
+                             default.metadata_df["name_to_plot"].dtype)
+            self.assertListEqual(
+                list(compact.compartmentalized_dfs["abundances"]["med"]),
+                list(default.compartmentalized_dfs["abundances"]["med"]))
+
+    def test_preload_chunk_rows(self):
+        with tempfile.TemporaryDirectory() as folder:
+            write_dataset_files(folder)
+            default = self.build_dataset(folder)
+            abundances = pd.read_csv(
+                os.path.join(folder, "AbundanceCorrected.tsv"), sep="\t")
+            abundances['other'] = 1.0
+            abundances.loc[3] = ['Ala'] + [np.nan] * 6 + [1.0]
+            abundances.to_csv(os.path.join(folder, "AbundanceCorrected.tsv"),
+                              sep="\t", index=False)
+            dataset = self.build_dataset(folder, chunk_rows=2)
+            pd.testing.assert_frame_equal(dataset.abundances_df,
+                                          default.abundances_df)
+            for compartment in ["cell", "med"]:
+                pd.testing.assert_frame_equal(
+                    dataset.compartmentalized_dfs["abundances"][compartment],
+                    default.compartmentalized_dfs["abundances"][compartment])
+
+    def test_preload_memmap(self):
+        with tempfile.TemporaryDirectory() as folder:
+            write_dataset_files(folder)
+            in_memory = self.build_dataset(folder)
+            # only the outdated maps of this dataset are removed
+            siblings = {"test-" + "0" * 64: ["abundances.npy",
+                                             "abundances.npy.json"],
+                        "test-2-" + "1" * 64: ["abundances.npy",
+                                               "abundances.npy.json"],
+                        "test-" + "2" * 64: ["notes.txt"],
+                        "test-raw": ["abundances.npy"]}
+            for folder_name, file_names in siblings.items():
+                os.makedirs(os.path.join(folder, "maps", folder_name))
+                for file_name in file_names:
+                    open(os.path.join(folder, "maps", folder_name,
+                                      file_name), "w").close()
+            for i in range(2):
+                dataset = self.build_dataset(folder, cache_dir="cache",
+                                             memmap_dir="maps")
+                self.assertFalse(dataset.loaded_from_cache)
+                self.assertSetEqual(dataset.memmapped_datasets,
+                                    {"abundances"})
+                for compartment in ["cell", "med"]:
+                    df = dataset.compartmentalized_dfs["abundances"][
+                        compartment]
+                    pd.testing.assert_frame_equal(
+                        df, in_memory.compartmentalized_dfs["abundances"][
+                            compartment])
+            maps_folder = dataset.memmap_folder
+            self.assertSetEqual(
+                set(os.listdir(os.path.join(folder, "maps"))),
+                {os.path.basename(maps_folder)} | set(list(siblings)[1:]))
+            self.assertListEqual(sorted(os.listdir(maps_folder)),
+                                 ["abundances.npy", "abundances.npy.json"])
+            # no row dropped in the cell compartment: a view into the map
+            df = dataset.compartmentalized_dfs["abundances"]["cell"]
+            base = df.to_numpy()
+            while base is not None and not isinstance(base, np.memmap):
+                base = base.base
+            self.assertIsInstance(base, np.memmap)
+            # the maps are copy-on-write
+            df.iloc[0, 0] = -1.0
+            self.assertNotEqual(np.load(os.path.join(
+                maps_folder, "abundances.npy")).min(), -1.0)
+
+    def test_preload_datatypes(self):
+        with tempfile.TemporaryDirectory() as folder:
+            write_dataset_files(folder)
+            abundances = pd.read_csv(
+                os.path.join(folder, "AbundanceCorrected.tsv"), sep="\t")
+            abundances.to_csv(os.path.join(folder, "MeanEnrichment13C.tsv"),
+                              sep="\t", index=False)
+            for i in range(2):  # without then with the cache
+                dataset = self.build_dataset(folder, ["abundances"],
+                                             cache_dir="cache")
+                self.assertEqual(dataset.loaded_from_cache, i == 1)
+                if i == 0:
+                    self.assertSetEqual(dataset.available_datasets,
+                                        {"metadata", "abundances"})
+                    self.assertIsNone(dataset.mean_enrichment_df)
+                else:  # cached after the first access
+                    self.assertSetEqual(dataset.deferred_datasets,
+                                        {"isotopologue_proportions",
+                                         "isotopologues"})
+                # read and split at the first access
+                mean_enrichment = dataset.get_compartmentalized_dfs(
+                    "mean_enrichment")
+                self.assertIn("mean_enrichment", dataset.available_datasets)
+                pd.testing.assert_frame_equal(
+                    mean_enrichment["cell"],
+                    dataset.get_compartmentalized_dfs("abundances")["cell"])
+                self.assertRaises(KeyError,
+                                  dataset.get_compartmentalized_dfs,
+                                  "isotopologues")
@@ -1,10 +1,17 @@
+import filecmp
+import os
+import tempfile
 from unittest import TestCase
 
 import numpy as np
 import pandas as pd
+from omegaconf import OmegaConf
 from scipy import stats
 
-from dimet.helpers import countnan_samples
+from dimet.data import DatasetConfig
+from dimet.helpers import (absolute_geommean_diff,
+                           compute_brunnermunzel_allH0,
+                           compute_ranksums_allH0, countnan_samples)
 from dimet.processing import differential_analysis
 
 
@@ -85,6 +92,88 @@ class TestDifferentialAnalysis(TestCase):
             result.loc[result['metabolite'] == "met3", "pvalue"].item(),
             0.436360, 6)
 
+    def test_compute_statistical_test_matrix(self):
+        values_interest = np.array([[15, 8, 11, np.nan],
+                                    [310, 2, 70, 12],
+                                    [1, 1, 3, 4]], dtype=float)
+        values_baseline = np.array([[9, 3, np.nan, 6],
+                                    [100, 5, 4, 1],
+                                    [2, 2, 5, np.nan]], dtype=float)
+        for test in ["MW", "Tt", "KW", "ranksum", "BrMu"]:
+            stat, pvalue = differential_analysis.\
+                compute_statistical_test_matrix(values_interest,
+                                                values_baseline, test)
+            for i in range(values_interest.shape[0]):
+                a1 = values_interest[i][~np.isnan(values_interest[i])]
+                a2 = values_baseline[i][~np.isnan(values_baseline[i])]
+                if test == "MW":
+                    expected = differential_analysis.\
+                        compute_mann_whitney_allH0(a1, a2)
+                elif test == "Tt":
+                    expected = stats.ttest_ind(a1, a2)
+                elif test == "KW":
+                    expected = stats.kruskal(a1, a2)
+                elif test == "ranksum":
+                    expected = compute_ranksums_allH0(a1, a2)
+                else:
+                    expected = compute_brunnermunzel_allH0(a1, a2)
+                self.assertAlmostEqual(stat[i], expected[0], 12)
+                self.assertAlmostEqual(pvalue[i], expected[1], 12)
+
+    def test_compute_statistical_test_matrix_wcox(self):
+        def scipy_wilcoxon_all_h0(a1, a2):
+            results = [stats.wilcoxon(a1, a2, alternative=alternative)
+                       for alternative in ["less", "greater", "two-sided"]]
+            return min([r for r in results if not np.isnan(r[1])],
+                       key=lambda r: r[1])
+
+        rng = np.random.default_rng(0)
+        for n in [6, 20]:  # exact or sign flips, exact or asymptotic
+            values_baseline = rng.normal(10, 2, size=(4, n))
+            values_interest = values_baseline + rng.normal(0.5, 1, (4, n))
+            values_interest[1, 0] = values_baseline[1, 0]  # a zero
+            values_baseline[2, :2] = 10  # tied differences
+            values_interest[2, :2] = 11.5
+            values_interest[3, 1] = np.nan  # in both groups: still paired
+            values_baseline[3, 1] = np.nan
+            stat, pvalue = differential_analysis.\
+                compute_statistical_test_matrix(values_interest,
+                                                values_baseline, "Wcox")
+            for i in range(values_interest.shape[0]):
+                a1 = values_interest[i][~np.isnan(values_interest[i])]
+                a2 = values_baseline[i][~np.isnan(values_baseline[i])]
+                expected = scipy_wilcoxon_all_h0(a1, a2)
+                self.assertAlmostEqual(stat[i], expected[0], 12)
+                self.assertAlmostEqual(pvalue[i], expected[1], 12)
+        # paired test: groups of different sizes are an error, as in scipy
+        values_interest[0, 0] = np.nan
+        self.assertRaises(ValueError,
+                          differential_analysis.
+                          compute_statistical_test_matrix,
+                          values_interest, values_baseline, "Wcox")
+
+    def test_compute_permutation_test_matrix(self):
+        values_interest = np.array([[15, 8, 11], [310, 2, 70]], dtype=float)
+        values_baseline = np.array([[9, 3, 0, 6], [100, 5, 4, 1]],
+                                   dtype=float)
+        # 35 partitions: exact test, as scipy permutation_test
+        stat, pvalue = differential_analysis.compute_permutation_test_matrix(
+            values_interest, values_baseline, n_resamples=9999, seed=1)
+        for i in range(2):
+            expected = stats.permutation_test(
+                (values_interest[i], values_baseline[i]),
+                statistic=absolute_geommean_diff,
+                permutation_type="independent", alternative="greater")
+            self.assertAlmostEqual(stat[i], expected.statistic, 12)
+            self.assertAlmostEqual(pvalue[i], expected.pvalue, 12)
+        # random resamples are reproducible with the seed
+        pvalue_1 = differential_analysis.compute_permutation_test_matrix(
+            values_interest, values_baseline, n_resamples=20, seed=1)[1]
+        pvalue_2 = differential_analysis.compute_permutation_test_matrix(
+            values_interest, values_baseline, n_resamples=20, seed=1)[1]
+        self.assertTrue(np.array_equal(pvalue_1, pvalue_2))
+        self.assertTrue(all(pvalue_1 >= 1 / 21))
+
     def test_auto_detect_tailway(self):
         data = {'zscore': np.random.laplace(loc=0.0, scale=1.6, size=500)}
         df = pd.DataFrame(data)
@@ -151,3 +240,43 @@ class TestDifferentialAnalysis(TestCase):
         self.assertListEqual(result[1], [['cond1', '3h'], ['cond1', '2.7h']])
         self.assertListEqual(result[2], [['cond2', '3h'], ['cond2', '2.7h']])
         self.assertListEqual(result[3], [['cond1', '2.7h'], ['cond1', '1h']])
+
+    def test_schedule_pairwise_comparisons(self):
+        rng = np.random.default_rng(0)
+        metadata = pd.DataFrame({
+            'name_to_plot': [f"{c}-{t}-{r}" for c in ['ctl', 'trt']
+                             for t in ['T0', 'T1'] for r in range(3)],
+            'condition': ['ctl'] * 6 + ['trt'] * 6,
+            'timepoint': (['T0'] * 3 + ['T1'] * 3) * 2,
+            'compartment': ['cell'] * 12})
+        dataset = DatasetConfig(
+            label="d", name="d", subfolder="/tmp", metadata="m",
+            conditions=OmegaConf.create(['ctl', 'trt'])).build()
+        dataset.metadata_df = metadata
+        compartment_dfs = {
+            co: pd.DataFrame(rng.lognormal(size=(30, 12)),
+                             columns=metadata['name_to_plot'])
+            for co in ['cell', 'med']}
+        comparisons = [[['trt', 'T0'], ['ctl', 'T0']],
+                       [['trt', 'T1'], ['ctl', 'T1']],
+                       [['ctl', 'T1'], ['ctl', 'T0']]]
+        with tempfile.TemporaryDirectory() as out_dir:
+            written = dict()
+            for n_jobs in [1, 2]:
+                cfg = OmegaConf.create({'analysis': {'method': {
+                    'grouping': ['condition', 'timepoint'],
+                    'qualityDistanceOverSpan': -0.3,
+                    'correction_method': 'fdr_bh', 'n_jobs': n_jobs}}})
+                out_table_dir = os.path.join(out_dir, str(n_jobs))
+                os.makedirs(out_table_dir)
+                written[n_jobs] = \
+                    differential_analysis.schedule_pairwise_comparisons(
+                        compartment_dfs, comparisons, dataset, cfg, "MW",
+                        "abundances", out_table_dir)
+            self.assertEqual(len(written[1]), 6)
+            self.assertListEqual(
+                [os.path.basename(f) for f in written[1]],
+                [os.path.basename(f) for f in written[2]])
+            for serial_file, parallel_file in zip(written[1], written[2]):
+                self.assertTrue(filecmp.cmp(serial_file, parallel_file,
+                                            shallow=False))
@@ -4,6 +4,8 @@
 @author: Johanna Galvis, Florian Specque, Macha Nikolski
 """
 
+import os
+import tempfile
 from unittest import TestCase
 
 import numpy as np
@@ -42,27 +44,77 @@ class TestFitStatisticalDistribution(TestCase):
         data = {'zscore': np.random.laplace(loc=0.0, scale=1.6, size=500)}
         df = pd.DataFrame(data)
         MYDISTRIBUTIONS = [stats.laplace, stats.johnsonsu, stats.pareto]
-        name, params = fit_statistical_distribution.best_fit_distribution(
+        fit = fit_statistical_distribution.best_fit_distribution(
             df, MYDISTRIBUTIONS, bins=200
         )
-        self.assertIsInstance(name, str)
-        self.assertTrue(name in ['laplace', 'johnsonsu'])
+        self.assertIsInstance(fit.name, str)
+        self.assertTrue(fit.name in ['laplace', 'johnsonsu'])
+        self.assertTrue(fit.sse > 0)
+        self.assertTrue(fit.fit_time >= 0)
+        params = fit.params
         self.assertAlmostEqual(params[0], -0.0257, places=3)
         self.assertAlmostEqual(params[1], 1.03437, places=3)
         self.assertAlmostEqual(params[2], -0.0834, places=3)
         self.assertAlmostEqual(params[3], 1.5379, places=3)
 
+    def test_best_fit_distribution_cache(self):
+        data = np.around(np.random.default_rng(0).normal(size=300), 5)
+        MYDISTRIBUTIONS = [stats.norm, stats.laplace]
+        fit_cache_key = fit_statistical_distribution.fit_cache_key
+        with tempfile.TemporaryDirectory() as cache_dir:
+            fit = fit_statistical_distribution.best_fit_distribution(
+                data, MYDISTRIBUTIONS, bins=50, cache_dir=cache_dir)
+            key = fit_cache_key(data, MYDISTRIBUTIONS, 50)
+            self.assertTrue(os.path.isfile(
+                os.path.join(cache_dir, f"{key}.json")))
+            # other candidates or bins are other fits
+            self.assertNotEqual(key, fit_cache_key(data, MYDISTRIBUTIONS, 40))
+            self.assertNotEqual(key,
+                                fit_cache_key(data, MYDISTRIBUTIONS[:1], 50))
+            # a new process only finds the fit on disk
+            fit_statistical_distribution.fit_cache.clear()
+            cached = fit_statistical_distribution.read_cached_fit(
+                key, cache_dir)
+            self.assertEqual(cached, fit)
+            self.assertIn(key, fit_statistical_distribution.fit_cache)
+
+    def test_search_best_fit(self):
+        data = np.around(np.random.default_rng(1).laplace(size=300), 5)
+        MYDISTRIBUTIONS = [stats.norm, stats.laplace, stats.johnsonsu]
+        serial, timed_out = fit_statistical_distribution.search_best_fit(
+            data, MYDISTRIBUTIONS, 100)
+        self.assertListEqual(timed_out, [])
+        parallel, _ = fit_statistical_distribution.search_best_fit(
+            data, MYDISTRIBUTIONS, 100, n_jobs=2)
+        self.assertEqual(serial.name, parallel.name)
+        self.assertTupleEqual(serial.params, parallel.params)
+        # a candidate exceeding its time budget is discarded
+        _, timed_out = fit_statistical_distribution.search_best_fit(
+            data, [stats.norm, stats.recipinvgauss], 100, timeout=0.05)
+        self.assertListEqual(timed_out, ['recipinvgauss'])
+
+    def test_get_distributions_list(self):
+        all_distributions = \
+            fit_statistical_distribution.get_distributions_list()
+        fast = fit_statistical_distribution.get_distributions_list("fast")
+        self.assertTrue(0 < len(fast) < len(all_distributions))
+        self.assertTrue(set(fast).issubset(set(all_distributions)))
+        self.assertIn(stats.norm, fast)
+
     def test_get_best_fit(self):
         data = {'zscore': np.random.laplace(loc=0.0, scale=1.6, size=500)}
         df = pd.DataFrame(data)
         dist = np.around(np.array((df["zscore"]).astype(float)), 5)
         MYDISTRIBUTIONS = [stats.laplace, stats.norm,
                            stats.johnsonsu, stats.pareto]
-        best_dist, best_dist_name, best_fit_params = \
-            fit_statistical_distribution.get_best_fit(dist,
-                                                      MYDISTRIBUTIONS)
-        self.assertTrue(best_dist_name in ['laplace', 'johnsonsu'])
-        self.assertIsInstance(best_fit_params, str)
+        fit = fit_statistical_distribution.get_best_fit(dist,
+                                                        MYDISTRIBUTIONS)
+        self.assertTrue(fit.name in ['laplace', 'johnsonsu'])
+        self.assertIs(fit.distribution, getattr(stats, fit.name))
+        # parameters by name, at full precision; rounded only in param_str
+        self.assertListEqual(list(fit.args_param.values()),
+                             [float(p) for p in fit.params])
+        self.assertIsInstance(fit.param_str, str)
 
     def test_find_best_distribution(self):
         data = {'zscore': np.random.laplace(loc=0.0, scale=1.6, size=500)}
@@ -4,6 +4,8 @@
 @author: Johanna Galvis, Florian Specque, Macha Nikolski
 """
 
+import os
+import tempfile
 from unittest import TestCase
 
 from dimet.helpers import (df_to_dict_by_compartment,
@@ -12,14 +14,27 @@ from dimet.helpers import (df_to_dict_by_compartment,
                            row_wise_nanstd_reduction,
                            concatenate_dataframes,
                            compute_gmean_nonan,
+                           row_wise_nangmean,
                            apply_multi_group_kruskal_wallis,
+                           kruskal_wallis_rows,
+                           correlation_rows, index_isotopologues,
                            countnan_samples, compute_padj,
+                           compute_wilcoxon_allH0,
+                           compute_distance_between_intervals,
+                           span_of_groups, extfind,
+                           index_folder_files,
+                           drop_all_nan_metabolites_on_comp_frames,
+                           set_samples_names,
+                           split_samples_by_compartment,
+                           index_metadata, metadata_rows,
                            verify_metadata_sample_not_duplicated)
 
 import numpy as np
 
 import pandas as pd
 
+from scipy import stats
+
 
 class TestHelpers(TestCase):
     def test_df_to_dict_bycomp(self):
@@ -124,6 +139,32 @@ class TestHelpers(TestCase):
         self.assertAlmostEqual(gmean1, 2.514, 2)
         self.assertAlmostEqual(gmean2, np.finfo(float).eps)
 
+    def test_row_wise_nangmean(self):
+        values = np.array([[4.6, 6.5, np.nan, 2],
+                           [np.nan, np.nan, 2, 8],
+                           [np.nan, 0, np.nan, np.nan],
+                           [np.nan, np.nan, np.nan, np.nan]])
+        result = row_wise_nangmean(values)
+        self.assertAlmostEqual(result[0], stats.gmean([4.6, 6.5, 2]), 12)
+        self.assertEqual(result[1], 4)
+        self.assertEqual(result[2], 0)
+        self.assertTrue(np.isnan(result[3]))
+        # by group of columns, with a minimum of 2 no-NaN values
+        result = row_wise_nangmean(values, groups=[[0, 1], [2, 3]],
+                                   min_valid=2)
+        self.assertEqual(result.shape, (4, 2))
+        self.assertAlmostEqual(result[0, 0], stats.gmean([4.6, 6.5]), 12)
+        self.assertTrue(np.isnan(result[0, 1]))
+        self.assertTrue(np.isnan(result[1, 0]))
+        self.assertEqual(result[1, 1], 4)
+        # min_valid=2 (bivariate analysis): the geometric mean of a group
+        # needs 2 samples with values, a single value gives NaN
+        result = row_wise_nangmean(np.array([[4.6, 6.5, np.nan],
+                                             [np.nan, np.nan, 2]]),
+                                   min_valid=2)
+        self.assertAlmostEqual(result[0], stats.gmean([4.6, 6.5]), 12)
+        self.assertTrue(np.isnan(result[1]))
+
     def test_first_column_for_column_values(self):
         data = {
             "Name": ["Alice", "Bob", "Charlie", "Dave"],
@@ -172,6 +213,58 @@ class TestHelpers(TestCase):
                                     np.array([0.56, 0.56, 0.32, 0.07, 0.14]),
                                     2))
 
+    def test_kruskal_wallis_rows(self):
+        # ties, NaN, an empty group and identical values
+        values = np.array([[1, 2, 2, 5, np.nan, 3, 3, 7],
+                           [0.5, np.nan, 0.1, 0.9, 0.4, 0.4, np.nan, 1.2],
+                           [1, 2, np.nan, np.nan, np.nan, 4, 5, 6],
+                           [1, 1, 1, 1, 1, 1, 1, 1]])
+        sizes = [3, 2, 3]
+        stat, pvalue = kruskal_wallis_rows(values, sizes)
+        for i in range(2):
+            expected = stats.kruskal(values[i, :3], values[i, 3:5],
+                                     values[i, 5:], nan_policy='omit')
+            self.assertAlmostEqual(stat[i], expected[0], 12)
+            self.assertAlmostEqual(pvalue[i], expected[1], 12)
+        self.assertTrue(np.isnan(pvalue[2:]).all())
+        self.assertRaises(ValueError, kruskal_wallis_rows, values, [8])
+
+    def test_compute_wilcoxon_allH0(self):
+        # exact, sign flips (ties and zeros) and asymptotic methods
+        x_exact = np.array([[1.1, 2.3, 3.2, 4.7, 5.1],
+                            [3.3, 2.1, 0.5, 4.8, 1.9]])
+        y_exact = np.array([[0.5, 0.9, 2.2, 3.1, 6.4],
+                            [1.2, 0.3, 0.7, 2.2, 0.4]])
+        x_ties = np.array([[1, 2, 3, 4, 5], [3, 2, 2, 7, 1]], dtype=float)
+        y_ties = np.array([[1, 1, 2, 3, 6], [1, 3, 1, 2, 2]], dtype=float)
+        rng = np.random.default_rng(0)
+        x_large = np.round(rng.normal(size=(2, 20)), 1)
+        y_large = np.round(rng.normal(size=(2, 20)), 1)
+        for x, y in [(x_exact, y_exact), (x_ties, y_ties),
+                     (x_large, y_large)]:
+            stat, pvalue = compute_wilcoxon_allH0(x, y)
+            for i in range(x.shape[0]):
+                results = [stats.wilcoxon(x[i], y[i], alternative=a)
+                           for a in ["less", "greater", "two-sided"]]
+                best = min(results, key=lambda r: r[1])
+                self.assertAlmostEqual(stat[i], best[0], 12)
+                self.assertAlmostEqual(pvalue[i], best[1], 12)
+                # single rows give the same result
+                self.assertAlmostEqual(
+                    compute_wilcoxon_allH0(x[i], y[i])[1], best[1], 12)
+
+    def test_compute_distance_between_intervals(self):
+        g1 = np.array([[1, 2, np.nan], [1, 5, 6], [np.nan, 2, 3]])
+        g2 = np.array([[4, 6, 9], [3, 4, np.nan], [5, np.nan, 8]])
+        distance = compute_distance_between_intervals(g1, g2, "symmetric")
+        self.assertTrue(np.array_equal(distance, [2, -1, 2]))
+        distance = compute_distance_between_intervals(g1, g2, "asymmetric")
+        self.assertTrue(np.array_equal(distance, [2, -3, 2]))
+        self.assertEqual(
+            compute_distance_between_intervals(g1[1], g2[1], "symmetric"), -1)
+        span = span_of_groups(g1, g2)
+        self.assertTrue(np.array_equal(span, [8, 5, 6]))
+
     def test_compute_padj(self):
         data = {
             'pvalue': [0.01, 0.02, np.nan, 0.03, 0.04],
@@ -193,3 +286,120 @@ class TestHelpers(TestCase):
         self.assertRaises(ValueError,
                           verify_metadata_sample_not_duplicated,
                           metadata)
+
+    def test_index_folder_files(self):
+        with tempfile.TemporaryDirectory() as folder:
+            for name in ["metadata.tsv", "Abund.csv", "Isotop.tsv.gz",
+                         "Enrich.csv.gz", "Enrich.tsv", "notes.txt"]:
+                open(os.path.join(folder, name), "w").close()
+            os.mkdir(os.path.join(folder, "cache.tsv"))
+            files_index = index_folder_files(folder)
+            self.assertDictEqual(files_index, {
+                "metadata": "tsv", "Abund": "csv", "Isotop": "tsv.gz",
+                "Enrich": "tsv"})
+            self.assertEqual(extfind(folder, "Isotop"), "tsv.gz")
+            self.assertEqual(extfind(folder, "notes", files_index), "csv")
+            # names with a sub-path, not in the index of the top level
+            os.mkdir(os.path.join(folder, "transcripts"))
+            open(os.path.join(folder, "transcripts", "DEG_A.tsv"),
+                 "w").close()
+            self.assertEqual(extfind(folder, "transcripts/DEG_A",
+                                     files_index), "tsv")
+            self.assertEqual(extfind(folder, "transcripts/DEG_B",
+                                     files_index), "csv")
+
+    def test_split_samples_by_compartment(self):
+        metadata = pd.DataFrame({
+            'original_name': ['s1', 's2', 's3', 's4', 's5'],
+            'name_to_plot': ['cell-1', 'cell-2', 'med-1', 'med-2', 'cell-3'],
+            'compartment': ['cell', 'cell', 'med', 'med', 'cell']})
+        df = pd.DataFrame(np.arange(20, dtype=float).reshape(4, 5),
+                          index=['Cit', 'Lac', 'Pyr', 'Glc'],
+                          columns=['s1', 's2', 's3', 's4', 's5'])
+        df.iloc[1, [2, 3]] = np.nan
+        for data in [df, df.astype({'s1': int})]:
+            frames = {'x': df_to_dict_by_compartment(data, metadata)}
+            frames = drop_all_nan_metabolites_on_comp_frames(frames,
+                                                             metadata)
+            expected = set_samples_names(frames, metadata)['x']
+            result = split_samples_by_compartment(data, metadata)
+            self.assertListEqual(list(result.keys()), ['cell', 'med'])
+            for compartment in expected.keys():
+                pd.testing.assert_frame_equal(result[compartment],
+                                              expected[compartment])
+        # samples already grouped by compartment: views, no copy
+        metadata = metadata.sort_values('compartment')
+        sorted_df = df[metadata['original_name']]
+        result = split_samples_by_compartment(sorted_df, metadata)
+        self.assertListEqual(list(result['med'].index), ['Cit', 'Pyr', 'Glc'])
+        self.assertTrue(np.shares_memory(result['cell'].to_numpy(),
+                                         sorted_df.to_numpy()))
+
+    def test_index_metadata(self):
+        metadata = pd.DataFrame({
+            'name_to_plot': ['s1', 's2', 's3', 's4', 's5', 's6'],
+            'condition': ['Ct', 'Tr', 'Ct', 'Tr', 'Ct', 'Ct'],
+            'timepoint': ['T0', 'T0', 'T1', 'T1', 'T0', 'T0'],
+            'compartment': ['cell', 'cell', 'cell', 'cell', 'med', 'cell']})
+        metadata_index = index_metadata(metadata)
+        self.assertEqual(len(metadata_index), 5)
+        self.assertListEqual(
+            metadata_rows(metadata_index, 'cell', 'Ct', 'T0').tolist(),
+            [0, 5])
+        self.assertListEqual(
+            metadata_rows(metadata_index, condition='Ct').tolist(),
+            [0, 2, 4, 5])
+        self.assertListEqual(
+            metadata_rows(metadata_index, compartment='cell',
+                          timepoint='T1').tolist(), [2, 3])
+        self.assertEqual(len(metadata_rows(metadata_index, 'med', 'Tr')), 0)
+        # as the row-wise masks
+        columns = ['condition', 'timepoint']
+        values = [['Ct', 'T0'], ['Tr', 'T1'], ['Tr', 'T5']]
+        self.assertListEqual(
+            first_column_for_column_values(metadata, columns, values,
+                                           metadata_index=metadata_index),
+            first_column_for_column_values(metadata, columns, values))
+        # columns absent from the metadata
+        metadata_index = index_metadata(metadata.drop(columns='compartment'))
+        self.assertListEqual(
+            metadata_rows(metadata_index, condition='Tr').tolist(), [1, 3])
+
+    def test_correlation_rows(self):
+        arrays_1 = [np.array([0.1, 0.5, 0.2, 0.9]), np.array([0.3, 0.1]),
+                    np.array([0.2, np.nan, 0.4]), np.array([0.5]),
+                    np.array([0.4, 0.4, 0.4]), np.array([0.1, 0.6, 0.3])]
+        arrays_2 = [np.array([0.2, 0.4, 0.4, 0.7]), np.array([0.1, 0.2]),
+                    np.array([0.1, 0.2, 0.3]), np.array([0.5]),
+                    np.array([0.1, 0.2, 0.3]), np.array([-0.1, -0.6, -0.3])]
+        # rows padded with NaN
+        valid = np.arange(4) < np.array([[len(a)] for a in arrays_1])
+        x = np.full(valid.shape, np.nan)
+        y = np.full(valid.shape, np.nan)
+        x[valid] = np.concatenate(arrays_1)
+        y[valid] = np.concatenate(arrays_2)
+        for method, test in [("pearson", stats.pearsonr),
+                             ("spearman", stats.spearmanr)]:
+            coefficients, pvalues = correlation_rows(x, y, valid, method)
+            for i, (a, b) in enumerate(zip(arrays_1, arrays_2)):
+                if len(a) < 2 or np.isnan(a).any() or (a == a[0]).all():
+                    self.assertTrue(np.isnan(coefficients[i]))
+                    self.assertTrue(np.isnan(pvalues[i]))
+                    continue
+                expected = test(a, b)
+                self.assertAlmostEqual(coefficients[i], expected[0], 12)
+                np.testing.assert_allclose(pvalues[i], expected[1])
+
+    def test_index_isotopologues(self):
+        isotopologue_index = index_isotopologues(
+            ['Lac_m+1', 'Cit_m+10', 'Cit_m+2', 'Lac_m+0', 'Cit_m+0',
+             'Cit_m+2'])
+        self.assertListEqual(
+            isotopologue_index.index.tolist(),
+            ['Cit_m+0', 'Cit_m+2', 'Cit_m+10', 'Lac_m+0', 'Lac_m+1'])
+        self.assertListEqual(isotopologue_index['metabolite'].tolist(),
+                             ['Cit', 'Cit', 'Cit', 'Lac', 'Lac'])
+        self.assertListEqual(isotopologue_index['m+x'].tolist(),
+                             [0, 2, 10, 0, 1])
+        self.assertListEqual(isotopologue_index['metabolite_code'].tolist(),
+                             [0, 0, 0, 1, 1])
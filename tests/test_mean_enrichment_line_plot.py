@@ -0,0 +1,38 @@
+import warnings
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from dimet.visualization import mean_enrichment_line_plot
+
+
+class TestMeanEnrichmentLinePlot(TestCase):
+
+    def test_metabolite_df__mean_and_sd(self):
+        compartment_df = pd.DataFrame(
+            [[0.1, 0.3, 0.5, 0.9]], index=["Cit"],
+            columns=["A-1", "A-2", "B-1", "B-2"])
+        metadata_df = pd.DataFrame({
+            'name_to_plot': ["A-1", "A-2", "B-1", "B-2"],
+            'condition': ["A", "A", "B", "B"],
+            'timepoint': ["1h"] * 4,
+            'timenum': [1] * 4,
+            'compartment': ["cell"] * 4,
+            'original_name': ["s1", "s2", "s3", "s4"]})
+        expected = mean_enrichment_line_plot.metabolite_df__mean_and_sd(
+            mean_enrichment_line_plot.melt_data_metadata_2df(
+                compartment_df, metadata_df))
+        self.assertListEqual(list(expected["condition"]), ["A", "B"])
+        self.assertTrue(np.allclose(expected["mean"], [20, 70]))
+        self.assertTrue(np.allclose(expected["sd"], [10, 20]))
+        # categorical metadata (compact_dtypes), C has no sample
+        metadata_df["condition"] = pd.Categorical(
+            metadata_df["condition"], ["A", "B", "C"])
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", FutureWarning)
+            result = mean_enrichment_line_plot.metabolite_df__mean_and_sd(
+                mean_enrichment_line_plot.melt_data_metadata_2df(
+                    compartment_df, metadata_df))
+        pd.testing.assert_frame_equal(
+            result.astype({"condition": object}), expected)
@@ -0,0 +1,19 @@
+import subprocess
+import sys
+from unittest import TestCase
+
+
+class TestMethod(TestCase):
+
+    def test_import_without_heavy_backends(self):
+        """
+        The methods import their processing and plotting backends when
+        they run, not when dimet.method is imported
+        """
+        heavy_modules = ["matplotlib", "seaborn", "sklearn", "statsmodels",
+                         "scipy.stats"]
+        code = ("import sys, dimet.method; "
+                f"print(sorted(set({heavy_modules}) & set(sys.modules)))")
+        process = subprocess.run([sys.executable, "-c", code],
+                                 capture_output=True, text=True, check=True)
+        self.assertEqual(process.stdout.strip(), "[]")
@@ -1,6 +1,8 @@
 from unittest import TestCase
 
+import matplotlib.pyplot as plt
 import numpy as np
+import pandas as pd
 
 from dimet.visualization import pca_plot
 
@@ -19,3 +21,22 @@ class TestPcaPlot(TestCase):
         self.assertAlmostEqual(vecs[0][1],  0.099, 2)
         self.assertAlmostEqual(vecs[1][0], -0.099, 2)
         self.assertAlmostEqual(vecs[1][1], -0.995, 2)
+
+    def test_pca_scatter_plot_categorical(self):
+        pc_df = pd.DataFrame({
+            'PC1': [1.0, -1.0, 0.5, -0.5], 'PC2': [0.5, 0.2, -0.3, -0.4],
+            'name_to_plot': ["B-1", "B-2", "A-1", "A-2"],
+            'condition': pd.Categorical(["B", "B", "A", "A"],
+                                        ["A", "B", "C"]),
+            'timepoint': pd.Categorical(["1h"] * 4, ["1h", "2h"])})
+        var_explained_df = pd.DataFrame({
+            'Explained Variance %': [60.0, 40.0], 'PC': ["PC1", "PC2"]})
+        fig = pca_plot.pca_scatter_plot(pc_df, var_explained_df,
+                                        "condition", "timepoint",
+                                        labels_column="",
+                                        ellipses_column=None)
+        labels = [text.get_text()
+                  for text in fig.axes[0].get_legend().get_texts()]
+        self.assertListEqual(labels,
+                             ["condition", "B", "A", "timepoint", "1h"])
+        plt.close(fig)
@@ -0,0 +1,53 @@
+"""
+Reports the import time of the DIMet startup (python -X importtime):
+the total, the slowest modules (cumulative time), and the heavy
+backends that are imported, which must be none: the methods import
+them only when they run.
+
+    python tools/import_time.py [module] [--top N]
+"""
+import argparse
+import subprocess
+import sys
+
+heavy_modules = ["matplotlib", "seaborn", "sklearn", "statsmodels",
+                 "scipy.stats"]
+
+
+def import_times(module: str):
+    """
+    Returns the (module, cumulative microseconds, nesting level) of the
+    modules reported by python -X importtime when importing the module
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True)
+    times = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip())) // 2
+        times.append((name.strip(), int(cumulative), level))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("module", nargs="?", default="dimet.method")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    times = import_times(args.module)
+    total = sum(cumulative for _, cumulative, level in times if level == 0)
+    print(f"import {args.module}: {total / 1e6:.3f} s")
+    for name, cumulative, _ in sorted(times, key=lambda x: -x[1])[:args.top]:
+        print(f"{cumulative / 1e6:9.3f} s  {name}")
+    imported = sorted(set(heavy_modules) & {name for name, _, _ in times})
+    if imported:
+        print(f"heavy modules imported at startup: {', '.join(imported)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()